@@ -0,0 +1,100 @@
+package cmd
+
+import (
+	"context"
+	"fmt"
+	"net/http"
+	"net/http/pprof"
+	"os"
+	"os/signal"
+	"path/filepath"
+	"runtime"
+	rpprof "runtime/pprof"
+	"syscall"
+	"time"
+
+	log "github.com/sirupsen/logrus"
+
+	"github.com/crowdsecurity/cs-custom-bouncer/pkg/cfg"
+)
+
+// registerDebugHandlers serves the pprof profiles, and the execution trace
+// (/debug/pprof/trace?seconds=N), on the metrics server.
+func registerDebugHandlers(muxer *http.ServeMux) {
+	muxer.HandleFunc("/debug/pprof/", pprof.Index)
+	muxer.HandleFunc("/debug/pprof/cmdline", pprof.Cmdline)
+	muxer.HandleFunc("/debug/pprof/profile", pprof.Profile)
+	muxer.HandleFunc("/debug/pprof/symbol", pprof.Symbol)
+	muxer.HandleFunc("/debug/pprof/trace", pprof.Trace)
+}
+
+// handleProfileSignal writes a heap profile, then a CPU profile of
+// cpu_profile_duration, to profile_dir each time SIGUSR1 is received.
+func handleProfileSignal(ctx context.Context, config cfg.DebugConfig) {
+	signalChan := make(chan os.Signal, 1)
+	signal.Notify(signalChan, syscall.SIGUSR1)
+	defer signal.Stop(signalChan)
+
+	for {
+		select {
+		case <-ctx.Done():
+			return
+		case <-signalChan:
+			if err := writeProfiles(ctx, config); err != nil {
+				log.Errorf("unable to write profiles: %s", err)
+			}
+		}
+	}
+}
+
+func writeProfiles(ctx context.Context, config cfg.DebugConfig) error {
+	suffix := time.Now().Format("20060102-150405") + ".pprof"
+
+	heapPath := filepath.Join(config.ProfileDir, "heap-"+suffix)
+
+	heap, err := os.Create(heapPath)
+	if err != nil {
+		return err
+	}
+
+	// up to date statistics, like /debug/pprof/heap?gc=1
+	runtime.GC()
+
+	err = rpprof.WriteHeapProfile(heap)
+	if cerr := heap.Close(); err == nil {
+		err = cerr
+	}
+	if err != nil {
+		return fmt.Errorf("%s: %w", heapPath, err)
+	}
+
+	log.Infof("heap profile written to %s", heapPath)
+
+	cpuPath := filepath.Join(config.ProfileDir, "cpu-"+suffix)
+
+	cpu, err := os.Create(cpuPath)
+	if err != nil {
+		return err
+	}
+
+	if err := rpprof.StartCPUProfile(cpu); err != nil {
+		cpu.Close()
+		return fmt.Errorf("%s: %w", cpuPath, err)
+	}
+
+	log.Infof("writing CPU profile to %s for %s", cpuPath, config.CPUProfileDuration)
+
+	timer := time.NewTimer(config.CPUProfileDuration)
+	defer timer.Stop()
+
+	select {
+	case <-timer.C:
+	case <-ctx.Done():
+	}
+
+	rpprof.StopCPUProfile()
+
+	log.Infof("CPU profile written to %s", cpuPath)
+
+	return cpu.Close()
+}
@@ -0,0 +1,221 @@
+package cmd
+
+import (
+	"bufio"
+	"compress/gzip"
+	"context"
+	"encoding/json"
+	"errors"
+	"fmt"
+	"io"
+	"math"
+	"os"
+	"sort"
+	"strings"
+	"sync"
+	"time"
+
+	log "github.com/sirupsen/logrus"
+	"golang.org/x/sync/errgroup"
+
+	"github.com/crowdsecurity/cs-custom-bouncer/pkg/custom"
+)
+
+// replayStats collects the processing time of the batches replayed to a sink.
+type replayStats struct {
+	mu        sync.Mutex
+	latencies []time.Duration
+	decisions int
+	done      time.Time
+}
+
+func (r *replayStats) add(batch *custom.QueuedBatch) {
+	latency := time.Since(batch.Received)
+
+	r.mu.Lock()
+	defer r.mu.Unlock()
+
+	r.latencies = append(r.latencies, latency)
+	r.decisions += len(batch.Deleted) + len(batch.New)
+}
+
+// percentile returns the p-th percentile of sorted durations.
+func percentile(sorted []time.Duration, p float64) time.Duration {
+	if len(sorted) == 0 {
+		return 0
+	}
+
+	i := int(math.Ceil(p*float64(len(sorted)))) - 1
+
+	return sorted[max(i, 0)]
+}
+
+func (r *replayStats) print(w io.Writer, name string, start time.Time) {
+	r.mu.Lock()
+	defer r.mu.Unlock()
+
+	sort.Slice(r.latencies, func(i, j int) bool { return r.latencies[i] < r.latencies[j] })
+
+	elapsed := r.done.Sub(start)
+
+	fmt.Fprintf(w, "sink %s: %d decisions in %s, %.0f decisions/s\n", name, r.decisions, elapsed.Round(time.Millisecond), float64(r.decisions)/elapsed.Seconds())
+	fmt.Fprintf(w, "  batch latency: p50=%s p90=%s p99=%s max=%s\n",
+		percentile(r.latencies, 0.5).Round(time.Microsecond),
+		percentile(r.latencies, 0.9).Round(time.Microsecond),
+		percentile(r.latencies, 0.99).Round(time.Microsecond),
+		percentile(r.latencies, 1).Round(time.Microsecond))
+}
+
+// replay sends the batches recorded in path to the sinks, instead of those
+// from LAPI, and prints the throughput and latency of each sink when they're
+// done. With paced, the batches are sent at the pace they have been received,
+// otherwise as fast as the sinks take them.
+//
+// The latency of a batch is the time between its reading from the file and
+// the end of its dispatch: until the commands have completed in live mode
+// (or have been queued with max_concurrent_exec), and until the decisions
+// have been written in stdin mode. The throughput includes the replies with
+// stdin_ack. In stdin mode, the first batch is sent once all the programs
+// have been started.
+func replay(sinks []*sink, path string, paced bool) error {
+	f, err := os.Open(path)
+	if err != nil {
+		return err
+	}
+	defer f.Close()
+
+	var r io.Reader = bufio.NewReader(f)
+
+	// the rotated recordings
+	if strings.HasSuffix(path, ".gz") {
+		gz, err := gzip.NewReader(r)
+		if err != nil {
+			return fmt.Errorf("unable to read %s: %w", path, err)
+		}
+		defer gz.Close()
+		r = gz
+	}
+
+	ctx, cancel := context.WithCancel(context.Background())
+	defer cancel()
+
+	// the programs in stdin mode and the retries, until the sinks are done
+	children, childCtx := errgroup.WithContext(ctx)
+
+	for _, s := range sinks {
+		if s.config.FeedViaStdin {
+			for shard := 0; shard < s.custom.StdinWorkers(); shard++ {
+				children.Go(func() error {
+					return feedViaStdin(childCtx, s.custom, s.config, shard)
+				})
+			}
+		}
+
+		if s.config.ExecRetries > 0 && !s.config.FeedViaStdin {
+			children.Go(func() error {
+				return s.custom.RunRetryQueue(childCtx)
+			})
+		}
+	}
+
+	g, ctx := errgroup.WithContext(childCtx)
+
+	stats := make([]*replayStats, len(sinks))
+
+	for i, s := range sinks {
+		stats[i] = &replayStats{}
+		s.processed = stats[i].add
+
+		g.Go(func() error {
+			defer func() { stats[i].done = time.Now() }()
+			if err := s.run(ctx); err != nil {
+				return err
+			}
+			// the decisions are only applied when the program replies
+			deadline := time.Now().Add(s.config.StdinWriteTimeout)
+			for s.custom.Inflight() > 0 && time.Now().Before(deadline) {
+				time.Sleep(10 * time.Millisecond)
+			}
+			return nil
+		})
+	}
+
+	var start time.Time
+	batches := 0
+
+	g.Go(func() error {
+		defer func() {
+			for _, s := range sinks {
+				s.queue.Close()
+			}
+		}()
+
+		// the decisions written before the programs have started would be lost
+		for _, s := range sinks {
+			if s.config.FeedViaStdin {
+				if err := s.custom.WaitStdin(ctx); err != nil {
+					return err
+				}
+			}
+		}
+
+		start = time.Now()
+
+		decoder := json.NewDecoder(r)
+
+		var first time.Time
+
+		for {
+			var batch custom.RecordedBatch
+
+			if err := decoder.Decode(&batch); err != nil {
+				if errors.Is(err, io.EOF) {
+					return nil
+				}
+				return fmt.Errorf("unable to read %s: %w", path, err)
+			}
+
+			if paced && !batch.ReceivedAt.IsZero() {
+				if first.IsZero() {
+					first = batch.ReceivedAt
+				}
+				timer := time.NewTimer(time.Until(start.Add(batch.ReceivedAt.Sub(first))))
+				select {
+				case <-timer.C:
+				case <-ctx.Done():
+					timer.Stop()
+					return ctx.Err()
+				}
+			}
+
+			batches++
+			received := time.Now()
+
+			for _, s := range sinks {
+				if err := s.queue.Push(ctx, batch.Deleted, batch.New, received); err != nil {
+					return err
+				}
+			}
+		}
+	})
+
+	err = g.Wait()
+
+	cancel()
+
+	if cerr := children.Wait(); cerr != nil && !errors.Is(cerr, context.Canceled) && err == nil {
+		err = cerr
+	}
+
+	if err != nil {
+		return fmt.Errorf("replay failed: %w", err)
+	}
+
+	log.Infof("replayed %d batches from %s", batches, path)
+
+	for i, s := range sinks {
+		stats[i].print(os.Stdout, s.config.Name, start)
+	}
+
+	return nil
+}
@@ -11,6 +11,7 @@ import (
 	"os/exec"
 	"os/signal"
 	"strings"
+	"sync"
 	"syscall"
 	"time"
 
@@ -28,6 +29,7 @@ import (
 
 	"github.com/crowdsecurity/cs-custom-bouncer/pkg/cfg"
 	"github.com/crowdsecurity/cs-custom-bouncer/pkg/custom"
+	"github.com/crowdsecurity/cs-custom-bouncer/pkg/metrics"
 )
 
 const name = "crowdsec-custom-bouncer"
@@ -57,50 +59,167 @@ func HandleSignals(ctx context.Context) error {
 	return nil
 }
 
-func deleteDecisions(ctx context.Context, custom *custom.CustomBouncer, decisions []*models.Decision) {
+// observeLag records the dispatch lag of n decisions received at the given time.
+func observeLag(received time.Time, n int) {
+	lag := time.Since(received).Seconds()
+	for i := 0; i < n; i++ {
+		metrics.DispatchLag.Observe(lag)
+	}
+}
+
+// samplers of the per-decision debug lines
+var addedLog, deletedLog custom.LogSampler
+
+func deleteDecisions(ctx context.Context, custom *custom.CustomBouncer, pool *custom.ExecPool, decisions []*models.Decision, received time.Time) {
 	if len(decisions) == 1 {
 		log.Info("deleting 1 decision")
 	} else {
 		log.Infof("deleting %d decisions", len(decisions))
 	}
+	if custom.BatchExec() {
+		observeLag(received, len(decisions))
+		if err := custom.DeleteBatch(ctx, decisions); err != nil {
+			log.Errorf("unable to delete decisions: %s", err)
+		}
+		return
+	}
 	for _, d := range decisions {
+		if pool != nil {
+			pool.Submit("del", d, received)
+			continue
+		}
+		observeLag(received, 1)
 		if err := custom.Delete(ctx, d); err != nil {
 			log.Errorf("unable to delete decision for '%s': %s", *d.Value, err)
 			continue
 		}
-		log.Debugf("deleted '%s'", *d.Value)
+		if deletedLog.Enabled() {
+			log.Debugf("deleted '%s'", *d.Value)
+		}
 	}
 }
 
-func addDecisions(ctx context.Context, custom *custom.CustomBouncer, decisions []*models.Decision) {
+func addDecisions(ctx context.Context, custom *custom.CustomBouncer, pool *custom.ExecPool, decisions []*models.Decision, received time.Time) {
 	if len(decisions) == 1 {
 		log.Info("adding 1 decision")
 	} else {
 		log.Infof("adding %d decisions", len(decisions))
 	}
+	if custom.BatchExec() {
+		observeLag(received, len(decisions))
+		if err := custom.AddBatch(ctx, decisions); err != nil {
+			log.Errorf("unable to insert decisions: %s", err)
+		}
+		return
+	}
 	for _, d := range decisions {
+		if pool != nil {
+			pool.Submit("add", d, received)
+			continue
+		}
+		observeLag(received, 1)
 		if err := custom.Add(ctx, d); err != nil {
 			log.Errorf("unable to insert decision for '%s': %s", *d.Value, err)
 			continue
 		}
-		log.Debugf("Adding '%s' for '%s'", *d.Value, *d.Duration)
+		if addedLog.Enabled() {
+			log.Debugf("Adding '%s' for '%s'", *d.Value, *d.Duration)
+		}
+	}
+}
+
+// dispatchDecisions sends the decisions of a batch received from LAPI at the given time.
+func dispatchDecisions(ctx context.Context, custom *custom.CustomBouncer, pool *custom.ExecPool, deleted, added []*models.Decision, received time.Time) {
+	deleteDecisions(ctx, custom, pool, deleted, received)
+	addDecisions(ctx, custom, pool, added, received)
+	flushDecisions(custom)
+}
+
+// flushDecisions writes what has been buffered by the previous dispatch.
+func flushDecisions(custom *custom.CustomBouncer) {
+	if err := custom.FlushStdin(); err != nil {
+		log.Errorf("unable to write decisions to custom program: %s", err)
+	}
+	if err := custom.SyncState(); err != nil {
+		log.Errorf("unable to write state journal: %s", err)
 	}
 }
 
-func feedViaStdin(ctx context.Context, custom *custom.CustomBouncer, config *cfg.BouncerConfig) error {
+func registerMetrics() {
+	prometheus.MustRegister(csbouncer.TotalLAPICalls, csbouncer.TotalLAPIError)
+	prometheus.MustRegister(metrics.Collectors()...)
+}
+
+// feedViaStdin runs one of the stdin_workers copies of the custom program, and
+// restarts it when it exits, up to total_retries times.
+func feedViaStdin(ctx context.Context, custom *custom.CustomBouncer, config *cfg.SinkConfig, shard int) error {
+	program := "custom program"
+	if custom.StdinWorkers() > 1 {
+		program = fmt.Sprintf("custom program %d/%d", shard+1, custom.StdinWorkers())
+	}
+
 	f := func() error {
 		log.Debugf("Starting binary %s %s", config.BinPath, config.BinArgs)
 		c := exec.CommandContext(ctx, config.BinPath, config.BinArgs...)
-		s, err := c.StdinPipe()
+		// so that each copy knows the partition of the decisions it receives
+		c.Env = append(os.Environ(),
+			fmt.Sprintf("CROWDSEC_STDIN_WORKER=%d", shard),
+			fmt.Sprintf("CROWDSEC_STDIN_WORKERS=%d", custom.StdinWorkers()),
+		)
+		// use our own pipe instead of StdinPipe(), it supports write deadlines
+		r, w, err := os.Pipe()
 		if err != nil {
 			return err
 		}
-		custom.BinaryStdin = s
-		if err := c.Start(); err != nil {
+		defer w.Close()
+		c.Stdin = r
+		// with stdin_ack, the program replies on its stdout
+		var ackReader, ackWriter *os.File
+		if config.StdinAck {
+			ackReader, ackWriter, err = os.Pipe()
+			if err != nil {
+				r.Close()
+				return err
+			}
+			defer ackReader.Close()
+			c.Stdout = ackWriter
+		}
+		err = c.Start()
+		r.Close()
+		if ackWriter != nil {
+			ackWriter.Close()
+		}
+		if err != nil {
 			return err
 		}
+		stdin, err := custom.SetShardStdin(shard, w)
+		if err != nil {
+			log.Errorf("unable to replay decisions to %s: %s", program, err)
+		}
+		if ackReader != nil {
+			go func() {
+				if err := custom.ReadShardAcks(shard, ackReader); err != nil {
+					log.Errorf("unable to read replies of %s: %s", program, err)
+				}
+			}()
+		}
+
+		done := make(chan error, 1)
+		go func() {
+			done <- c.Wait()
+		}()
 
-		return c.Wait()
+		select {
+		case err := <-done:
+			return err
+		case <-stdin.Stalled():
+			log.Errorf("%s is stalled (%s), killing it", program, stdin.Err())
+			if err := c.Process.Kill(); err != nil {
+				log.Errorf("unable to kill %s: %s", program, err)
+			}
+			<-done
+			return stdin.Err()
+		}
 	}
 
 	attempt := 1
@@ -108,26 +227,208 @@ func feedViaStdin(ctx context.Context, custom *custom.CustomBouncer, config *cfg
 
 	for config.TotalRetries == -1 || attempt <= config.TotalRetries {
 		time.Sleep(delay)
+		if attempt > 1 {
+			metrics.ChildRestarts.Inc()
+		}
 		err := f()
 		switch {
 		case err == nil:
-			log.Warningf("custom program exited with no error (retry %d/%d) -- the command is not supposed to quit when using stdin", attempt, config.TotalRetries)
-		case errors.Is(err, context.Canceled):
-			log.Info("custom program terminated")
+			log.Warningf("%s exited with no error (retry %d/%d) -- the command is not supposed to quit when using stdin", program, attempt, config.TotalRetries)
+		case errors.Is(err, context.Canceled) || ctx.Err() != nil:
+			// killed by exec.CommandContext
+			log.Infof("%s terminated", program)
 			return nil
 		case config.TotalRetries == 1:
-			log.Errorf("custom program exited: %s", err)
+			log.Errorf("%s exited: %s", program, err)
 		default:
-			log.Errorf("custom program exited (retry %d/%d): %s", attempt, config.TotalRetries, err)
+			log.Errorf("%s exited (retry %d/%d): %s", program, attempt, config.TotalRetries, err)
 		}
 
 		delay = 2 * time.Second
 		attempt++
 	}
 
+	if custom.StdinWorkers() > 1 {
+		return fmt.Errorf("maximum retries exceeded for %s execution", program)
+	}
+
 	return errors.New("maximum retries exceeded for program execution")
 }
 
+// sink is a custom program, fed by its own goroutine from its own queue.
+type sink struct {
+	config *cfg.SinkConfig
+	custom *custom.CustomBouncer
+	queue  *custom.DispatchQueue
+	// called after each batch, in replay mode
+	processed func(batch *custom.QueuedBatch)
+
+	// the batches received from LAPI, waiting for room in the queue
+	mu      sync.Mutex
+	backlog []*custom.QueuedBatch
+	wake    chan struct{}
+	pending prometheus.Gauge
+}
+
+func newSink(config *cfg.SinkConfig, c *custom.CustomBouncer) *sink {
+	return &sink{
+		config:  config,
+		custom:  c,
+		queue:   c.NewDispatchQueue(),
+		wake:    make(chan struct{}, 1),
+		pending: metrics.SinkBacklog.WithLabelValues(config.Name),
+	}
+}
+
+// send hands a batch received from LAPI to the forwarding goroutine of the
+// sink. It doesn't wait: with queue_policy=block, a full queue only holds
+// back the decisions of this sink.
+func (s *sink) send(deleted, added []*models.Decision, received time.Time) {
+	s.mu.Lock()
+	s.backlog = append(s.backlog, &custom.QueuedBatch{Deleted: deleted, New: added, Received: received})
+	s.pending.Set(float64(len(s.backlog)))
+	s.mu.Unlock()
+
+	select {
+	case s.wake <- struct{}{}:
+	default:
+	}
+}
+
+// forward pushes the batches handed by send to the queue of the sink, in
+// order, until ctx is done.
+func (s *sink) forward(ctx context.Context) error {
+	for {
+		select {
+		case <-ctx.Done():
+			return ctx.Err()
+		case <-s.wake:
+		}
+
+		for {
+			s.mu.Lock()
+			if len(s.backlog) == 0 {
+				s.mu.Unlock()
+				break
+			}
+			batch := s.backlog[0]
+			s.backlog[0] = nil
+			s.backlog = s.backlog[1:]
+			s.pending.Set(float64(len(s.backlog)))
+			s.mu.Unlock()
+
+			if err := s.queue.Push(ctx, batch.Deleted, batch.New, batch.Received); err != nil {
+				return err
+			}
+		}
+	}
+}
+
+// run processes the batches queued for the sink until ctx is done, or until
+// the queue is closed and empty.
+func (s *sink) run(ctx context.Context) error {
+	config := s.config
+	custom := s.custom
+
+	log.Infof("Processing new and deleted decisions . . . (sink %s)", config.Name)
+	if config.FeedViaStdin {
+		// the first batch would be lost if written before the programs have started
+		if err := custom.WaitStdin(ctx); err != nil {
+			return err
+		}
+	}
+	pool := custom.NewExecPool(ctx)
+	coalescer := custom.NewCoalescer()
+	aggregator := custom.NewAggregator()
+	// the first batch is sent at once, then decisions are sent incrementally
+	bulkLoad := config.BulkLoad
+	cacheExpireTicker := time.NewTicker(config.CacheRetentionDuration)
+	defer cacheExpireTicker.Stop()
+	// nil unless decisions are coalesced over a time window, instead of per batch
+	var coalesceTick <-chan time.Time
+	if config.CoalesceDecisions && config.CoalesceWindow > 0 {
+		ticker := time.NewTicker(config.CoalesceWindow)
+		defer ticker.Stop()
+		coalesceTick = ticker.C
+	}
+	// nil unless decisions are deleted by the bouncer when they expire
+	var expiryTick <-chan time.Time
+	if config.LocalExpiry {
+		// the deletions are spread over the ticks, up to local_expiry_rate
+		ticker := time.NewTicker(100 * time.Millisecond)
+		defer ticker.Stop()
+		expiryTick = ticker.C
+	}
+	dispatchBatch := func(deleted, added []*models.Decision, received time.Time) {
+		deleted, added = custom.FilterDecisions(deleted, added)
+		deleted, added = aggregator.Apply(deleted, added)
+		if bulkLoad {
+			bulkLoad = false
+			observeLag(received, len(added))
+			err := custom.BulkLoad(ctx, deleted, added)
+			if err == nil {
+				return
+			}
+			log.Errorf("%s, sending decisions one by one", err)
+		}
+		// only the difference with the previous run, for the first batch
+		deleted, added = custom.Reconcile(deleted, added)
+		deleted = custom.SkipExpired(deleted)
+		if !config.CoalesceDecisions {
+			dispatchDecisions(ctx, custom, pool, deleted, added, received)
+			return
+		}
+		coalescer.Push(deleted, added)
+		if coalesceTick == nil {
+			deleted, added = coalescer.Flush()
+			dispatchDecisions(ctx, custom, pool, deleted, added, received)
+		}
+	}
+	for {
+		select {
+		case <-ctx.Done():
+			log.Infof("terminating sink %s", config.Name)
+			if pool != nil {
+				pool.Close()
+			}
+			return ctx.Err()
+		case <-s.queue.Ready():
+			batch, ok := s.queue.Pop()
+			if !ok {
+				if s.queue.Closed() {
+					// replay done, send what's left
+					if coalescer.Len() != 0 {
+						deleted, added := coalescer.Flush()
+						dispatchDecisions(ctx, custom, pool, deleted, added, coalescer.Oldest())
+					}
+					if pool != nil {
+						pool.Close()
+					}
+					return nil
+				}
+				continue
+			}
+			dispatchBatch(batch.Deleted, batch.New, batch.Received)
+			if s.processed != nil {
+				s.processed(batch)
+			}
+		case <-coalesceTick:
+			if coalescer.Len() != 0 {
+				received := coalescer.Oldest()
+				deleted, added := coalescer.Flush()
+				dispatchDecisions(ctx, custom, pool, deleted, added, received)
+			}
+		case now := <-expiryTick:
+			if expired := custom.ExpireDecisions(now); len(expired) != 0 {
+				deleteDecisions(ctx, custom, pool, expired, now)
+				flushDecisions(custom)
+			}
+		case <-cacheExpireTicker.C:
+			custom.ExpireCache()
+		}
+	}
+}
+
 func Execute() error {
 	var promServer *http.Server
 	configPath := flag.String("c", "", "path to crowdsec-custom-bouncer.yaml")
@@ -135,6 +436,8 @@ func Execute() error {
 	bouncerVersion := flag.Bool("version", false, "display version and exit")
 	testConfig := flag.Bool("t", false, "test config and exit")
 	showConfig := flag.Bool("T", false, "show full config (.yaml + .yaml.local) and exit")
+	replayFile := flag.String("replay", "", "send the batches recorded in this file instead of those from LAPI, print statistics and exit")
+	replayPaced := flag.Bool("replay-paced", false, "with -replay, send the batches at the pace they have been recorded")
 
 	flag.Parse()
 
@@ -164,19 +467,31 @@ func Execute() error {
 		return fmt.Errorf("unable to load configuration: %w", err)
 	}
 
+	defer config.Logging.FlushLogs()
+
+	custom.SetLogSampling(config.Logging.LogSampleFirst, config.Logging.LogSampleThereafter)
+
 	if *verbose && log.GetLevel() < log.DebugLevel {
 		log.SetLevel(log.DebugLevel)
 	}
 
-	custom, err := custom.NewCustomBouncer(config)
-	if err != nil {
-		return err
+	sinks := make([]*sink, 0, len(config.Sinks)+1)
+
+	for _, sinkConfig := range config.AllSinks() {
+		c, err := custom.NewCustomBouncer(sinkConfig)
+		if err != nil {
+			return fmt.Errorf("sink %s: %w", sinkConfig.Name, err)
+		}
+
+		sinks = append(sinks, newSink(sinkConfig, c))
 	}
 
 	log.Infof("Starting %s %s", name, version.String())
 
-	if err := custom.Init(); err != nil {
-		return err
+	for _, s := range sinks {
+		if err := s.custom.Init(); err != nil {
+			return fmt.Errorf("sink %s: %w", s.config.Name, err)
+		}
 	}
 
 	if *testConfig {
@@ -184,7 +499,27 @@ func Execute() error {
 		return nil
 	}
 
-	defer bouncerShutdown(custom)
+	if debug := config.PrometheusConfig.Debug; debug.ProfileDir != "" {
+		profileCtx, stopProfiling := context.WithCancel(context.Background())
+		defer stopProfiling()
+		go handleProfileSignal(profileCtx, debug)
+	}
+
+	if *replayFile != "" {
+		// no state journal, the replayed decisions are not those of LAPI
+		for _, s := range sinks {
+			defer bouncerShutdown(s.custom)
+		}
+		return replay(sinks, *replayFile, *replayPaced)
+	}
+
+	for _, s := range sinks {
+		if err := s.custom.OpenState(); err != nil {
+			return fmt.Errorf("sink %s: %w", s.config.Name, err)
+		}
+
+		defer bouncerShutdown(s.custom)
+	}
 
 	bouncer := &csbouncer.StreamBouncer{}
 	bouncer.UserAgent = fmt.Sprintf("%s/%s", name, version.String())
@@ -196,7 +531,18 @@ func Execute() error {
 	if err := bouncer.Init(); err != nil {
 		return err
 	}
-	cacheResetTicker := time.NewTicker(config.CacheRetentionDuration)
+
+	// nil unless the batches are recorded for -replay
+	var recorder *custom.Recorder
+	if config.Record.File != "" {
+		log.Infof("recording stream batches to %s", config.Record.File)
+		recorder = custom.NewRecorder(config.Record.Writer(), config.Record.BufferSize)
+		defer func() {
+			if err := recorder.Close(); err != nil {
+				log.Errorf("unable to record stream batches: %s", err)
+			}
+		}()
+	}
 
 	g, ctx := errgroup.WithContext(context.Background())
 
@@ -218,7 +564,11 @@ func Execute() error {
 			Handler: muxer,
 		}
 		muxer.Handle("/metrics", promhttp.Handler())
-		prometheus.MustRegister(csbouncer.TotalLAPICalls, csbouncer.TotalLAPIError)
+		if config.PrometheusConfig.Debug.Enabled {
+			log.Infof("Serving profiles at %s", listenOn+"/debug/pprof/")
+			registerDebugHandlers(muxer)
+		}
+		registerMetrics()
 		go func() {
 			log.Infof("Serving metrics at %s", listenOn+"/metrics")
 			if err := promServer.ListenAndServe(); err != nil && !errors.Is(err, http.ErrServerClosed) {
@@ -228,33 +578,48 @@ func Execute() error {
 		}()
 	}
 
-	if config.FeedViaStdin {
+	for _, s := range sinks {
+		if s.config.FeedViaStdin {
+			for shard := 0; shard < s.custom.StdinWorkers(); shard++ {
+				g.Go(func() error {
+					return feedViaStdin(ctx, s.custom, s.config, shard)
+				})
+			}
+		}
+
+		if s.config.ExecRetries > 0 && !s.config.FeedViaStdin {
+			g.Go(func() error {
+				return s.custom.RunRetryQueue(ctx)
+			})
+		}
+
 		g.Go(func() error {
-			return feedViaStdin(ctx, custom, config)
+			return s.forward(ctx)
+		})
+
+		g.Go(func() error {
+			return s.run(ctx)
 		})
 	}
 
 	g.Go(func() error {
-		log.Info("Processing new and deleted decisions . . .")
 		for {
 			select {
 			case <-ctx.Done():
 				log.Info("terminating bouncer process")
-				if config.PrometheusConfig.Enabled {
-					log.Info("terminating prometheus server")
-					if err := promServer.Shutdown(context.Background()); err != nil {
-						log.Errorf("unable to shutdown prometheus server: %s", err)
-					}
-				}
 				return ctx.Err()
 			case decisions := <-bouncer.Stream:
 				if decisions == nil {
 					continue
 				}
-				deleteDecisions(ctx, custom, decisions.Deleted)
-				addDecisions(ctx, custom, decisions.New)
-			case <-cacheResetTicker.C:
-				custom.ResetCache()
+				received := time.Now()
+				recorder.Record(received, decisions.Deleted, decisions.New)
+				metrics.BatchSize.WithLabelValues("deleted").Observe(float64(len(decisions.Deleted)))
+				metrics.BatchSize.WithLabelValues("new").Observe(float64(len(decisions.New)))
+				// the decisions are shared by the sinks, they must not modify them
+				for _, s := range sinks {
+					s.send(decisions.Deleted, decisions.New, received)
+				}
 			}
 		}
 	})
@@ -269,7 +634,16 @@ func Execute() error {
 		})
 	}
 
-	if err := g.Wait(); err != nil {
+	err = g.Wait()
+
+	if promServer != nil {
+		log.Info("terminating prometheus server")
+		if err := promServer.Shutdown(context.Background()); err != nil {
+			log.Errorf("unable to shutdown prometheus server: %s", err)
+		}
+	}
+
+	if err != nil {
 		return fmt.Errorf("process terminated with error: %w", err)
 	}
 
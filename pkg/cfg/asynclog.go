@@ -0,0 +1,89 @@
+package cfg
+
+import (
+	"fmt"
+	"io"
+	"os"
+	"sync"
+	"time"
+
+	"github.com/crowdsecurity/cs-custom-bouncer/pkg/metrics"
+)
+
+// asyncWriter writes the log lines from its own goroutine, so that logging
+// doesn't wait for the disk. Up to size lines can wait to be written, the next
+// ones are dropped until there's room.
+type asyncWriter struct {
+	w     io.Writer
+	lines chan []byte
+
+	mu      sync.Mutex
+	pending int
+	// broadcast when there's no line left to write
+	idle *sync.Cond
+}
+
+func newAsyncWriter(w io.Writer, size int) *asyncWriter {
+	a := &asyncWriter{
+		w:     w,
+		lines: make(chan []byte, size),
+	}
+	a.idle = sync.NewCond(&a.mu)
+
+	go a.run()
+
+	return a
+}
+
+// Write never blocks. The line is copied, logrus reuses its buffer.
+func (a *asyncWriter) Write(p []byte) (int, error) {
+	line := make([]byte, len(p))
+	copy(line, p)
+
+	a.mu.Lock()
+	defer a.mu.Unlock()
+
+	select {
+	case a.lines <- line:
+		a.pending++
+	default:
+		metrics.LogDroppedLines.WithLabelValues("buffer_full").Inc()
+	}
+
+	return len(p), nil
+}
+
+func (a *asyncWriter) run() {
+	for line := range a.lines {
+		if _, err := a.w.Write(line); err != nil {
+			fmt.Fprintf(os.Stderr, "Failed to write to log, %v\n", err)
+		}
+
+		a.mu.Lock()
+		a.pending--
+		if a.pending == 0 {
+			a.idle.Broadcast()
+		}
+		a.mu.Unlock()
+	}
+}
+
+// flush waits for the buffered lines to be written, for up to timeout.
+func (a *asyncWriter) flush(timeout time.Duration) {
+	expired := false
+
+	timer := time.AfterFunc(timeout, func() {
+		a.mu.Lock()
+		expired = true
+		a.mu.Unlock()
+		a.idle.Broadcast()
+	})
+	defer timer.Stop()
+
+	a.mu.Lock()
+	defer a.mu.Unlock()
+
+	for a.pending > 0 && !expired {
+		a.idle.Wait()
+	}
+}
@@ -0,0 +1,68 @@
+package cfg
+
+import (
+	"reflect"
+	"sync"
+	"testing"
+	"time"
+
+	"github.com/prometheus/client_golang/prometheus/testutil"
+
+	"github.com/crowdsecurity/cs-custom-bouncer/pkg/metrics"
+)
+
+// blockingWriter records the lines, once unblocked.
+type blockingWriter struct {
+	started chan struct{}
+	unblock chan struct{}
+	once    sync.Once
+	mu      sync.Mutex
+	lines   []string
+}
+
+func (w *blockingWriter) Write(p []byte) (int, error) {
+	w.once.Do(func() { close(w.started) })
+	<-w.unblock
+
+	w.mu.Lock()
+	defer w.mu.Unlock()
+	w.lines = append(w.lines, string(p))
+
+	return len(p), nil
+}
+
+func Test_AsyncWriter(t *testing.T) {
+	w := &blockingWriter{started: make(chan struct{}), unblock: make(chan struct{})}
+	a := newAsyncWriter(w, 2)
+	dropped := metrics.LogDroppedLines.WithLabelValues("buffer_full")
+	before := testutil.ToFloat64(dropped)
+
+	a.Write([]byte("a\n"))
+	// "a" is being written, the buffer holds the next 2 lines
+	<-w.started
+	for _, line := range []string{"b\n", "c\n", "d\n", "e\n"} {
+		if n, err := a.Write([]byte(line)); n != len(line) || err != nil {
+			t.Errorf("expected the write not to fail, found=%d, %v", n, err)
+		}
+	}
+
+	if n := testutil.ToFloat64(dropped) - before; n != 2 {
+		t.Errorf("expected 2 dropped lines, found=%v", n)
+	}
+
+	// the writer is stuck, flush gives up
+	start := time.Now()
+	a.flush(50 * time.Millisecond)
+	if elapsed := time.Since(start); elapsed > time.Second {
+		t.Errorf("expected flush to time out, found=%s", elapsed)
+	}
+
+	close(w.unblock)
+	a.flush(5 * time.Second)
+
+	w.mu.Lock()
+	defer w.mu.Unlock()
+	if !reflect.DeepEqual(w.lines, []string{"a\n", "b\n", "c\n"}) {
+		t.Errorf("expected the buffered lines to be written, found=%q", w.lines)
+	}
+}
@@ -5,6 +5,7 @@ import (
 	"fmt"
 	"io"
 	"os"
+	"path/filepath"
 	"time"
 
 	log "github.com/sirupsen/logrus"
@@ -14,14 +15,80 @@ import (
 )
 
 type PrometheusConfig struct {
-	Enabled       bool   `yaml:"enabled"`
-	ListenAddress string `yaml:"listen_addr"`
-	ListenPort    string `yaml:"listen_port"`
+	Enabled       bool        `yaml:"enabled"`
+	ListenAddress string      `yaml:"listen_addr"`
+	ListenPort    string      `yaml:"listen_port"`
+	Debug         DebugConfig `yaml:"debug"`
+}
+
+// DebugConfig enables the profiling of the bouncer: with pprof on the
+// metrics server, or on SIGUSR1 if profile_dir is set.
+type DebugConfig struct {
+	Enabled            bool          `yaml:"enabled"`
+	ProfileDir         string        `yaml:"profile_dir"`
+	CPUProfileDuration time.Duration `yaml:"cpu_profile_duration"`
+}
+
+// FilterRule drops the decisions that match all its conditions. The
+// conditions that are not set match any decision.
+type FilterRule struct {
+	Name             string        `yaml:"name"`
+	ScenarioRegex    string        `yaml:"scenario_regex"`
+	ScenarioContains []string      `yaml:"scenario_contains"`
+	Scopes           []string      `yaml:"scopes"`
+	Types            []string      `yaml:"types"`
+	Origins          []string      `yaml:"origins"`
+	MinDuration      time.Duration `yaml:"min_duration"` // matches the decisions that are shorter
+	CIDRs            []string      `yaml:"cidrs"`        // matches the Ip and Range decisions inside
+}
+
+// SinkConfig is the configuration of a custom program, and of how the
+// decisions are sent to it.
+type SinkConfig struct {
+	Name                   string        `yaml:"name"`
+	BinPath                string        `yaml:"bin_path"` // path to binary
+	BinArgs                []string      `yaml:"bin_args"` // arguments for binary
+	QueueSize              int           `yaml:"queue_size"`
+	QueuePolicy            string        `yaml:"queue_policy"`
+	DecisionFilters        []FilterRule  `yaml:"decision_filters"`
+	CacheRetentionDuration time.Duration `yaml:"cache_retention_duration"`
+	CacheMaxEntries        int           `yaml:"cache_max_entries"`
+	AggregateCIDRs         bool          `yaml:"aggregate_cidrs"`
+	LocalExpiry            bool          `yaml:"local_expiry"`
+	LocalExpiryRate        float64       `yaml:"local_expiry_rate"`
+	CoalesceDecisions      bool          `yaml:"coalesce_decisions"`
+	CoalesceWindow         time.Duration `yaml:"coalesce_window"`
+	FeedViaStdin           bool          `yaml:"feed_via_stdin"`
+	StdinWorkers           int           `yaml:"stdin_workers"`
+	StdinFormat            string        `yaml:"stdin_format"`
+	StdinTSVFields         []string      `yaml:"stdin_tsv_fields"`
+	StdinBufferSize        int           `yaml:"stdin_buffer_size"`
+	StdinFlushInterval     time.Duration `yaml:"stdin_flush_interval"`
+	StdinWriteTimeout      time.Duration `yaml:"stdin_write_timeout"`
+	ReplayOnRestart        bool          `yaml:"replay_on_restart"`
+	StdinAck               bool          `yaml:"stdin_ack"`
+	StdinAckWindow         int           `yaml:"stdin_ack_window"`
+	StdinAckRetries        int           `yaml:"stdin_ack_retries"`
+	StateDir               string        `yaml:"state_dir"`
+	BulkLoad               bool          `yaml:"bulk_load"`
+	BulkLoadFile           string        `yaml:"bulk_load_file"`
+	BatchExec              bool          `yaml:"batch_exec"`
+	MaxBatchSize           int           `yaml:"max_batch_size"`
+	MaxConcurrentExec      int           `yaml:"max_concurrent_exec"`
+	ExecRateLimit          float64       `yaml:"exec_rate_limit"`
+	ExecRateBurst          int           `yaml:"exec_rate_burst"`
+	ExecPriority           string        `yaml:"exec_priority"`
+	TotalRetries           int           `yaml:"total_retries"`
+	ExecRetries            int           `yaml:"exec_retries"`
+	ExecRetryBackoff       time.Duration `yaml:"exec_retry_backoff"`
+	ExecRetryMaxBackoff    time.Duration `yaml:"exec_retry_max_backoff"`
+	DeadLetterFile         string        `yaml:"dead_letter_file"`
 }
 
 type BouncerConfig struct {
-	BinPath                    string           `yaml:"bin_path"` // path to binary
-	BinArgs                    []string         `yaml:"bin_args"` // arguments for binary
+	// the sink configured at the top level, if bin_path is set
+	SinkConfig                 `yaml:",inline"`
+	Sinks                      []SinkConfig     `yaml:"sinks"`
 	PidDir                     string           `yaml:"piddir"`
 	UpdateFrequency            string           `yaml:"update_frequency"`
 	IncludeScenariosContaining []string         `yaml:"include_scenarios_containing"`
@@ -31,10 +98,23 @@ type BouncerConfig struct {
 	Logging                    LoggingConfig    `yaml:",inline"`
 	APIUrl                     string           `yaml:"api_url"`
 	APIKey                     string           `yaml:"api_key"`
-	CacheRetentionDuration     time.Duration    `yaml:"cache_retention_duration"`
-	FeedViaStdin               bool             `yaml:"feed_via_stdin"`
-	TotalRetries               int              `yaml:"total_retries"`
 	PrometheusConfig           PrometheusConfig `yaml:"prometheus"`
+	Record                     RecordConfig     `yaml:"record"`
+}
+
+// AllSinks returns the sink configured at the top level, if any, followed by those of the sinks list.
+func (c *BouncerConfig) AllSinks() []*SinkConfig {
+	ret := make([]*SinkConfig, 0, len(c.Sinks)+1)
+
+	if c.BinPath != "" {
+		ret = append(ret, &c.SinkConfig)
+	}
+
+	for i := range c.Sinks {
+		ret = append(ret, &c.Sinks[i])
+	}
+
+	return ret
 }
 
 // MergedConfig() returns the byte content of the patched configuration file (with .yaml.local).
@@ -64,23 +144,191 @@ func NewConfig(reader io.Reader) (*BouncerConfig, error) {
 		return nil, err
 	}
 
-	if config.BinPath == "" {
+	if config.PrometheusConfig.Debug.CPUProfileDuration <= 0 {
+		config.PrometheusConfig.Debug.CPUProfileDuration = 30 * time.Second
+	}
+
+	if err = config.Record.setup(); err != nil {
+		return nil, err
+	}
+
+	if config.BinPath == "" && len(config.Sinks) == 0 {
 		return nil, errors.New("bin_path is not set")
 	}
 
-	_, err = os.Stat(config.BinPath)
+	if config.BinPath != "" {
+		if config.Name == "" {
+			config.Name = "default"
+		}
+
+		if err = config.SinkConfig.setup("crowdsec-custom-bouncer.bulk"); err != nil {
+			return nil, err
+		}
+	}
+
+	for i := range config.Sinks {
+		sink := &config.Sinks[i]
+
+		if sink.Name == "" {
+			sink.Name = fmt.Sprintf("sink-%d", i+1)
+		}
+
+		if err = sink.setup("crowdsec-custom-bouncer-" + sink.Name + ".bulk"); err != nil {
+			return nil, fmt.Errorf("sink %s: %w", sink.Name, err)
+		}
+	}
+
+	names := make(map[string]bool)
+	stateDirs := make(map[string]string)
+
+	for _, sink := range config.AllSinks() {
+		if names[sink.Name] {
+			return nil, fmt.Errorf("sink name '%s' is used more than once", sink.Name)
+		}
+		names[sink.Name] = true
+
+		if sink.StateDir == "" {
+			continue
+		}
+
+		dir := filepath.Clean(sink.StateDir)
+		if other, ok := stateDirs[dir]; ok {
+			return nil, fmt.Errorf("sinks %s and %s have the same state_dir", other, sink.Name)
+		}
+		stateDirs[dir] = sink.Name
+	}
+
+	return config, nil
+}
+
+// setup checks the configuration of a sink and sets the defaults. bulkFile is
+// the name of the default bulk_load_file.
+func (c *SinkConfig) setup(bulkFile string) error {
+	if c.BinPath == "" {
+		return errors.New("bin_path is not set")
+	}
+
+	_, err := os.Stat(c.BinPath)
 	if os.IsNotExist(err) {
-		return nil, fmt.Errorf("binary '%s' doesn't exist", config.BinPath)
+		return fmt.Errorf("binary '%s' doesn't exist", c.BinPath)
 	}
 
-	if config.CacheRetentionDuration == 0 {
+	if c.CacheRetentionDuration == 0 {
 		log.Info("cache_retention_duration defaults to 10 seconds")
-		config.CacheRetentionDuration = 10 * time.Second
+		c.CacheRetentionDuration = 10 * time.Second
 	}
 
-	if config.TotalRetries == 0 {
-		config.TotalRetries = 1
+	if c.StdinWorkers < 0 {
+		return errors.New("stdin_workers can't be negative")
 	}
 
-	return config, nil
+	if c.StdinWorkers == 0 {
+		c.StdinWorkers = 1
+	}
+
+	if c.StdinBufferSize == 0 {
+		c.StdinBufferSize = 64 * 1024
+	}
+
+	if c.StdinFlushInterval == 0 {
+		c.StdinFlushInterval = time.Second
+	}
+
+	if c.StdinWriteTimeout == 0 {
+		c.StdinWriteTimeout = 30 * time.Second
+	}
+
+	if c.StdinAckWindow < 0 {
+		return errors.New("stdin_ack_window can't be negative")
+	}
+
+	if c.StdinAckWindow == 0 {
+		c.StdinAckWindow = 1000
+	}
+
+	if c.MaxBatchSize < 0 {
+		return errors.New("max_batch_size can't be negative")
+	}
+
+	if c.MaxBatchSize == 0 {
+		c.MaxBatchSize = 1000
+	}
+
+	if c.MaxConcurrentExec == 0 {
+		c.MaxConcurrentExec = 1
+	}
+
+	if c.ExecRateLimit < 0 {
+		return errors.New("exec_rate_limit can't be negative")
+	}
+
+	if c.ExecRateBurst < 0 {
+		return errors.New("exec_rate_burst can't be negative")
+	}
+
+	if c.ExecRateBurst == 0 {
+		c.ExecRateBurst = max(int(c.ExecRateLimit), 1)
+	}
+
+	switch c.ExecPriority {
+	case "":
+		c.ExecPriority = "del"
+	case "del", "add":
+	default:
+		return fmt.Errorf("unknown exec_priority '%s', must be one of: del, add", c.ExecPriority)
+	}
+
+	if c.LocalExpiryRate < 0 {
+		return errors.New("local_expiry_rate can't be negative")
+	}
+
+	if c.LocalExpiryRate == 0 {
+		c.LocalExpiryRate = 100
+	}
+
+	if c.CoalesceWindow < 0 {
+		return errors.New("coalesce_window can't be negative")
+	}
+
+	if c.BulkLoad && c.BulkLoadFile == "" {
+		dir := c.StateDir
+		if dir == "" {
+			dir = os.TempDir()
+		}
+		c.BulkLoadFile = filepath.Join(dir, bulkFile)
+	}
+
+	if c.ExecRetries < 0 {
+		return errors.New("exec_retries can't be negative")
+	}
+
+	if c.ExecRetryBackoff <= 0 {
+		c.ExecRetryBackoff = time.Second
+	}
+
+	if c.ExecRetryMaxBackoff <= 0 {
+		c.ExecRetryMaxBackoff = 5 * time.Minute
+	}
+
+	if c.QueueSize < 0 {
+		return errors.New("queue_size can't be negative")
+	}
+
+	if c.QueueSize == 0 {
+		c.QueueSize = 100
+	}
+
+	switch c.QueuePolicy {
+	case "":
+		c.QueuePolicy = "block"
+	case "block", "drop_oldest_adds", "collapse":
+	default:
+		return fmt.Errorf("unknown queue_policy '%s', must be one of: block, drop_oldest_adds, collapse", c.QueuePolicy)
+	}
+
+	if c.TotalRetries == 0 {
+		c.TotalRetries = 1
+	}
+
+	return nil
 }
@@ -22,6 +22,14 @@ type LoggingConfig struct {
 	LogMaxFiles  int        `yaml:"log_max_files,omitempty"`
 	LogMaxAge    int        `yaml:"log_max_age,omitempty"`
 	CompressLogs *bool      `yaml:"compress_logs,omitempty"`
+	// number of lines waiting to be written by a goroutine, 0 to write them synchronously
+	LogBufferSize int `yaml:"log_buffer_size"`
+	// per message and per second, the first LogSampleFirst per-decision debug lines are
+	// logged, then one in LogSampleThereafter. 0 to log them all
+	LogSampleFirst      int `yaml:"log_sample_first,omitempty"`
+	LogSampleThereafter int `yaml:"log_sample_thereafter,omitempty"`
+
+	async *asyncWriter
 }
 
 func (c *LoggingConfig) LoggerForFile(fileName string) (io.Writer, error) {
@@ -71,12 +79,22 @@ func (c *LoggingConfig) setDefaults() {
 	if c.CompressLogs == nil {
 		c.CompressLogs = ptr.Of(true)
 	}
+
+	if c.LogSampleThereafter == 0 {
+		c.LogSampleThereafter = 100
+	}
 }
 
 func (c *LoggingConfig) validate() error {
 	if c.LogMode != "stdout" && c.LogMode != "file" {
 		return errors.New("log_mode should be either 'stdout' or 'file'")
 	}
+	if c.LogBufferSize < 0 {
+		return errors.New("log_buffer_size can't be negative")
+	}
+	if c.LogSampleFirst < 0 || c.LogSampleThereafter < 0 {
+		return errors.New("log_sample_first and log_sample_thereafter can't be negative")
+	}
 	return nil
 }
 
@@ -87,28 +105,43 @@ func (c *LoggingConfig) setup(fileName string) error {
 	}
 	log.SetLevel(*c.LogLevel)
 
-	if c.LogMode == "stdout" {
-		return nil
-	}
+	var out io.Writer = os.Stderr
 
-	log.SetFormatter(&log.TextFormatter{TimestampFormat: time.RFC3339, FullTimestamp: true})
+	if c.LogMode == "file" {
+		log.SetFormatter(&log.TextFormatter{TimestampFormat: time.RFC3339, FullTimestamp: true})
 
-	logger, err := c.LoggerForFile(fileName)
-	if err != nil {
-		return err
+		logger, err := c.LoggerForFile(fileName)
+		if err != nil {
+			return err
+		}
+
+		out = logger
+
+		// keep stderr for panic/fatal, otherwise process failures
+		// won't be visible enough
+		log.AddHook(&writer.Hook{
+			Writer: os.Stderr,
+			LogLevels: []log.Level{
+				log.PanicLevel,
+				log.FatalLevel,
+			},
+		})
 	}
 
-	log.SetOutput(logger)
+	if c.LogBufferSize > 0 {
+		c.async = newAsyncWriter(out, c.LogBufferSize)
+		out = c.async
+		log.RegisterExitHandler(c.FlushLogs)
+	}
 
-	// keep stderr for panic/fatal, otherwise process failures
-	// won't be visible enough
-	log.AddHook(&writer.Hook{
-		Writer: os.Stderr,
-		LogLevels: []log.Level{
-			log.PanicLevel,
-			log.FatalLevel,
-		},
-	})
+	log.SetOutput(out)
 
 	return nil
 }
+
+// FlushLogs waits for the lines buffered with log_buffer_size to be written, for up to a second.
+func (c *LoggingConfig) FlushLogs() {
+	if c.async != nil {
+		c.async.flush(time.Second)
+	}
+}
@@ -0,0 +1,64 @@
+package cfg
+
+import (
+	"errors"
+	"io"
+
+	"gopkg.in/natefinch/lumberjack.v2"
+
+	"github.com/crowdsecurity/go-cs-lib/ptr"
+)
+
+// RecordConfig is the configuration of the recording of the stream batches, for -replay.
+type RecordConfig struct {
+	File       string `yaml:"file"`
+	MaxSize    int    `yaml:"max_size,omitempty"`
+	MaxFiles   int    `yaml:"max_files,omitempty"`
+	MaxAge     int    `yaml:"max_age,omitempty"`
+	Compress   *bool  `yaml:"compress,omitempty"`
+	BufferSize int    `yaml:"buffer_size,omitempty"`
+}
+
+// Writer returns the file to record the batches to, rotated like the logs.
+func (c *RecordConfig) Writer() io.WriteCloser {
+	// default permissions will be 0600 from lumberjack
+	return &lumberjack.Logger{
+		Filename:   c.File,
+		MaxSize:    c.MaxSize,
+		MaxBackups: c.MaxFiles,
+		MaxAge:     c.MaxAge,
+		Compress:   *c.Compress,
+	}
+}
+
+func (c *RecordConfig) setDefaults() {
+	if c.MaxSize == 0 {
+		c.MaxSize = 100
+	}
+
+	if c.MaxFiles == 0 {
+		c.MaxFiles = 10
+	}
+
+	if c.MaxAge == 0 {
+		c.MaxAge = 30
+	}
+
+	if c.Compress == nil {
+		c.Compress = ptr.Of(true)
+	}
+
+	if c.BufferSize == 0 {
+		c.BufferSize = 1000
+	}
+}
+
+func (c *RecordConfig) setup() error {
+	c.setDefaults()
+
+	if c.BufferSize < 0 {
+		return errors.New("record.buffer_size can't be negative")
+	}
+
+	return nil
+}
@@ -0,0 +1,366 @@
+package custom
+
+import (
+	"bufio"
+	"bytes"
+	"errors"
+	"fmt"
+	"io"
+	"strconv"
+	"sync"
+	"time"
+
+	log "github.com/sirupsen/logrus"
+
+	"github.com/crowdsecurity/crowdsec/pkg/models"
+
+	"github.com/crowdsecurity/cs-custom-bouncer/pkg/metrics"
+)
+
+type inflightDecision struct {
+	decision *models.Decision
+	action   string
+	key      DecisionKey
+	// the order of the write, among those of the same key
+	seq      uint64
+	sent     time.Time
+	attempts int
+	// nacked, and not written again yet: it can't be replied to
+	resending bool
+	// false for the replayed decisions, that are sent regardless of the window
+	slot bool
+}
+
+var nackLog LogSampler
+
+// ackTracker keeps the decisions written to a custom program until it replies
+// with "ack <id>" or "nack <id>" on its stdout. At most cap(window) decisions
+// can wait for a reply, the next writes block until there's room.
+//
+// The replies for the same id must come in the order the decisions were sent.
+// A nacked decision is not sent again once a newer one has been written for
+// the same key: the add and the del of a decision share the same id, and the
+// add must not be applied after the del.
+type ackTracker struct {
+	mu       sync.Mutex
+	inflight map[int64][]*inflightDecision
+	// the seq of the last decision written for each key in flight
+	latest  map[DecisionKey]uint64
+	seq     uint64
+	window  chan struct{}
+	retries int
+	timeout time.Duration
+	writer  *StdinWriter
+	resend  chan *inflightDecision
+	// closed when the program has been restarted
+	done      chan struct{}
+	closeOnce sync.Once
+	onFailure func(decision *models.Decision, action string)
+}
+
+func newAckTracker(window, retries int, timeout time.Duration, writer *StdinWriter) *ackTracker {
+	return &ackTracker{
+		inflight: make(map[int64][]*inflightDecision),
+		latest:   make(map[DecisionKey]uint64),
+		window:   make(chan struct{}, window),
+		retries:  retries,
+		timeout:  timeout,
+		writer:   writer,
+		resend:   make(chan *inflightDecision, window),
+		done:     make(chan struct{}),
+	}
+}
+
+func (t *ackTracker) close() {
+	t.closeOnce.Do(func() { close(t.done) })
+
+	t.mu.Lock()
+	defer t.mu.Unlock()
+
+	n := 0
+	for _, queue := range t.inflight {
+		n += len(queue)
+	}
+
+	metrics.StdinInflight.Sub(float64(n))
+	t.inflight = make(map[int64][]*inflightDecision)
+	t.latest = make(map[DecisionKey]uint64)
+}
+
+// acquire waits for room in the window. flush is called before waiting: the
+// program can't reply to the decisions that are still buffered.
+func (t *ackTracker) acquire(flush func() error) error {
+	select {
+	case t.window <- struct{}{}:
+		return nil
+	default:
+	}
+
+	if err := flush(); err != nil {
+		return err
+	}
+
+	timer := time.NewTimer(t.timeout)
+	defer timer.Stop()
+
+	select {
+	case t.window <- struct{}{}:
+		return nil
+	case <-timer.C:
+		err := fmt.Errorf("%w: no reply for %s with %d decisions in flight", ErrStalledConsumer, t.timeout, cap(t.window))
+		t.writer.fail(err)
+		return err
+	case <-t.writer.Stalled():
+		return t.writer.Err()
+	case <-t.done:
+		return errors.New("custom program has been restarted")
+	}
+}
+
+func (t *ackTracker) track(decision *models.Decision, action string, slot bool) {
+	t.mu.Lock()
+	defer t.mu.Unlock()
+
+	t.seq++
+	key := decisionToDecisionKey(decision)
+	t.latest[key] = t.seq
+
+	t.inflight[decision.ID] = append(t.inflight[decision.ID], &inflightDecision{
+		decision: decision,
+		action:   action,
+		key:      key,
+		seq:      t.seq,
+		sent:     time.Now(),
+		slot:     slot,
+	})
+	metrics.StdinInflight.Inc()
+}
+
+// superseded tells if a newer decision has been written for the key of d.
+// t.mu must be held.
+func (t *ackTracker) superseded(d *inflightDecision) bool {
+	return t.latest[d.key] != d.seq
+}
+
+// forget removes d from the decisions in flight, before its reply. t.mu must
+// be held.
+func (t *ackTracker) forget(d *inflightDecision) {
+	queue := t.inflight[d.decision.ID]
+	for i, q := range queue {
+		if q != d {
+			continue
+		}
+		if len(queue) == 1 {
+			delete(t.inflight, d.decision.ID)
+		} else {
+			t.inflight[d.decision.ID] = append(queue[:i:i], queue[i+1:]...)
+		}
+		break
+	}
+}
+
+func (t *ackTracker) len() int {
+	t.mu.Lock()
+	defer t.mu.Unlock()
+
+	n := 0
+	for _, queue := range t.inflight {
+		n += len(queue)
+	}
+
+	return n
+}
+
+// pop returns the oldest decision in flight with this id, that has been written.
+func (t *ackTracker) pop(id int64) *inflightDecision {
+	t.mu.Lock()
+	defer t.mu.Unlock()
+
+	for _, d := range t.inflight[id] {
+		if !d.resending {
+			t.forget(d)
+			return d
+		}
+	}
+
+	return nil
+}
+
+func (t *ackTracker) release(d *inflightDecision) {
+	t.mu.Lock()
+	if !t.superseded(d) {
+		delete(t.latest, d.key)
+	}
+	t.mu.Unlock()
+
+	metrics.StdinInflight.Dec()
+	if d.slot {
+		<-t.window
+	}
+}
+
+// handle processes a line of the program's stdout.
+func (t *ackTracker) handle(line []byte) {
+	verb, rest, _ := bytes.Cut(bytes.TrimSpace(line), []byte(" "))
+	idStr, reason, _ := bytes.Cut(rest, []byte(" "))
+
+	if !bytes.Equal(verb, []byte("ack")) && !bytes.Equal(verb, []byte("nack")) {
+		log.Debugf("custom program: %s", line)
+		return
+	}
+
+	id, err := strconv.ParseInt(string(idStr), 10, 64)
+	if err != nil {
+		log.Warningf("custom program: invalid reply '%s'", line)
+		return
+	}
+
+	d := t.pop(id)
+	if d == nil {
+		log.Debugf("custom program: reply for unknown decision %d", id)
+		return
+	}
+
+	if verb[0] == 'a' {
+		metrics.StdinAcks.WithLabelValues("ack").Inc()
+		metrics.ApplyDuration.Observe(time.Since(d.sent).Seconds())
+		t.release(d)
+		return
+	}
+
+	metrics.StdinAcks.WithLabelValues("nack").Inc()
+
+	t.mu.Lock()
+	superseded := t.superseded(d)
+	t.mu.Unlock()
+
+	if superseded {
+		if nackLog.Enabled() {
+			log.Debugf("custom program: nack for decision %d (%s), not sent again: superseded", id, reason)
+		}
+		t.release(d)
+		return
+	}
+
+	d.attempts++
+	if d.attempts <= t.retries {
+		if nackLog.Enabled() {
+			log.Debugf("custom program: nack for decision %d (%s), retry %d/%d", id, reason, d.attempts, t.retries)
+		}
+		t.mu.Lock()
+		d.resending = true
+		t.inflight[id] = append(t.inflight[id], d)
+		t.mu.Unlock()
+		select {
+		case t.resend <- d:
+		case <-t.done:
+		}
+		return
+	}
+
+	log.Errorf("custom program: unable to %s decision %d for '%s': %s", d.action, id, derefString(d.decision.Value), reason)
+	metrics.StdinAcks.WithLabelValues("failed").Inc()
+	t.release(d)
+	if t.onFailure != nil {
+		t.onFailure(d.decision, d.action)
+	}
+}
+
+// Inflight returns the number of decisions waiting for a reply of the custom programs, with stdin_ack.
+func (c *CustomBouncer) Inflight() int {
+	n := 0
+
+	for _, s := range c.shards {
+		s.mu.Lock()
+		acks := s.acks
+		s.mu.Unlock()
+
+		if acks != nil {
+			n += acks.len()
+		}
+	}
+
+	return n
+}
+
+// ReadAcks reads the replies of the custom program on its stdout until EOF,
+// with stdin_ack. The decisions that are nacked are sent again, up to
+// stdin_ack_retries times. It must be called after SetStdin, for the same program.
+func (c *CustomBouncer) ReadAcks(r io.Reader) error {
+	return c.ReadShardAcks(0, r)
+}
+
+// ReadShardAcks is ReadAcks for one of the stdin_workers programs, after SetShardStdin.
+func (c *CustomBouncer) ReadShardAcks(shard int, r io.Reader) error {
+	s := c.shards[shard]
+
+	s.mu.Lock()
+	t := s.acks
+	s.mu.Unlock()
+
+	if t == nil {
+		return errors.New("stdin_ack is not enabled")
+	}
+
+	resendDone := make(chan struct{})
+	go func() {
+		defer close(resendDone)
+		for d := range t.resend {
+			c.resendDecision(s, t, d)
+		}
+	}()
+
+	scanner := bufio.NewScanner(r)
+	for scanner.Scan() {
+		t.handle(scanner.Bytes())
+	}
+
+	close(t.resend)
+	<-resendDone
+
+	return scanner.Err()
+}
+
+func (c *CustomBouncer) resendDecision(s *stdinShard, t *ackTracker, d *inflightDecision) {
+	buf := getBuffer()
+	defer putBuffer(buf)
+
+	b, err := c.stdinEncoder().appendDecision(*buf, d.decision, d.action)
+	*buf = b
+	if err != nil {
+		log.Warningf("serialize: %s", err)
+		return
+	}
+
+	s.mu.Lock()
+	if s.acks != t {
+		// restarted, the decisions are replayed if needed
+		s.mu.Unlock()
+		return
+	}
+	// the decisions are tracked with s.mu held, none can be written meanwhile
+	t.mu.Lock()
+	superseded := t.superseded(d)
+	if superseded {
+		t.forget(d)
+	} else {
+		d.resending = false
+	}
+	t.mu.Unlock()
+	if superseded {
+		s.mu.Unlock()
+		t.release(d)
+		return
+	}
+	_, err = s.writer.Write(b)
+	s.mu.Unlock()
+
+	if err == nil {
+		metrics.StdinLines.Inc()
+		err = s.flush()
+	}
+
+	if err != nil {
+		log.Errorf("unable to send decision %d again: %s", d.decision.ID, err)
+	}
+}
@@ -0,0 +1,360 @@
+package custom
+
+import (
+	"net/netip"
+	"strings"
+
+	"github.com/crowdsecurity/crowdsec/pkg/models"
+
+	"github.com/crowdsecurity/cs-custom-bouncer/pkg/metrics"
+)
+
+// aggregateNode is a node of a binary trie of IP prefixes. A node is full
+// when all its addresses are covered by decisions: its own, or those of its
+// two children. A full node without a full ancestor is sent to the program as
+// a single decision.
+type aggregateNode struct {
+	prefix   netip.Prefix
+	children [2]*aggregateNode
+	members  map[DecisionKey]*models.Decision
+	full     bool
+	// one of the ancestors is full
+	covered bool
+	// the decision with the longest duration in the subtree
+	longest *models.Decision
+	// the decision sent for the prefix, if any, and the one it's copied from
+	emitted *models.Decision
+	source  *models.Decision
+}
+
+type aggregateTreeKey struct {
+	decisionType string
+	v6           bool
+}
+
+type aggregateMember struct {
+	treeKey aggregateTreeKey
+	prefix  netip.Prefix
+}
+
+// Aggregator merges the Ip and Range decisions of the same type into the
+// smallest set of prefixes that covers them exactly, and returns the changes
+// to this set instead of the decisions. The other decisions are unchanged.
+//
+// The decision sent for a prefix is a copy of the one with the longest
+// duration among those it covers, without id and uuid. It's replaced, deleted
+// then added again, when a longer decision is added to the prefix.
+// It's not safe for concurrent use.
+type Aggregator struct {
+	trees   map[aggregateTreeKey]*aggregateNode
+	members map[DecisionKey]aggregateMember
+	emitted int
+
+	// the operations of the batch being applied
+	deleted    []*models.Decision
+	added      []*models.Decision
+	addedIndex map[*models.Decision]int
+}
+
+// NewAggregator returns nil if aggregate_cidrs is not set. Apply can be called
+// on a nil Aggregator.
+func (c *CustomBouncer) NewAggregator() *Aggregator {
+	if !c.aggregateCIDRs {
+		return nil
+	}
+
+	return &Aggregator{
+		trees:   make(map[aggregateTreeKey]*aggregateNode),
+		members: make(map[DecisionKey]aggregateMember),
+	}
+}
+
+// decisionPrefix returns the prefix of an Ip or Range decision.
+func decisionPrefix(decision *models.Decision) (netip.Prefix, bool) {
+	if decision.Value == nil || decision.Scope == nil || decision.Type == nil {
+		return netip.Prefix{}, false
+	}
+
+	switch {
+	case strings.EqualFold(*decision.Scope, "ip"):
+		addr, err := netip.ParseAddr(*decision.Value)
+		if err != nil || addr.Zone() != "" {
+			return netip.Prefix{}, false
+		}
+		addr = addr.Unmap()
+		return netip.PrefixFrom(addr, addr.BitLen()), true
+	case strings.EqualFold(*decision.Scope, "range"):
+		prefix, err := netip.ParsePrefix(*decision.Value)
+		if err != nil {
+			return netip.Prefix{}, false
+		}
+		if prefix.Addr().Is4In6() {
+			bits := prefix.Bits() - 96
+			if bits < 0 {
+				return netip.Prefix{}, false
+			}
+			prefix = netip.PrefixFrom(prefix.Addr().Unmap(), bits)
+		}
+		return prefix.Masked(), true
+	}
+
+	return netip.Prefix{}, false
+}
+
+// Apply updates the prefixes with a stream batch, and returns the operations
+// to send: the deletions and additions of prefixes, followed by the other
+// decisions of the batch.
+func (a *Aggregator) Apply(deleted, added []*models.Decision) ([]*models.Decision, []*models.Decision) {
+	if a == nil {
+		return deleted, added
+	}
+
+	// the gauges are shared by the sinks, they're updated with the difference
+	members, emitted := len(a.members), a.emitted
+
+	a.deleted = nil
+	a.added = nil
+	a.addedIndex = make(map[*models.Decision]int)
+
+	var otherDeleted, otherAdded []*models.Decision
+
+	for _, decision := range deleted {
+		key := decisionToDecisionKey(decision)
+		member, ok := a.members[key]
+		if !ok {
+			// not sent by the aggregator, the program may have it from a previous run
+			otherDeleted = append(otherDeleted, decision)
+			continue
+		}
+		a.remove(key, member)
+	}
+
+	for _, decision := range added {
+		prefix, ok := decisionPrefix(decision)
+		if !ok {
+			otherAdded = append(otherAdded, decision)
+			continue
+		}
+		a.add(decisionToDecisionKey(decision), decision, prefix)
+	}
+
+	retAdded := make([]*models.Decision, 0, len(a.added)+len(otherAdded))
+	for _, decision := range a.added {
+		if decision != nil {
+			retAdded = append(retAdded, decision)
+		}
+	}
+
+	retDeleted := append(a.deleted, otherDeleted...)
+	retAdded = append(retAdded, otherAdded...)
+
+	a.deleted, a.added, a.addedIndex = nil, nil, nil
+
+	metrics.AggregatedDecisions.Add(float64(len(a.members) - members))
+	metrics.AggregatedPrefixes.Add(float64(a.emitted - emitted))
+
+	return retDeleted, retAdded
+}
+
+func prefixBit(addr netip.Addr, i int) int {
+	if addr.Is4() {
+		b := addr.As4()
+		return int(b[i/8]>>(7-i%8)) & 1
+	}
+
+	b := addr.As16()
+
+	return int(b[i/8]>>(7-i%8)) & 1
+}
+
+// path returns the nodes from the root of the tree to the prefix. They are
+// created if needed, otherwise nil is returned if the prefix is not in the tree.
+func (a *Aggregator) path(treeKey aggregateTreeKey, prefix netip.Prefix, create bool) []*aggregateNode {
+	root := a.trees[treeKey]
+	if root == nil {
+		if !create {
+			return nil
+		}
+		root = &aggregateNode{prefix: netip.PrefixFrom(prefix.Addr(), 0).Masked()}
+		a.trees[treeKey] = root
+	}
+
+	path := make([]*aggregateNode, 1, prefix.Bits()+1)
+	path[0] = root
+
+	node := root
+	for i := 0; i < prefix.Bits(); i++ {
+		bit := prefixBit(prefix.Addr(), i)
+		child := node.children[bit]
+		if child == nil {
+			if !create {
+				return nil
+			}
+			child = &aggregateNode{prefix: netip.PrefixFrom(prefix.Addr(), i+1).Masked()}
+			node.children[bit] = child
+		}
+		path = append(path, child)
+		node = child
+	}
+
+	return path
+}
+
+func (a *Aggregator) add(key DecisionKey, decision *models.Decision, prefix netip.Prefix) {
+	treeKey := aggregateTreeKey{decisionType: *decision.Type, v6: prefix.Addr().Is6()}
+	path := a.path(treeKey, prefix, true)
+
+	node := path[len(path)-1]
+	if node.members == nil {
+		node.members = make(map[DecisionKey]*models.Decision, 1)
+	}
+	node.members[key] = decision
+	a.members[key] = aggregateMember{treeKey: treeKey, prefix: prefix}
+
+	a.update(path)
+}
+
+func (a *Aggregator) remove(key DecisionKey, member aggregateMember) {
+	treeKey := member.treeKey
+	delete(a.members, key)
+
+	path := a.path(treeKey, member.prefix, false)
+	if path == nil {
+		return
+	}
+
+	delete(path[len(path)-1].members, key)
+
+	a.update(path)
+
+	// prune the empty nodes, they can't be full
+	for i := len(path) - 1; i > 0; i-- {
+		node := path[i]
+		if len(node.members) != 0 || node.children[0] != nil || node.children[1] != nil {
+			break
+		}
+		parent := path[i-1]
+		if parent.children[0] == node {
+			parent.children[0] = nil
+		} else {
+			parent.children[1] = nil
+		}
+	}
+
+	if root := path[0]; len(root.members) == 0 && root.children[0] == nil && root.children[1] == nil {
+		delete(a.trees, treeKey)
+	}
+}
+
+// update recomputes the nodes of a path after a change of the members of its
+// last node. Only the nodes of the path can change: the subtrees next to it
+// are only visited if the coverage by their ancestors has changed.
+func (a *Aggregator) update(path []*aggregateNode) {
+	for i := len(path) - 1; i >= 0; i-- {
+		node := path[i]
+		left, right := node.children[0], node.children[1]
+
+		node.full = len(node.members) != 0 || (left != nil && left.full && right != nil && right.full)
+
+		node.longest = nil
+		for _, decision := range node.members {
+			node.longest = longestDecision(node.longest, decision)
+		}
+		for _, child := range node.children {
+			if child != nil {
+				node.longest = longestDecision(node.longest, child.longest)
+			}
+		}
+	}
+
+	covered := false
+
+	for i, node := range path {
+		node.covered = covered
+		a.setEmitted(node, node.full && !covered)
+		covered = covered || node.full
+
+		for _, child := range node.children {
+			if child != nil && (i == len(path)-1 || child != path[i+1]) {
+				a.cover(child, covered)
+			}
+		}
+	}
+}
+
+// cover updates a subtree that hasn't changed, after the coverage by its
+// ancestors has.
+func (a *Aggregator) cover(node *aggregateNode, covered bool) {
+	if node.covered == covered {
+		return
+	}
+
+	node.covered = covered
+	a.setEmitted(node, node.full && !covered)
+
+	for _, child := range node.children {
+		if child != nil {
+			a.cover(child, covered || node.full)
+		}
+	}
+}
+
+func longestDecision(a, b *models.Decision) *models.Decision {
+	if a == nil || (b != nil && durationSeconds(b) > durationSeconds(a)) {
+		return b
+	}
+
+	return a
+}
+
+func (a *Aggregator) setEmitted(node *aggregateNode, emit bool) {
+	switch {
+	case emit && node.emitted == nil:
+		node.emitted, node.source = prefixDecision(node), node.longest
+		a.addedIndex[node.emitted] = len(a.added)
+		a.added = append(a.added, node.emitted)
+		a.emitted++
+	case emit && durationSeconds(node.longest) > durationSeconds(node.source):
+		// send it again with the new duration, the program and the cache
+		// would ignore another add for the same prefix
+		old := node.emitted
+		node.emitted, node.source = prefixDecision(node), node.longest
+		if i, ok := a.addedIndex[old]; ok {
+			a.added[i] = node.emitted
+			delete(a.addedIndex, old)
+			a.addedIndex[node.emitted] = i
+		} else {
+			a.deleted = append(a.deleted, old)
+			a.addedIndex[node.emitted] = len(a.added)
+			a.added = append(a.added, node.emitted)
+		}
+	case !emit && node.emitted != nil:
+		if i, ok := a.addedIndex[node.emitted]; ok {
+			// added in the same batch, it's not been sent
+			a.added[i] = nil
+			delete(a.addedIndex, node.emitted)
+		} else {
+			a.deleted = append(a.deleted, node.emitted)
+		}
+		node.emitted, node.source = nil, nil
+		a.emitted--
+	}
+}
+
+func prefixDecision(node *aggregateNode) *models.Decision {
+	decision := *node.longest
+
+	value := node.prefix.String()
+	scope := "Range"
+	if node.prefix.IsSingleIP() {
+		value = node.prefix.Addr().String()
+		scope = "Ip"
+	}
+
+	decision.ID = 0
+	decision.UUID = ""
+	decision.Value = &value
+	decision.Scope = &scope
+
+	return &decision
+}
@@ -0,0 +1,91 @@
+package custom
+
+// ahoCorasick finds if a string contains any of a set of patterns, in a single
+// pass over the string whatever the number of patterns.
+type ahoCorasick struct {
+	// next[state][byte] is the state after reading byte, failure links included
+	next [][256]int32
+	// match[state] is true if a pattern ends at this state, or at one of its suffixes
+	match []bool
+}
+
+func newAhoCorasick(patterns []string) *ahoCorasick {
+	ac := &ahoCorasick{
+		next:  make([][256]int32, 1),
+		match: make([]bool, 1),
+	}
+
+	// trie of the patterns, -1 for missing transitions
+	for i := range ac.next[0] {
+		ac.next[0][i] = -1
+	}
+
+	for _, pattern := range patterns {
+		state := int32(0)
+		for i := 0; i < len(pattern); i++ {
+			b := pattern[i]
+			if ac.next[state][b] < 0 {
+				var row [256]int32
+				for j := range row {
+					row[j] = -1
+				}
+				ac.next = append(ac.next, row)
+				ac.match = append(ac.match, false)
+				ac.next[state][b] = int32(len(ac.next) - 1)
+			}
+			state = ac.next[state][b]
+		}
+		ac.match[state] = true
+	}
+
+	// breadth-first, complete the transitions with those of the failure state
+	fail := make([]int32, len(ac.next))
+	queue := make([]int32, 0, len(ac.next))
+
+	for b := 0; b < 256; b++ {
+		child := ac.next[0][b]
+		if child < 0 {
+			ac.next[0][b] = 0
+			continue
+		}
+		fail[child] = 0
+		queue = append(queue, child)
+	}
+
+	for len(queue) > 0 {
+		state := queue[0]
+		queue = queue[1:]
+
+		ac.match[state] = ac.match[state] || ac.match[fail[state]]
+
+		for b := 0; b < 256; b++ {
+			child := ac.next[state][b]
+			if child < 0 {
+				ac.next[state][b] = ac.next[fail[state]][b]
+				continue
+			}
+			fail[child] = ac.next[fail[state]][b]
+			queue = append(queue, child)
+		}
+	}
+
+	return ac
+}
+
+// matchString returns true if s contains one of the patterns.
+func (ac *ahoCorasick) matchString(s string) bool {
+	if ac.match[0] {
+		// empty pattern
+		return true
+	}
+
+	state := int32(0)
+	for i := 0; i < len(s); i++ {
+		state = ac.next[state][s[i]]
+		if ac.match[state] {
+			return true
+		}
+	}
+
+	return false
+}
@@ -0,0 +1,183 @@
+package custom
+
+import (
+	"bufio"
+	"context"
+	"errors"
+	"fmt"
+	"os"
+	"os/exec"
+	"path/filepath"
+	"time"
+
+	log "github.com/sirupsen/logrus"
+
+	"github.com/crowdsecurity/crowdsec/pkg/models"
+
+	"github.com/crowdsecurity/cs-custom-bouncer/pkg/metrics"
+)
+
+// BulkLoad sends the first stream batch as a whole: the decisions are written
+// to bulk_load_file, then the program is called with "bulk-load <file>" in live
+// mode, or receives a "bulk-load" marker with the path in stdin mode. The file
+// has all the active decisions, the program is expected to replace its own.
+//
+// With stdin_workers, each program receives its own file, named after
+// bulk_load_file with the index of the program, with its own decisions.
+//
+// An error is returned if a file can't be written, or if the program can't
+// be sent the load or fails. The decisions are then not marked as active, and
+// the batch can be dispatched as usual.
+func (c *CustomBouncer) BulkLoad(ctx context.Context, deleted, added []*models.Decision) error {
+	decisions := bulkDecisions(deleted, added)
+
+	encoder := stdinEncoder(jsonEncoder{})
+	parts := [][]*models.Decision{decisions}
+	if c.feedViaStdin {
+		encoder = c.stdinEncoder()
+		parts = c.partition(decisions)
+	}
+
+	for i, part := range parts {
+		path := c.bulkPath(i)
+		if err := writeBulkFile(path, encoder, part); err != nil {
+			return fmt.Errorf("unable to write %s: %w", path, err)
+		}
+	}
+
+	log.Infof("bulk loading %d decisions from %s", len(decisions), c.bulkLoadFile)
+
+	if c.feedViaStdin {
+		for i, s := range c.shards {
+			err := c.writeMarker(s, "bulk-load", len(parts[i]), c.bulkPath(i))
+			if err == nil {
+				err = s.flush()
+			}
+			if err != nil {
+				return fmt.Errorf("unable to send bulk-load to custom program: %w", err)
+			}
+		}
+	} else {
+		cmd := exec.CommandContext(ctx, c.Path, "bulk-load", c.bulkLoadFile)
+		if out, err := runCommand(cmd, "bulk-load"); err != nil {
+			return fmt.Errorf("error in 'bulk-load' command (%s): %w --> %s", cmd.String(), err, string(out))
+		}
+	}
+
+	// the journal, if any, is superseded by the file
+	c.journaled = nil
+	c.active.replace(decisions)
+
+	if c.localExpiry {
+		c.expiries.reset()
+		now := time.Now()
+		for _, decision := range decisions {
+			c.expiries.schedule(decisionToDecisionKey(decision), decision, now)
+		}
+	}
+
+	if c.journal != nil {
+		if err := c.journal.reset(decisions); err != nil {
+			log.Errorf("unable to write state journal: %s", err)
+		}
+	}
+
+	return nil
+}
+
+// bulkPath returns the file for the decisions of a stdin_workers program.
+func (c *CustomBouncer) bulkPath(shard int) string {
+	if len(c.shards) == 1 {
+		return c.bulkLoadFile
+	}
+
+	return fmt.Sprintf("%s.%d", c.bulkLoadFile, shard)
+}
+
+// bulkDecisions returns the decisions that are active after the batch, one per
+// key. Those that are both new and deleted have expired in the meantime.
+func bulkDecisions(deleted, added []*models.Decision) []*models.Decision {
+	deletedIDs := make(map[int64]struct{}, len(deleted))
+	for _, decision := range deleted {
+		if decision.ID != 0 {
+			deletedIDs[decision.ID] = struct{}{}
+		}
+	}
+
+	index := make(map[DecisionKey]int, len(added))
+	ret := make([]*models.Decision, 0, len(added))
+
+	for _, decision := range added {
+		if _, ok := deletedIDs[decision.ID]; ok && decision.ID != 0 {
+			continue
+		}
+
+		key := decisionToDecisionKey(decision)
+		if i, ok := index[key]; ok {
+			ret[i] = decision
+			continue
+		}
+
+		index[key] = len(ret)
+		ret = append(ret, decision)
+	}
+
+	return ret
+}
+
+// writeBulkFile replaces path with the encoded decisions. It's written aside
+// and renamed, so that the program never reads a partial file.
+func writeBulkFile(path string, encoder stdinEncoder, decisions []*models.Decision) error {
+	tmp, err := os.CreateTemp(filepath.Dir(path), filepath.Base(path)+".*")
+	if err != nil {
+		return err
+	}
+	defer os.Remove(tmp.Name())
+
+	w := bufio.NewWriter(tmp)
+
+	var buf []byte
+
+	for _, decision := range decisions {
+		buf, err = encoder.appendDecision(buf[:0], decision, "add")
+		if err != nil {
+			log.Warningf("serialize: %s", err)
+			continue
+		}
+
+		if _, err := w.Write(buf); err != nil {
+			tmp.Close()
+			return err
+		}
+	}
+
+	err = w.Flush()
+	if err == nil {
+		err = tmp.Sync()
+	}
+	if cerr := tmp.Close(); err == nil {
+		err = cerr
+	}
+	if err != nil {
+		return err
+	}
+
+	return os.Rename(tmp.Name(), path)
+}
+
+// writeMarker sends a control record to a custom program.
+func (c *CustomBouncer) writeMarker(s *stdinShard, marker string, count int, path string) error {
+	s.mu.Lock()
+	defer s.mu.Unlock()
+
+	if s.writer == nil {
+		return errors.New("custom program is not running")
+	}
+
+	_, err := s.writer.Write(c.stdinEncoder().appendMarker(nil, marker, count, path))
+	if err == nil {
+		metrics.StdinLines.Inc()
+	}
+
+	return err
+}
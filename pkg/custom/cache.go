@@ -0,0 +1,172 @@
+package custom
+
+import (
+	"container/list"
+	"sync"
+	"sync/atomic"
+	"time"
+
+	"github.com/crowdsecurity/cs-custom-bouncer/pkg/metrics"
+)
+
+// decisionCache remembers the decision keys that have been processed recently,
+// to avoid sending them twice. Each key expires on its own, retention after it
+// has been added. If maxSize > 0, the least recently used keys are evicted
+// to keep the cache under this size. It's safe for concurrent use.
+type decisionCache struct {
+	mu        sync.Mutex
+	retention time.Duration
+	maxSize   int
+	expiry    deadlineHeap
+	lru       list.List // front is the most recently used
+	elements  map[DecisionKey]*list.Element
+	hits      atomic.Uint64
+	misses    atomic.Uint64
+}
+
+func (c *decisionCache) configure(retention time.Duration, maxSize int) {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+
+	c.retention = retention
+	c.maxSize = maxSize
+}
+
+// lookupLocked returns the element of a key that is in the cache and not expired.
+func (c *decisionCache) lookupLocked(key DecisionKey, now time.Time) (*list.Element, bool) {
+	elem, ok := c.elements[key]
+	if !ok {
+		return nil, false
+	}
+
+	if deadline, _ := c.expiry.deadline(key); c.retention > 0 && !deadline.After(now) {
+		c.removeLocked(key)
+		return nil, false
+	}
+
+	return elem, true
+}
+
+func (c *decisionCache) has(key DecisionKey) bool {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+
+	elem, ok := c.lookupLocked(key, time.Now())
+	if !ok {
+		c.misses.Add(1)
+		metrics.CacheMisses.Inc()
+
+		return false
+	}
+
+	c.hits.Add(1)
+	metrics.CacheHits.Inc()
+	c.lru.MoveToFront(elem)
+
+	return true
+}
+
+func (c *decisionCache) add(key DecisionKey) {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+
+	c.addLocked(key, time.Now())
+}
+
+func (c *decisionCache) addLocked(key DecisionKey, now time.Time) {
+	if c.elements == nil {
+		c.elements = make(map[DecisionKey]*list.Element)
+	}
+
+	if elem, ok := c.elements[key]; ok {
+		c.lru.MoveToFront(elem)
+	} else {
+		c.elements[key] = c.lru.PushFront(key)
+		metrics.CacheSize.Inc()
+	}
+
+	c.expiry.set(key, now.Add(c.retention))
+
+	for c.maxSize > 0 && len(c.elements) > c.maxSize {
+		c.removeLocked(c.lru.Back().Value.(DecisionKey))
+	}
+}
+
+// testAndAdd adds the key to the cache, and returns true if it was already there.
+func (c *decisionCache) testAndAdd(key DecisionKey) bool {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+
+	now := time.Now()
+
+	if elem, ok := c.lookupLocked(key, now); ok {
+		c.hits.Add(1)
+		metrics.CacheHits.Inc()
+		c.lru.MoveToFront(elem)
+
+		return true
+	}
+
+	c.misses.Add(1)
+	metrics.CacheMisses.Inc()
+	c.addLocked(key, now)
+
+	return false
+}
+
+func (c *decisionCache) remove(key DecisionKey) {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+
+	c.removeLocked(key)
+}
+
+func (c *decisionCache) removeLocked(key DecisionKey) {
+	elem, ok := c.elements[key]
+	if !ok {
+		return
+	}
+
+	c.lru.Remove(elem)
+	delete(c.elements, key)
+	c.expiry.remove(key)
+	metrics.CacheSize.Dec()
+}
+
+// expire removes the keys that have outlived the retention, and returns how many.
+func (c *decisionCache) expire() int {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+
+	if c.retention <= 0 {
+		return 0
+	}
+
+	expired := c.expiry.popExpired(time.Now())
+	for _, key := range expired {
+		c.lru.Remove(c.elements[key])
+		delete(c.elements, key)
+	}
+
+	metrics.CacheSize.Sub(float64(len(expired)))
+
+	return len(expired)
+}
+
+func (c *decisionCache) len() int {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+
+	return len(c.elements)
+}
+
+func (c *decisionCache) reset() {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+
+	metrics.CacheSize.Sub(float64(len(c.elements)))
+
+	c.elements = make(map[DecisionKey]*list.Element)
+	c.lru.Init()
+	c.expiry = deadlineHeap{}
+}
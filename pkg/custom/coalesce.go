@@ -0,0 +1,133 @@
+package custom
+
+import (
+	"time"
+
+	"github.com/crowdsecurity/crowdsec/pkg/models"
+
+	"github.com/crowdsecurity/cs-custom-bouncer/pkg/metrics"
+)
+
+type coalescedKey struct {
+	firstDel *models.Decision // set if the first operation is a del
+	last     *models.Decision
+	lastAdd  bool
+	ops      int
+}
+
+// Coalescer collapses the successive add/del operations on the same decision
+// key, so that only the net change is sent to the custom program.
+// It's not safe for concurrent use.
+type Coalescer struct {
+	custom  *CustomBouncer
+	pending map[DecisionKey]*coalescedKey
+	order   []DecisionKey
+	oldest  time.Time
+}
+
+func (c *CustomBouncer) NewCoalescer() *Coalescer {
+	return &Coalescer{
+		custom:  c,
+		pending: make(map[DecisionKey]*coalescedKey),
+	}
+}
+
+func (co *Coalescer) push(decision *models.Decision, add bool) {
+	key := decisionToDecisionKey(decision)
+
+	p, ok := co.pending[key]
+	if !ok {
+		p = &coalescedKey{}
+		if !add {
+			p.firstDel = decision
+		}
+		co.pending[key] = p
+		co.order = append(co.order, key)
+	}
+
+	p.last = decision
+	p.lastAdd = add
+	p.ops++
+}
+
+// Push records the operations of a stream batch. Deletions come first, like
+// when the batch is sent as-is, except for decisions that are both new and
+// deleted in the same batch: they have been added, then deleted.
+func (co *Coalescer) Push(deleted, added []*models.Decision) {
+	if len(co.order) == 0 {
+		co.oldest = time.Now()
+	}
+
+	newIDs := make(map[int64]struct{}, len(added))
+	for _, d := range added {
+		newIDs[d.ID] = struct{}{}
+	}
+
+	var expired []*models.Decision
+
+	for _, d := range deleted {
+		if _, ok := newIDs[d.ID]; ok && d.ID != 0 {
+			expired = append(expired, d)
+			continue
+		}
+		co.push(d, false)
+	}
+
+	for _, d := range added {
+		co.push(d, true)
+	}
+
+	for _, d := range expired {
+		co.push(d, false)
+	}
+}
+
+// Flush returns the net operations since the last flush, and resets the coalescer.
+//
+// An operation is dropped only when it's redundant with the other operations
+// of the same key, or with the active decision. A deletion for a decision
+// the bouncer doesn't know about is kept: the program may have it from a
+// previous run.
+func (co *Coalescer) Flush() (deleted, added []*models.Decision) {
+	total := 0
+
+	for _, key := range co.order {
+		p := co.pending[key]
+		total += p.ops
+		active := co.custom.active.get(key)
+
+		switch {
+		case p.lastAdd && p.firstDel == nil && active != nil && active.ID == p.last.ID:
+			// already there, the decisions without id (like those of
+			// aggregate_cidrs) are replaced with a del and an add
+		case p.lastAdd:
+			if p.firstDel != nil {
+				deleted = append(deleted, p.firstDel)
+			}
+			added = append(added, p.last)
+		case p.firstDel != nil || active != nil:
+			deleted = append(deleted, p.last)
+		default:
+			// added, then deleted before being sent
+		}
+	}
+
+	if dropped := total - len(deleted) - len(added); dropped > 0 {
+		metrics.CoalescedOperations.Add(float64(dropped))
+	}
+
+	co.pending = make(map[DecisionKey]*coalescedKey)
+	co.order = nil
+
+	return deleted, added
+}
+
+// Oldest returns when the oldest pending operation has been pushed.
+func (co *Coalescer) Oldest() time.Time {
+	return co.oldest
+}
+
+// Len returns the number of keys waiting to be flushed.
+func (co *Coalescer) Len() int {
+	return len(co.order)
+}
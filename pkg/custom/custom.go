@@ -1,12 +1,15 @@
 package custom
 
 import (
+	"bytes"
 	"context"
-	"encoding/json"
+	"errors"
 	"fmt"
 	"io"
 	"os/exec"
+	"slices"
 	"strconv"
+	"strings"
 	"time"
 
 	log "github.com/sirupsen/logrus"
@@ -14,6 +17,7 @@ import (
 	"github.com/crowdsecurity/crowdsec/pkg/models"
 
 	"github.com/crowdsecurity/cs-custom-bouncer/pkg/cfg"
+	"github.com/crowdsecurity/cs-custom-bouncer/pkg/metrics"
 )
 
 type DecisionKey struct {
@@ -27,29 +31,131 @@ type DecisionWithAction struct {
 	Action string `json:"action,omitempty"`
 }
 
+// samplers of the per-decision debug lines
+var addBanLog, delBanLog LogSampler
+
 type CustomBouncer struct {
 	Path                    string
-	BinaryStdin             io.Writer
+	name                    string
+	queueSize               int
+	queuePolicy             string
+	shards                  []*stdinShard
 	feedViaStdin            bool
-	newDecisionValueSet     map[DecisionKey]struct{}
-	expiredDecisionValueSet map[DecisionKey]struct{}
+	stdinBufferSize         int
+	stdinFlushInterval      time.Duration
+	stdinWriteTimeout       time.Duration
+	replayOnRestart         bool
+	stdinAck                bool
+	stdinAckWindow          int
+	stdinAckRetries         int
+	retries                 *retryQueue
+	limiter                 *forkLimiter
+	encoder                 stdinEncoder
+	maxConcurrentExec       int
+	batchExec               bool
+	maxBatchSize            int
+	newDecisionValueSet     decisionCache
+	expiredDecisionValueSet decisionCache
+	active                  decisionState
+	stateDir                string
+	bulkLoadFile            string
+	aggregateCIDRs          bool
+	filter                  *decisionFilter
+	localExpiry             bool
+	localExpiryRate         float64
+	expiries                expiryScheduler
+	journal                 *journal
+	// decisions loaded from the journal, until the first batch is reconciled
+	journaled map[DecisionKey]*models.Decision
 }
 
-func NewCustomBouncer(cfg *cfg.BouncerConfig) (*CustomBouncer, error) {
-	return &CustomBouncer{
-		Path:         cfg.BinPath,
-		feedViaStdin: cfg.FeedViaStdin,
-	}, nil
+func NewCustomBouncer(cfg *cfg.SinkConfig) (*CustomBouncer, error) {
+	encoder, err := newStdinEncoder(cfg.StdinFormat, cfg.StdinTSVFields)
+	if err != nil {
+		return nil, err
+	}
+
+	if cfg.StdinAck && cfg.StdinFormat == "tsv" && !slices.Contains(cfg.StdinTSVFields, "id") {
+		return nil, errors.New("stdin_ack needs the id field in stdin_tsv_fields")
+	}
+
+	filter, err := newDecisionFilter(cfg.DecisionFilters)
+	if err != nil {
+		return nil, err
+	}
+
+	c := &CustomBouncer{
+		Path:               cfg.BinPath,
+		name:               cfg.Name,
+		queueSize:          cfg.QueueSize,
+		queuePolicy:        cfg.QueuePolicy,
+		feedViaStdin:       cfg.FeedViaStdin,
+		stdinBufferSize:    cfg.StdinBufferSize,
+		stdinFlushInterval: cfg.StdinFlushInterval,
+		stdinWriteTimeout:  cfg.StdinWriteTimeout,
+		replayOnRestart:    cfg.ReplayOnRestart,
+		stdinAck:           cfg.StdinAck,
+		stdinAckWindow:     cfg.StdinAckWindow,
+		stdinAckRetries:    cfg.StdinAckRetries,
+		encoder:            encoder,
+		batchExec:          cfg.BatchExec,
+		maxBatchSize:       cfg.MaxBatchSize,
+		maxConcurrentExec:  cfg.MaxConcurrentExec,
+		stateDir:           cfg.StateDir,
+		bulkLoadFile:       cfg.BulkLoadFile,
+		aggregateCIDRs:     cfg.AggregateCIDRs,
+		filter:             filter,
+		localExpiry:        cfg.LocalExpiry,
+		localExpiryRate:    cfg.LocalExpiryRate,
+	}
+	if !cfg.FeedViaStdin {
+		c.limiter = newForkLimiter(cfg.ExecRateLimit, max(cfg.ExecRateBurst, 1), cfg.ExecPriority)
+	}
+	c.shards = make([]*stdinShard, max(cfg.StdinWorkers, 1))
+	for i := range c.shards {
+		c.shards[i] = &stdinShard{attached: make(chan struct{})}
+	}
+	if cfg.ExecRetries > 0 && !cfg.FeedViaStdin {
+		c.retries = newRetryQueue(cfg.ExecRetries, cfg.ExecRetryBackoff, cfg.ExecRetryMaxBackoff, cfg.DeadLetterFile)
+	}
+	c.newDecisionValueSet.configure(cfg.CacheRetentionDuration, cfg.CacheMaxEntries)
+	c.expiredDecisionValueSet.configure(cfg.CacheRetentionDuration, cfg.CacheMaxEntries)
+
+	return c, nil
+}
+
+// BatchExec returns true if decisions are passed to the binary in batches
+// (one invocation per "add-batch" or "del-batch") instead of one by one.
+func (c *CustomBouncer) BatchExec() bool {
+	return c.batchExec && !c.feedViaStdin
 }
 
 func (c *CustomBouncer) ResetCache() {
-	cachedDecisionCount := len(c.newDecisionValueSet) + len(c.expiredDecisionValueSet)
+	cachedDecisionCount := c.newDecisionValueSet.len() + c.expiredDecisionValueSet.len()
 	if cachedDecisionCount != 0 {
 		log.Debugf("resetting cache, clearing %d decisions", cachedDecisionCount)
 		// dont return here, because this could be used to intiate the sets
 	}
-	c.newDecisionValueSet = make(map[DecisionKey]struct{})
-	c.expiredDecisionValueSet = make(map[DecisionKey]struct{})
+	c.newDecisionValueSet.reset()
+	c.expiredDecisionValueSet.reset()
+}
+
+// ExpireCache removes the cached decisions that have outlived cache_retention_duration.
+// They are also ignored when they are looked up, this is only to reclaim memory.
+func (c *CustomBouncer) ExpireCache() {
+	expired := c.newDecisionValueSet.expire() + c.expiredDecisionValueSet.expire()
+	if expired != 0 {
+		log.Debugf("removed %d expired decisions from cache", expired)
+	}
+}
+
+// CacheStats returns the number of hits and misses of the decision caches, and their size.
+func (c *CustomBouncer) CacheStats() (hits, misses uint64, size int) {
+	hits = c.newDecisionValueSet.hits.Load() + c.expiredDecisionValueSet.hits.Load()
+	misses = c.newDecisionValueSet.misses.Load() + c.expiredDecisionValueSet.misses.Load()
+	size = c.newDecisionValueSet.len() + c.expiredDecisionValueSet.len()
+
+	return hits, misses, size
 }
 
 func (c *CustomBouncer) Init() error {
@@ -57,75 +163,466 @@ func (c *CustomBouncer) Init() error {
 	return nil
 }
 
-func (c *CustomBouncer) Add(ctx context.Context, decision *models.Decision) error {
-	if _, exists := c.newDecisionValueSet[decisionToDecisionKey(decision)]; exists {
+// OpenState loads the decisions recorded in state_dir by a previous run, and
+// records the next ones there. It does nothing if state_dir is not set.
+func (c *CustomBouncer) OpenState() error {
+	if c.stateDir == "" {
 		return nil
 	}
-	banDuration, err := time.ParseDuration(*decision.Duration)
+
+	j, decisions, err := openJournal(c.stateDir)
+	if err != nil {
+		return fmt.Errorf("unable to open state journal: %w", err)
+	}
+
+	for key, decision := range decisions {
+		c.active.set(key, decision)
+	}
+
+	c.journal = j
+	c.journaled = decisions
+
+	log.Infof("loaded %d active decisions from %s", len(decisions), j.path)
+
+	return nil
+}
+
+// Reconcile returns the operations to send for the first stream batch after
+// a restart with state_dir: the new decisions that the program doesn't have
+// already, and the deletion of those it has but are no longer in the batch.
+// Any other batch is returned unchanged.
+func (c *CustomBouncer) Reconcile(deleted, added []*models.Decision) ([]*models.Decision, []*models.Decision) {
+	if c.journaled == nil {
+		return deleted, added
+	}
+
+	journaled := c.journaled
+	c.journaled = nil
+
+	current := make(map[DecisionKey]struct{}, len(added))
+	diffAdded := make([]*models.Decision, 0, len(added))
+
+	for _, decision := range added {
+		key := decisionToDecisionKey(decision)
+		current[key] = struct{}{}
+		if old, ok := journaled[key]; ok && old.ID == decision.ID {
+			// with its remaining duration
+			c.active.set(key, decision)
+			if c.localExpiry {
+				c.expiries.schedule(key, decision, time.Now())
+			}
+			continue
+		}
+		diffAdded = append(diffAdded, decision)
+	}
+
+	// don't append to the slice of the caller
+	diffDeleted := deleted[:len(deleted):len(deleted)]
+	for _, decision := range deleted {
+		delete(journaled, decisionToDecisionKey(decision))
+	}
+
+	for key, decision := range journaled {
+		if _, ok := current[key]; !ok {
+			diffDeleted = append(diffDeleted, decision)
+		}
+	}
+
+	log.Infof("warm start: %d of %d decisions already applied, %d to delete",
+		len(added)-len(diffAdded), len(added), len(diffDeleted)-len(deleted))
+
+	return diffDeleted, diffAdded
+}
+
+// SyncState writes the recorded decisions to state_dir.
+func (c *CustomBouncer) SyncState() error {
+	if c.journal == nil {
+		return nil
+	}
+
+	return c.journal.sync(c.active.len(), c.active.snapshot)
+}
+
+func (c *CustomBouncer) setActive(key DecisionKey, decision *models.Decision) {
+	c.active.set(key, decision)
+	if c.journal != nil {
+		c.journal.append(decision, "add")
+	}
+	if c.localExpiry {
+		c.expiries.schedule(key, decision, time.Now())
+	}
+}
+
+func (c *CustomBouncer) removeActive(key DecisionKey, decision *models.Decision) {
+	c.active.remove(key)
+	if c.journal != nil {
+		c.journal.append(decision, "del")
+	}
+	if c.localExpiry {
+		c.expiries.cancel(key)
+	}
+}
+
+// SetStdin attaches the stdin of a newly started custom program. Lines are
+// buffered and written by a StdinWriter, which is returned.
+//
+// With replay_on_restart, the active decisions are sent first, followed by
+// a "snapshot-end" line, before any other decision can be written.
+func (c *CustomBouncer) SetStdin(w io.Writer) (*StdinWriter, error) {
+	return c.SetShardStdin(0, w)
+}
+
+// SetShardStdin is SetStdin for one of the stdin_workers programs, from 0 to
+// StdinWorkers()-1. Only the decisions of its partition are replayed.
+func (c *CustomBouncer) SetShardStdin(shard int, w io.Writer) (*StdinWriter, error) {
+	s := c.shards[shard]
+	sw := NewStdinWriter(w, c.stdinBufferSize, c.stdinFlushInterval, c.stdinWriteTimeout)
+
+	s.mu.Lock()
+	defer s.mu.Unlock()
+
+	s.writer = sw
+	// once the snapshot has been written
+	defer s.attachOnce.Do(func() { close(s.attached) })
+
+	if s.acks != nil {
+		// the previous program won't reply
+		s.acks.close()
+		s.acks = nil
+	}
+
+	if c.stdinAck {
+		window := c.stdinAckWindow
+		if window <= 0 {
+			window = 1
+		}
+		s.acks = newAckTracker(window, c.stdinAckRetries, c.stdinWriteTimeout, sw)
+		s.acks.onFailure = c.uncache
+	}
+
+	if !c.replayOnRestart {
+		return sw, nil
+	}
+
+	snapshot := c.partition(c.active.snapshot())[shard]
+	log.Infof("sending %d active decisions to the custom program", len(snapshot))
+
+	encoder := c.stdinEncoder()
+
+	var buf []byte
+
+	for _, decision := range snapshot {
+		var err error
+
+		buf, err = encoder.appendDecision(buf[:0], decision, "add")
+		if err != nil {
+			log.Warningf("serialize: %s", err)
+			continue
+		}
+
+		if s.acks != nil {
+			s.acks.track(decision, "add", false)
+		}
+		if _, err := sw.Write(buf); err != nil {
+			return sw, err
+		}
+		metrics.StdinLines.Inc()
+	}
+
+	if _, err := sw.Write(encoder.appendMarker(buf[:0], "snapshot-end", len(snapshot), "")); err != nil {
+		return sw, err
+	}
+	metrics.StdinLines.Inc()
+
+	return sw, sw.Flush()
+}
+
+func (c *CustomBouncer) stdinEncoder() stdinEncoder {
+	if c.encoder == nil {
+		return jsonEncoder{}
+	}
+
+	return c.encoder
+}
+
+// FlushStdin writes the buffered lines to the custom programs.
+func (c *CustomBouncer) FlushStdin() error {
+	var errs []error
+
+	for _, s := range c.shards {
+		if err := s.flush(); err != nil {
+			errs = append(errs, err)
+		}
+	}
+
+	return errors.Join(errs...)
+}
+
+// writeStdin sends a decision to the custom program, with the configured stdin_format.
+func (c *CustomBouncer) writeStdin(decision *models.Decision, action string) error {
+	buf := getBuffer()
+	defer putBuffer(buf)
+
+	b, err := c.stdinEncoder().appendDecision(*buf, decision, action)
+	*buf = b
 	if err != nil {
 		return err
 	}
-	log.Debugf("custom [%s] : add ban on %s for %s sec (%s)", c.Path, *decision.Value, strconv.Itoa(int(banDuration.Seconds())), *decision.Scenario)
-	var str string
-	if c.feedViaStdin {
-		str, err = serializeDecision(decision, "add")
+
+	s := c.shards[c.shardOf(decision)]
+
+	s.mu.Lock()
+	acks := s.acks
+	s.mu.Unlock()
+
+	if acks != nil {
+		if err := acks.acquire(s.flush); err != nil {
+			return err
+		}
+	}
+
+	s.mu.Lock()
+	defer s.mu.Unlock()
+
+	if s.writer == nil {
+		return errors.New("custom program is not running")
+	}
+
+	if acks != nil {
+		acks.track(decision, action, true)
+	}
+
+	if _, err = s.writer.Write(b); err == nil {
+		metrics.StdinLines.Inc()
+	}
+
+	return err
+}
+
+// uncache forgets that a decision has been sent, when the program failed to
+// apply it. A failed add is not active anymore, so that it's not skipped by
+// the next warm start.
+func (c *CustomBouncer) uncache(decision *models.Decision, action string) {
+	key := decisionToDecisionKey(decision)
+	if action == "add" {
+		c.newDecisionValueSet.remove(key)
+		if active := c.active.get(key); active != nil && active.ID == decision.ID {
+			c.removeActive(key, decision)
+		}
 	} else {
-		str, err = serializeDecision(decision, "")
+		c.expiredDecisionValueSet.remove(key)
+	}
+}
+
+// NewExecPool returns a pool to run the live mode commands concurrently, or nil
+// if they must be run one at a time (max_concurrent_exec <= 1, stdin or batch mode).
+func (c *CustomBouncer) NewExecPool(ctx context.Context) *ExecPool {
+	if c.feedViaStdin || c.BatchExec() || c.maxConcurrentExec <= 1 {
+		return nil
+	}
+
+	return NewExecPool(ctx, c, c.maxConcurrentExec)
+}
+
+func (c *CustomBouncer) Add(ctx context.Context, decision *models.Decision) error {
+	key := decisionToDecisionKey(decision)
+	if c.newDecisionValueSet.has(key) {
+		return nil
+	}
+	if c.retries != nil {
+		// superseded
+		c.retries.cancel(key)
 	}
+	c.expiredDecisionValueSet.remove(key)
+	banDuration, err := time.ParseDuration(*decision.Duration)
 	if err != nil {
-		log.Warningf("serialize: %s", err)
+		return err
+	}
+	if addBanLog.Enabled() {
+		log.Debugf("custom [%s] : add ban on %s for %d sec (%s)", c.Path, *decision.Value, int(banDuration.Seconds()), *decision.Scenario)
 	}
 	if c.feedViaStdin {
-		fmt.Fprintln(c.BinaryStdin, str)
-		c.newDecisionValueSet[decisionToDecisionKey(decision)] = struct{}{}
+		// the decision is active even if the write fails: it can be replayed
+		c.setActive(key, decision)
+		if err := c.writeStdin(decision, "add"); err != nil {
+			return err
+		}
+		c.newDecisionValueSet.add(key)
 		return nil
 	}
-	cmd := exec.CommandContext(ctx, c.Path, "add", *decision.Value, strconv.Itoa(int(banDuration.Seconds())), *decision.Scenario, str)
-	if out, err := cmd.CombinedOutput(); err != nil {
-		log.Errorf("Error in 'add' command (%s): %v --> %s", cmd.String(), err, string(out))
+	if err := c.execDecision(ctx, "add", decision); err != nil {
+		// not cached nor journaled, so that it's not ignored if it comes again
+		c.retryLater(decision, "add")
+		return nil
 	}
-	c.newDecisionValueSet[decisionToDecisionKey(decision)] = struct{}{}
+	c.setActive(key, decision)
+	c.newDecisionValueSet.add(key)
 	return nil
 }
 
 func (c *CustomBouncer) Delete(ctx context.Context, decision *models.Decision) error {
-	if _, exists := c.expiredDecisionValueSet[decisionToDecisionKey(decision)]; exists {
+	key := decisionToDecisionKey(decision)
+	if c.expiredDecisionValueSet.has(key) {
 		return nil
 	}
+	if c.retries != nil {
+		c.retries.cancel(key)
+	}
+	c.newDecisionValueSet.remove(key)
 	banDuration, err := time.ParseDuration(*decision.Duration)
 	if err != nil {
 		return err
 	}
-	var str string
 	if c.feedViaStdin {
-		str, err = serializeDecision(decision, "del")
-	} else {
-		str, err = serializeDecision(decision, "")
+		c.removeActive(key, decision)
+		if err := c.writeStdin(decision, "del"); err != nil {
+			return err
+		}
+		c.expiredDecisionValueSet.add(key)
+		return nil
 	}
-	if c.feedViaStdin {
-		fmt.Fprintln(c.BinaryStdin, str)
-		c.expiredDecisionValueSet[decisionToDecisionKey(decision)] = struct{}{}
+	if delBanLog.Enabled() {
+		log.Debugf("custom [%s] : del ban on %s for %d sec (%s)", c.Path, *decision.Value, int(banDuration.Seconds()), *decision.Scenario)
+	}
+	if err := c.execDecision(ctx, "del", decision); err != nil {
+		// still active, so that the deletion is sent again after a restart
+		c.retryLater(decision, "del")
 		return nil
 	}
+	c.removeActive(key, decision)
+	c.expiredDecisionValueSet.add(key)
+	return nil
+}
+
+// execDecision calls the binary with "add" or "del" for a decision.
+func (c *CustomBouncer) execDecision(ctx context.Context, action string, decision *models.Decision) error {
+	str, err := serializeDecision(decision, "")
 	if err != nil {
 		log.Warningf("serialize: %s", err)
 	}
-	log.Debugf("custom [%s] : del ban on %s for %s sec (%s)", c.Path, *decision.Value, strconv.Itoa(int(banDuration.Seconds())), *decision.Scenario)
-	cmd := exec.CommandContext(ctx, c.Path, "del", *decision.Value, strconv.Itoa(int(banDuration.Seconds())), *decision.Scenario, str)
-	if out, err := cmd.CombinedOutput(); err != nil {
-		log.Errorf("Error in 'del' command (%s): %v --> %s", cmd.String(), err, string(out))
+	if err := c.limiter.wait(ctx, action); err != nil {
+		return err
+	}
+	cmd := exec.CommandContext(ctx, c.Path, action, *decision.Value, strconv.FormatInt(durationSeconds(decision), 10), *decision.Scenario, str)
+	out, err := runCommand(cmd, action)
+	if err != nil {
+		log.Errorf("Error in '%s' command (%s): %v --> %s", action, cmd.String(), err, string(out))
+	}
+	return err
+}
+
+// retryLater queues a failed command, if exec_retries is set.
+func (c *CustomBouncer) retryLater(decision *models.Decision, action string) {
+	if c.retries != nil {
+		c.retries.push(decision, action, 1)
+	}
+}
+
+// AddBatch calls the binary with the "add-batch" verb and the serialized decisions
+// on its stdin, one per line. At most maxBatchSize decisions are sent per call.
+// The decisions are only active once the binary has succeeded.
+func (c *CustomBouncer) AddBatch(ctx context.Context, decisions []*models.Decision) error {
+	return c.execBatch(ctx, "add-batch", decisions, &c.newDecisionValueSet, &c.expiredDecisionValueSet)
+}
+
+// DeleteBatch is the "del-batch" counterpart of AddBatch.
+func (c *CustomBouncer) DeleteBatch(ctx context.Context, decisions []*models.Decision) error {
+	return c.execBatch(ctx, "del-batch", decisions, &c.expiredDecisionValueSet, &c.newDecisionValueSet)
+}
+
+func (c *CustomBouncer) execBatch(ctx context.Context, verb string, decisions []*models.Decision, cache, opposite *decisionCache) error {
+	batch := make([]*models.Decision, 0, len(decisions))
+	for _, decision := range decisions {
+		// mark it right away, to skip duplicates within the same batch
+		key := decisionToDecisionKey(decision)
+		if cache.testAndAdd(key) {
+			continue
+		}
+		if c.retries != nil {
+			c.retries.cancel(key)
+		}
+		// a new "del" must not be skipped after an "add", and vice versa
+		opposite.remove(key)
+		batch = append(batch, decision)
 	}
-	c.expiredDecisionValueSet[decisionToDecisionKey(decision)] = struct{}{}
+
+	size := c.maxBatchSize
+	if size <= 0 {
+		size = len(batch)
+	}
+
+	for start := 0; start < len(batch); start += size {
+		end := min(start+size, len(batch))
+		action := strings.TrimSuffix(verb, "-batch")
+		if err := c.execChunk(ctx, verb, batch[start:end]); err != nil {
+			for _, decision := range batch[start:end] {
+				cache.remove(decisionToDecisionKey(decision))
+				c.retryLater(decision, action)
+			}
+			continue
+		}
+		for _, decision := range batch[start:end] {
+			if action == "add" {
+				c.setActive(decisionToDecisionKey(decision), decision)
+			} else {
+				c.removeActive(decisionToDecisionKey(decision), decision)
+			}
+		}
+	}
+
 	return nil
 }
 
-func (*CustomBouncer) ShutDown() error {
+// execChunk calls the binary with "add-batch" or "del-batch" for the decisions.
+func (c *CustomBouncer) execChunk(ctx context.Context, verb string, decisions []*models.Decision) error {
+	var buf []byte
+	for _, decision := range decisions {
+		var err error
+		buf, err = jsonEncoder{}.appendDecision(buf, decision, "")
+		if err != nil {
+			log.Warningf("serialize: %s", err)
+			continue
+		}
+	}
+
+	if err := c.limiter.wait(ctx, strings.TrimSuffix(verb, "-batch")); err != nil {
+		return err
+	}
+
+	log.Debugf("custom [%s] : %s with %d decisions", c.Path, verb, len(decisions))
+	cmd := exec.CommandContext(ctx, c.Path, verb)
+	cmd.Stdin = bytes.NewReader(buf)
+	out, err := runCommand(cmd, verb)
+	if err != nil {
+		log.Errorf("Error in '%s' command (%s): %v --> %s", verb, cmd.String(), err, string(out))
+	}
+	return err
+}
+
+// runCommand runs a live mode command, and records its duration and failure.
+func runCommand(cmd *exec.Cmd, action string) ([]byte, error) {
+	start := time.Now()
+	out, err := cmd.CombinedOutput()
+	metrics.ExecDuration.WithLabelValues(action).Observe(time.Since(start).Seconds())
+	if err != nil {
+		metrics.ExecFailures.WithLabelValues(action).Inc()
+	}
+	return out, err
+}
+
+func (c *CustomBouncer) ShutDown() error {
+	if c.journal != nil {
+		return c.journal.close()
+	}
 	return nil
 }
 
 func serializeDecision(decision *models.Decision, action string) (string, error) {
-	d := DecisionWithAction{Decision: *decision, Action: action, ID: decision.ID}
-	serbyte, err := json.Marshal(d)
+	buf := getBuffer()
+	defer putBuffer(buf)
+
+	serbyte, err := appendDecisionJSON(*buf, decision, action)
+	*buf = serbyte
 	if err != nil {
 		return "", fmt.Errorf("serialize error : %w", err)
 	}
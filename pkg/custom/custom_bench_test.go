@@ -0,0 +1,217 @@
+package custom_test
+
+import (
+	"fmt"
+	"io"
+	"os"
+	"testing"
+
+	"github.com/crowdsecurity/crowdsec/pkg/models"
+
+	"github.com/crowdsecurity/cs-custom-bouncer/pkg/cfg"
+	"github.com/crowdsecurity/cs-custom-bouncer/pkg/custom"
+)
+
+const noopBinaryPath = "./testdata/custom-noop"
+
+// benchmark sizes, in number of decisions per batch
+var benchSizes = []int{1_000, 10_000, 100_000}
+
+// syntheticDecisions returns n decisions with distinct values.
+func syntheticDecisions(n int) []*models.Decision {
+	origin := "CAPI"
+	scope := "Ip"
+	ret := make([]*models.Decision, n)
+	for i := range ret {
+		value := fmt.Sprintf("10.%d.%d.%d", (i>>16)&0xff, (i>>8)&0xff, i&0xff)
+		ret[i] = &models.Decision{
+			ID:       int64(i + 1),
+			Duration: &durationWithUnit,
+			Value:    &value,
+			Scenario: &sceanario,
+			Type:     &decisionType,
+			Scope:    &scope,
+			Origin:   &origin,
+		}
+	}
+	return ret
+}
+
+// reportThroughput adds the decisions/s metric, for b.N batches of n decisions.
+func reportThroughput(b *testing.B, n int) {
+	b.ReportMetric(float64(n)*float64(b.N)/b.Elapsed().Seconds(), "decisions/s")
+}
+
+// newBenchBouncer returns a bouncer that feeds /dev/null in stdin mode,
+// or calls a script that does nothing in live mode.
+func newBenchBouncer(b *testing.B, config *cfg.SinkConfig) *custom.CustomBouncer {
+	b.Helper()
+
+	c, err := custom.NewCustomBouncer(config)
+	if err != nil {
+		b.Fatal(err)
+	}
+	if err := c.Init(); err != nil {
+		b.Fatal(err)
+	}
+
+	if config.FeedViaStdin {
+		devNull, err := os.OpenFile(os.DevNull, os.O_WRONLY, 0)
+		if err != nil {
+			b.Fatal(err)
+		}
+		b.Cleanup(func() { devNull.Close() })
+		if _, err := c.SetStdin(devNull); err != nil {
+			b.Fatal(err)
+		}
+	}
+
+	return c
+}
+
+// Benchmark_StdinFormat measures the cost of sending a decision in stdin mode,
+// with each stdin_format, to a sink that discards everything.
+func Benchmark_StdinFormat(b *testing.B) {
+	for _, format := range []string{"json", "tsv", "binary"} {
+		b.Run(format, func(b *testing.B) {
+			c, err := custom.NewCustomBouncer(&cfg.SinkConfig{
+				BinPath:         binaryPath,
+				FeedViaStdin:    true,
+				StdinFormat:     format,
+				StdinBufferSize: 64 * 1024,
+			})
+			if err != nil {
+				b.Fatal(err)
+			}
+			if err := c.Init(); err != nil {
+				b.Fatal(err)
+			}
+			if _, err := c.SetStdin(io.Discard); err != nil {
+				b.Fatal(err)
+			}
+			decisions := syntheticDecisions(b.N)
+			ctx := b.Context()
+
+			b.ReportAllocs()
+			b.ResetTimer()
+			for _, d := range decisions {
+				if err := c.Add(ctx, d); err != nil {
+					b.Fatal(err)
+				}
+			}
+			reportThroughput(b, 1)
+		})
+	}
+}
+
+// Benchmark_CustomBouncer runs Add then Delete for batches of decisions,
+// in stdin and live mode. Each op is a full batch.
+func Benchmark_CustomBouncer(b *testing.B) {
+	modes := []struct {
+		name   string
+		config cfg.SinkConfig
+	}{
+		{name: "stdin", config: cfg.SinkConfig{BinPath: noopBinaryPath, FeedViaStdin: true, StdinBufferSize: 64 * 1024}},
+		{name: "live", config: cfg.SinkConfig{BinPath: noopBinaryPath}},
+		{name: "live-batch", config: cfg.SinkConfig{BinPath: noopBinaryPath, BatchExec: true, MaxBatchSize: 1000}},
+	}
+
+	for _, mode := range modes {
+		for _, size := range benchSizes {
+			for _, action := range []string{"add", "del"} {
+				b.Run(fmt.Sprintf("%s/%s/%d", mode.name, action, size), func(b *testing.B) {
+					config := mode.config
+					c := newBenchBouncer(b, &config)
+					decisions := syntheticDecisions(size)
+					ctx := b.Context()
+
+					b.ReportAllocs()
+					b.ResetTimer()
+					for i := 0; i < b.N; i++ {
+						b.StopTimer()
+						c.ResetCache()
+						b.StartTimer()
+
+						var err error
+						switch {
+						case c.BatchExec() && action == "add":
+							err = c.AddBatch(ctx, decisions)
+						case c.BatchExec():
+							err = c.DeleteBatch(ctx, decisions)
+						default:
+							for _, d := range decisions {
+								if action == "add" {
+									err = c.Add(ctx, d)
+								} else {
+									err = c.Delete(ctx, d)
+								}
+								if err != nil {
+									break
+								}
+							}
+						}
+						if err != nil {
+							b.Fatal(err)
+						}
+						if err := c.FlushStdin(); err != nil {
+							b.Fatal(err)
+						}
+					}
+					reportThroughput(b, size)
+				})
+			}
+		}
+	}
+}
+
+// Benchmark_CacheHit measures decisions that are skipped because they have just been sent.
+func Benchmark_CacheHit(b *testing.B) {
+	for _, size := range benchSizes {
+		b.Run(fmt.Sprint(size), func(b *testing.B) {
+			c := newBenchBouncer(b, &cfg.SinkConfig{BinPath: noopBinaryPath, FeedViaStdin: true})
+			decisions := syntheticDecisions(size)
+			ctx := b.Context()
+			for _, d := range decisions {
+				if err := c.Add(ctx, d); err != nil {
+					b.Fatal(err)
+				}
+			}
+
+			b.ReportAllocs()
+			b.ResetTimer()
+			for i := 0; i < b.N; i++ {
+				for _, d := range decisions {
+					if err := c.Add(ctx, d); err != nil {
+						b.Fatal(err)
+					}
+				}
+			}
+			reportThroughput(b, size)
+		})
+	}
+}
+
+// Benchmark_ResetCache measures clearing caches of various sizes.
+func Benchmark_ResetCache(b *testing.B) {
+	for _, size := range benchSizes {
+		b.Run(fmt.Sprint(size), func(b *testing.B) {
+			c := newBenchBouncer(b, &cfg.SinkConfig{BinPath: noopBinaryPath, FeedViaStdin: true})
+			decisions := syntheticDecisions(size)
+			ctx := b.Context()
+
+			b.ReportAllocs()
+			b.ResetTimer()
+			for i := 0; i < b.N; i++ {
+				b.StopTimer()
+				for _, d := range decisions {
+					if err := c.Add(ctx, d); err != nil {
+						b.Fatal(err)
+					}
+				}
+				b.StartTimer()
+				c.ResetCache()
+			}
+			reportThroughput(b, size)
+		})
+	}
+}
@@ -0,0 +1,106 @@
+package custom
+
+import (
+	"fmt"
+	"testing"
+	"time"
+
+	"github.com/crowdsecurity/crowdsec/pkg/models"
+)
+
+func benchDecision() *models.Decision {
+	duration := "3h59m58s"
+	origin := "CAPI"
+	scenario := "crowdsecurity/ssh-bf"
+	scope := "Ip"
+	decisionType := "ban"
+	value := "192.168.100.200"
+
+	return &models.Decision{
+		ID:       1234567,
+		Duration: &duration,
+		Origin:   &origin,
+		Scenario: &scenario,
+		Scope:    &scope,
+		Type:     &decisionType,
+		Value:    &value,
+	}
+}
+
+func Benchmark_serializeDecision(b *testing.B) {
+	d := benchDecision()
+
+	b.ReportAllocs()
+	b.ResetTimer()
+	for i := 0; i < b.N; i++ {
+		if _, err := serializeDecision(d, "add"); err != nil {
+			b.Fatal(err)
+		}
+	}
+	b.ReportMetric(float64(b.N)/b.Elapsed().Seconds(), "decisions/s")
+}
+
+func Benchmark_appendDecisionJSON(b *testing.B) {
+	d := benchDecision()
+	buf := make([]byte, 0, 512)
+
+	b.ReportAllocs()
+	b.ResetTimer()
+	for i := 0; i < b.N; i++ {
+		var err error
+		if buf, err = appendDecisionJSON(buf[:0], d, "add"); err != nil {
+			b.Fatal(err)
+		}
+	}
+	b.ReportMetric(float64(b.N)/b.Elapsed().Seconds(), "decisions/s")
+}
+
+func Benchmark_decisionCache(b *testing.B) {
+	for _, size := range []int{1_000, 10_000, 100_000} {
+		keys := make([]DecisionKey, size)
+		for i := range keys {
+			keys[i] = DecisionKey{Value: fmt.Sprintf("10.%d.%d.%d", (i>>16)&0xff, (i>>8)&0xff, i&0xff), Type: "ban"}
+		}
+
+		b.Run(fmt.Sprintf("miss/%d", size), func(b *testing.B) {
+			var cache decisionCache
+			cache.configure(time.Hour, 0)
+
+			b.ReportAllocs()
+			b.ResetTimer()
+			for i := 0; i < b.N; i++ {
+				if i%size == 0 {
+					b.StopTimer()
+					cache.reset()
+					b.StartTimer()
+				}
+				cache.testAndAdd(keys[i%size])
+			}
+		})
+
+		b.Run(fmt.Sprintf("hit/%d", size), func(b *testing.B) {
+			var cache decisionCache
+			cache.configure(time.Hour, 0)
+			for _, key := range keys {
+				cache.add(key)
+			}
+
+			b.ReportAllocs()
+			b.ResetTimer()
+			for i := 0; i < b.N; i++ {
+				cache.has(keys[i%size])
+			}
+		})
+
+		b.Run(fmt.Sprintf("lru-evict/%d", size), func(b *testing.B) {
+			var cache decisionCache
+			cache.configure(time.Hour, size/2)
+
+			b.ReportAllocs()
+			b.ResetTimer()
+			for i := 0; i < b.N; i++ {
+				cache.add(keys[i%size])
+			}
+		})
+	}
+}
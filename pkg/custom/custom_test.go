@@ -1,19 +1,30 @@
 package custom_test
 
 import (
+	"bytes"
+	"context"
+	"encoding/binary"
+	"encoding/json"
+	"errors"
 	"fmt"
+	"io"
 	"os"
 	"reflect"
 	"strings"
 	"testing"
+	"time"
+
+	log "github.com/sirupsen/logrus"
 
 	"github.com/crowdsecurity/crowdsec/pkg/models"
 
+	"github.com/crowdsecurity/cs-custom-bouncer/pkg/cfg"
 	"github.com/crowdsecurity/cs-custom-bouncer/pkg/custom"
 )
 
 const (
 	binaryPath       = "./testdata/custom-live"
+	batchBinaryPath  = "./testdata/custom-batch"
 	binaryOutputFile = "./data.txt"
 )
 
@@ -23,6 +34,7 @@ var (
 	sceanario         = "crowdsec/bruteforce"
 	ip1               = "1.2.3.4"
 	ip2               = "1.2.3.5"
+	ip3               = "1.2.3.6"
 	decisionType      = "IP"
 )
 
@@ -294,3 +306,1712 @@ func Test_CustomBouncer_Delete(t *testing.T) {
 		})
 	}
 }
+
+func readLines(path string) []string {
+	dat, err := os.ReadFile(path)
+	if err != nil {
+		panic(err)
+	}
+	return strings.Split(strings.TrimSpace(string(dat)), "\n")
+}
+
+func Test_CustomBouncer_Batch(t *testing.T) {
+	ctx := t.Context()
+
+	decisions := []*models.Decision{
+		{Duration: &durationWithUnit, Value: &ip1, Scenario: &sceanario, Type: &decisionType},
+		{Duration: &durationWithUnit, Value: &ip2, Scenario: &sceanario, Type: &decisionType},
+		{Duration: &durationWithUnit, Value: &ip1, Scenario: &sceanario, Type: &decisionType},
+		{Duration: &durationWithUnit, Value: &ip3, Scenario: &sceanario, Type: &decisionType},
+	}
+
+	tests := []struct {
+		name          string
+		maxBatchSize  int
+		expectedLines []string
+	}{
+		{
+			name:          "single batch",
+			maxBatchSize:  10,
+			expectedLines: []string{"add-batch 3", "del-batch 3"},
+		},
+		{
+			name:          "split batches",
+			maxBatchSize:  2,
+			expectedLines: []string{"add-batch 2", "add-batch 1", "del-batch 2", "del-batch 1"},
+		},
+	}
+	for _, tt := range tests {
+		t.Run(tt.name, func(t *testing.T) {
+			defer cleanup()
+			c, err := custom.NewCustomBouncer(&cfg.SinkConfig{
+				BinPath:      batchBinaryPath,
+				BatchExec:    true,
+				MaxBatchSize: tt.maxBatchSize,
+			})
+			if err != nil {
+				t.Fatal(err)
+			}
+			if err := c.Init(); err != nil {
+				t.Fatal(err)
+			}
+			if err := c.AddBatch(ctx, decisions); err != nil {
+				t.Error(err)
+			}
+			if err := c.DeleteBatch(ctx, decisions); err != nil {
+				t.Error(err)
+			}
+			foundData := readLines(binaryOutputFile)
+			if !reflect.DeepEqual(foundData, tt.expectedLines) {
+				t.Errorf("expected=%v, found=%v", tt.expectedLines, foundData)
+			}
+		})
+	}
+}
+
+func Test_ExecPool_KeyOrdering(t *testing.T) {
+	ctx := t.Context()
+	defer cleanup()
+
+	c, err := custom.NewCustomBouncer(&cfg.SinkConfig{
+		BinPath:           binaryPath,
+		MaxConcurrentExec: 4,
+	})
+	if err != nil {
+		t.Fatal(err)
+	}
+	if err := c.Init(); err != nil {
+		t.Fatal(err)
+	}
+
+	pool := c.NewExecPool(ctx)
+	if pool == nil {
+		t.Fatal("expected a pool")
+	}
+
+	values := make([]string, 20)
+	for i := range values {
+		values[i] = fmt.Sprintf("10.0.0.%d", i)
+		d := &models.Decision{Duration: &durationWithUnit, Value: &values[i], Scenario: &sceanario, Type: &decisionType}
+		pool.Submit("add", d, time.Now())
+		pool.Submit("del", d, time.Now())
+	}
+	pool.Close()
+
+	seen := make(map[string][]string)
+	for _, line := range parseFile(binaryOutputFile) {
+		seen[line.value] = append(seen[line.value], line.action)
+	}
+	for _, value := range values {
+		if !reflect.DeepEqual(seen[value], []string{"add", "del"}) {
+			t.Errorf("%s: expected=[add del], found=%v", value, seen[value])
+		}
+	}
+}
+
+func Test_StdinWriter(t *testing.T) {
+	var out bytes.Buffer
+
+	w := custom.NewStdinWriter(&out, 16, time.Hour, time.Second)
+
+	fmt.Fprintln(w, "12345")
+	if out.Len() != 0 {
+		t.Errorf("expected buffered line, found=%q", out.String())
+	}
+
+	// exceeds the buffer size
+	fmt.Fprintln(w, "6789abcdefghij")
+	if out.Len() == 0 {
+		t.Error("expected a write when the buffer is full")
+	}
+
+	if err := w.Flush(); err != nil {
+		t.Fatal(err)
+	}
+	if out.String() != "12345\n6789abcdefghij\n" {
+		t.Errorf("found=%q", out.String())
+	}
+}
+
+func Test_StdinWriter_Stalled(t *testing.T) {
+	r, pw, err := os.Pipe()
+	if err != nil {
+		t.Fatal(err)
+	}
+	defer r.Close()
+	defer pw.Close()
+
+	w := custom.NewStdinWriter(pw, 4096, time.Hour, 100*time.Millisecond)
+
+	// nobody reads the pipe, it will be full at some point
+	line := strings.Repeat("x", 1023)
+	for i := 0; i < 1024; i++ {
+		if _, err = fmt.Fprintln(w, line); err != nil {
+			break
+		}
+	}
+	if err == nil {
+		err = w.Flush()
+	}
+
+	if !errors.Is(err, custom.ErrStalledConsumer) {
+		t.Fatalf("expected ErrStalledConsumer, found=%v", err)
+	}
+
+	select {
+	case <-w.Stalled():
+	default:
+		t.Error("expected Stalled() to be closed")
+	}
+}
+
+func Test_CustomBouncer_Replay(t *testing.T) {
+	ctx := t.Context()
+
+	c, err := custom.NewCustomBouncer(&cfg.SinkConfig{
+		BinPath:         binaryPath,
+		FeedViaStdin:    true,
+		ReplayOnRestart: true,
+	})
+	if err != nil {
+		t.Fatal(err)
+	}
+	if err := c.Init(); err != nil {
+		t.Fatal(err)
+	}
+
+	var first, second bytes.Buffer
+
+	if _, err := c.SetStdin(&first); err != nil {
+		t.Fatal(err)
+	}
+
+	d1 := &models.Decision{Duration: &durationWithUnit, Value: &ip1, Scenario: &sceanario, Type: &decisionType}
+	d2 := &models.Decision{Duration: &durationWithUnit, Value: &ip2, Scenario: &sceanario, Type: &decisionType}
+
+	for _, err := range []error{c.Add(ctx, d1), c.Add(ctx, d2), c.Delete(ctx, d1), c.FlushStdin()} {
+		if err != nil {
+			t.Fatal(err)
+		}
+	}
+
+	// the program has been restarted
+	if _, err := c.SetStdin(&second); err != nil {
+		t.Fatal(err)
+	}
+
+	lines := strings.Split(strings.TrimSpace(second.String()), "\n")
+	if len(lines) != 2 {
+		t.Fatalf("expected 2 lines, found=%q", second.String())
+	}
+	if !strings.Contains(lines[0], `"value":"`+ip2+`"`) || !strings.Contains(lines[0], `"action":"add"`) {
+		t.Errorf("expected add for %s, found=%s", ip2, lines[0])
+	}
+	if lines[1] != `{"action":"snapshot-end","count":1}` {
+		t.Errorf("expected snapshot marker, found=%s", lines[1])
+	}
+}
+
+func Test_CustomBouncer_Cache(t *testing.T) {
+	ctx := t.Context()
+
+	d1 := &models.Decision{Duration: &durationWithUnit, Value: &ip1, Scenario: &sceanario, Type: &decisionType}
+	d2 := &models.Decision{Duration: &durationWithUnit, Value: &ip2, Scenario: &sceanario, Type: &decisionType}
+
+	tests := []struct {
+		name           string
+		retention      time.Duration
+		maxEntries     int
+		run            func(c *custom.CustomBouncer) error
+		expectedAction []string
+	}{
+		{
+			name:      "expired entry",
+			retention: 50 * time.Millisecond,
+			run: func(c *custom.CustomBouncer) error {
+				if err := c.Add(ctx, d1); err != nil {
+					return err
+				}
+				if err := c.Add(ctx, d1); err != nil {
+					return err
+				}
+				time.Sleep(60 * time.Millisecond)
+				return c.Add(ctx, d1)
+			},
+			expectedAction: []string{"add", "add"},
+		},
+		{
+			name:       "evicted entry",
+			retention:  time.Hour,
+			maxEntries: 1,
+			run: func(c *custom.CustomBouncer) error {
+				for _, d := range []*models.Decision{d1, d2, d1} {
+					if err := c.Add(ctx, d); err != nil {
+						return err
+					}
+				}
+				return nil
+			},
+			expectedAction: []string{"add", "add", "add"},
+		},
+		{
+			name:      "add after delete",
+			retention: time.Hour,
+			run: func(c *custom.CustomBouncer) error {
+				if err := c.Add(ctx, d1); err != nil {
+					return err
+				}
+				if err := c.Delete(ctx, d1); err != nil {
+					return err
+				}
+				return c.Add(ctx, d1)
+			},
+			expectedAction: []string{"add", "del", "add"},
+		},
+	}
+	for _, tt := range tests {
+		t.Run(tt.name, func(t *testing.T) {
+			defer cleanup()
+			c, err := custom.NewCustomBouncer(&cfg.SinkConfig{
+				BinPath:                binaryPath,
+				CacheRetentionDuration: tt.retention,
+				CacheMaxEntries:        tt.maxEntries,
+			})
+			if err != nil {
+				t.Fatal(err)
+			}
+			if err := c.Init(); err != nil {
+				t.Fatal(err)
+			}
+			if err := tt.run(c); err != nil {
+				t.Fatal(err)
+			}
+			found := []string{}
+			for _, line := range parseFile(binaryOutputFile) {
+				found = append(found, line.action)
+			}
+			if !reflect.DeepEqual(found, tt.expectedAction) {
+				t.Errorf("expected=%v, found=%v", tt.expectedAction, found)
+			}
+		})
+	}
+}
+
+func Test_Coalescer(t *testing.T) {
+	ctx := t.Context()
+
+	newDecision := func(id int64, value *string) *models.Decision {
+		return &models.Decision{ID: id, Duration: &durationWithUnit, Value: value, Scenario: &sceanario, Type: &decisionType}
+	}
+
+	active := newDecision(1, &ip1)
+
+	type batch struct {
+		deleted []*models.Decision
+		added   []*models.Decision
+	}
+
+	tests := []struct {
+		name            string
+		batches         []batch
+		expectedDeleted []int64
+		expectedAdded   []int64
+	}{
+		{
+			name:    "added and deleted in the same batch",
+			batches: []batch{{deleted: []*models.Decision{newDecision(2, &ip2)}, added: []*models.Decision{newDecision(2, &ip2)}}},
+		},
+		{
+			name:          "added, deleted, added again",
+			batches:       []batch{{added: []*models.Decision{newDecision(2, &ip2)}}, {deleted: []*models.Decision{newDecision(2, &ip2)}}, {added: []*models.Decision{newDecision(3, &ip2)}}},
+			expectedAdded: []int64{3},
+		},
+		{
+			name:            "unknown deletion",
+			batches:         []batch{{deleted: []*models.Decision{newDecision(2, &ip2)}}},
+			expectedDeleted: []int64{2},
+		},
+		{
+			name:    "active decision",
+			batches: []batch{{added: []*models.Decision{newDecision(1, &ip1)}}},
+		},
+		{
+			name:            "replaced decision",
+			batches:         []batch{{deleted: []*models.Decision{newDecision(1, &ip1)}, added: []*models.Decision{newDecision(4, &ip1)}}},
+			expectedDeleted: []int64{1},
+			expectedAdded:   []int64{4},
+		},
+		{
+			name:            "replaced with the same id",
+			batches:         []batch{{deleted: []*models.Decision{newDecision(1, &ip1)}}, {added: []*models.Decision{newDecision(1, &ip1)}}},
+			expectedDeleted: []int64{1},
+			expectedAdded:   []int64{1},
+		},
+		{
+			name:            "deleted active decision",
+			batches:         []batch{{added: []*models.Decision{newDecision(4, &ip1)}}, {deleted: []*models.Decision{newDecision(4, &ip1)}}},
+			expectedDeleted: []int64{4},
+		},
+	}
+	for _, tt := range tests {
+		t.Run(tt.name, func(t *testing.T) {
+			c, err := custom.NewCustomBouncer(&cfg.SinkConfig{BinPath: binaryPath, FeedViaStdin: true})
+			if err != nil {
+				t.Fatal(err)
+			}
+			if err := c.Init(); err != nil {
+				t.Fatal(err)
+			}
+			if _, err := c.SetStdin(io.Discard); err != nil {
+				t.Fatal(err)
+			}
+			if err := c.Add(ctx, active); err != nil {
+				t.Fatal(err)
+			}
+
+			co := c.NewCoalescer()
+			for _, b := range tt.batches {
+				co.Push(b.deleted, b.added)
+			}
+			deleted, added := co.Flush()
+
+			ids := func(decisions []*models.Decision) []int64 {
+				var ret []int64
+				for _, d := range decisions {
+					ret = append(ret, d.ID)
+				}
+				return ret
+			}
+			if !reflect.DeepEqual(ids(deleted), tt.expectedDeleted) {
+				t.Errorf("deleted: expected=%v, found=%v", tt.expectedDeleted, ids(deleted))
+			}
+			if !reflect.DeepEqual(ids(added), tt.expectedAdded) {
+				t.Errorf("added: expected=%v, found=%v", tt.expectedAdded, ids(added))
+			}
+		})
+	}
+}
+
+func Test_CustomBouncer_StdinFormat(t *testing.T) {
+	ctx := t.Context()
+
+	origin := "crowdsec"
+	scope := "Ip"
+	decision := &models.Decision{ID: 42, Duration: &durationWithUnit, Value: &ip1, Scenario: &sceanario, Type: &decisionType, Scope: &scope, Origin: &origin}
+
+	binaryFrame := func(op byte, id, seconds int64, strs ...string) []byte {
+		var body bytes.Buffer
+		body.WriteByte(op)
+		binary.Write(&body, binary.BigEndian, id)
+		binary.Write(&body, binary.BigEndian, seconds)
+		for _, s := range strs {
+			binary.Write(&body, binary.BigEndian, uint16(len(s)))
+			body.WriteString(s)
+		}
+		frame := binary.BigEndian.AppendUint32(nil, uint32(body.Len()))
+		return append(frame, body.Bytes()...)
+	}
+
+	tests := []struct {
+		name      string
+		format    string
+		tsvFields []string
+		expected  []byte
+	}{
+		{
+			name:     "tsv, default fields",
+			format:   "tsv",
+			expected: []byte("add\t1.2.3.4\t1200\tIP\tIp\tcrowdsec/bruteforce\ndel\t1.2.3.4\t1200\tIP\tIp\tcrowdsec/bruteforce\n"),
+		},
+		{
+			name:      "tsv, custom fields",
+			format:    "tsv",
+			tsvFields: []string{"id", "action", "value", "origin"},
+			expected:  []byte("42\tadd\t1.2.3.4\tcrowdsec\n42\tdel\t1.2.3.4\tcrowdsec\n"),
+		},
+		{
+			name:   "binary",
+			format: "binary",
+			expected: append(
+				binaryFrame('a', 42, 1200, ip1, decisionType, scope, sceanario, origin),
+				binaryFrame('d', 42, 1200, ip1, decisionType, scope, sceanario, origin)...),
+		},
+	}
+	for _, tt := range tests {
+		t.Run(tt.name, func(t *testing.T) {
+			c, err := custom.NewCustomBouncer(&cfg.SinkConfig{
+				BinPath:        binaryPath,
+				FeedViaStdin:   true,
+				StdinFormat:    tt.format,
+				StdinTSVFields: tt.tsvFields,
+			})
+			if err != nil {
+				t.Fatal(err)
+			}
+			if err := c.Init(); err != nil {
+				t.Fatal(err)
+			}
+			var out bytes.Buffer
+			if _, err := c.SetStdin(&out); err != nil {
+				t.Fatal(err)
+			}
+			if err := c.Add(ctx, decision); err != nil {
+				t.Fatal(err)
+			}
+			if err := c.Delete(ctx, decision); err != nil {
+				t.Fatal(err)
+			}
+			if err := c.FlushStdin(); err != nil {
+				t.Fatal(err)
+			}
+			if !bytes.Equal(out.Bytes(), tt.expected) {
+				t.Errorf("expected=%q, found=%q", tt.expected, out.Bytes())
+			}
+		})
+	}
+
+	if _, err := custom.NewCustomBouncer(&cfg.SinkConfig{StdinFormat: "tsv", StdinTSVFields: []string{"nope"}}); err == nil {
+		t.Error("expected an error for an unknown tsv field")
+	}
+}
+
+func Test_CustomBouncer_JSONCompat(t *testing.T) {
+	ctx := t.Context()
+
+	str := func(s string) *string { return &s }
+	simulated := true
+
+	decisions := []*models.Decision{
+		{Duration: &durationWithUnit, Value: &ip1, Scenario: &sceanario, Type: &decisionType},
+		{
+			ID:        12345,
+			Duration:  str("3h59m58.123s"),
+			Origin:    str("cscli"),
+			Scenario:  str(`manual 'ban' from "<sid>" & co`),
+			Scope:     str("Range"),
+			Simulated: &simulated,
+			Type:      str("ban"),
+			Until:     "2026-10-18T12:00:00Z",
+			UUID:      "ab6f8f10-1b8f-4b0a-9e08-5b8d2c2f0e1c",
+			Value:     str("2001:db8::/32"),
+		},
+		{ID: 1, Duration: str("1s"), Value: str("weird\t\n\r\x01\x7f\\ \u2028\u2029 \xff \u00e9 \u65e5\u672c"), Scenario: str(""), Type: str("captcha")},
+	}
+
+	c, err := custom.NewCustomBouncer(&cfg.SinkConfig{BinPath: binaryPath, FeedViaStdin: true})
+	if err != nil {
+		t.Fatal(err)
+	}
+	if err := c.Init(); err != nil {
+		t.Fatal(err)
+	}
+
+	for _, action := range []string{"add", "del"} {
+		for _, d := range decisions {
+			var out bytes.Buffer
+			if _, err := c.SetStdin(&out); err != nil {
+				t.Fatal(err)
+			}
+			c.ResetCache()
+			if action == "add" {
+				err = c.Add(ctx, d)
+			} else {
+				err = c.Delete(ctx, d)
+			}
+			if err != nil {
+				t.Fatal(err)
+			}
+			if err := c.FlushStdin(); err != nil {
+				t.Fatal(err)
+			}
+			expected, err := json.Marshal(custom.DecisionWithAction{Decision: *d, ID: d.ID, Action: action})
+			if err != nil {
+				t.Fatal(err)
+			}
+			expected = append(expected, '\n')
+			if !bytes.Equal(out.Bytes(), expected) {
+				t.Errorf("expected=%s, found=%s", expected, out.Bytes())
+			}
+		}
+	}
+}
+
+func Test_CustomBouncer_StateJournal(t *testing.T) {
+	defer cleanup()
+
+	ctx := t.Context()
+	stateDir := t.TempDir()
+
+	newBouncer := func() *custom.CustomBouncer {
+		c, err := custom.NewCustomBouncer(&cfg.SinkConfig{
+			BinPath:      binaryPath,
+			FeedViaStdin: true,
+			StateDir:     stateDir,
+		})
+		if err != nil {
+			t.Fatal(err)
+		}
+		if err := c.Init(); err != nil {
+			t.Fatal(err)
+		}
+		if err := c.OpenState(); err != nil {
+			t.Fatal(err)
+		}
+		if _, err := c.SetStdin(io.Discard); err != nil {
+			t.Fatal(err)
+		}
+		return c
+	}
+
+	d1 := &models.Decision{ID: 1, Duration: &durationWithUnit, Value: &ip1, Scenario: &sceanario, Type: &decisionType}
+	d2 := &models.Decision{ID: 2, Duration: &durationWithUnit, Value: &ip2, Scenario: &sceanario, Type: &decisionType}
+	d3 := &models.Decision{ID: 3, Duration: &durationWithUnit, Value: &ip3, Scenario: &sceanario, Type: &decisionType}
+	d1bis := &models.Decision{ID: 4, Duration: &durationWithUnit, Value: &ip1, Scenario: &sceanario, Type: &decisionType}
+
+	c := newBouncer()
+	for _, err := range []error{c.Add(ctx, d1), c.Add(ctx, d2), c.Add(ctx, d3), c.Delete(ctx, d3), c.SyncState(), c.ShutDown()} {
+		if err != nil {
+			t.Fatal(err)
+		}
+	}
+
+	// simulate a crash in the middle of a write
+	f, err := os.OpenFile(stateDir+"/decisions.journal", os.O_WRONLY|os.O_APPEND, 0)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if _, err := f.WriteString(`{"duration":"1200s","orig`); err != nil {
+		t.Fatal(err)
+	}
+	f.Close()
+
+	c = newBouncer()
+	defer c.ShutDown()
+
+	// d1 has been replaced, d2 is unchanged, d3 is new again
+	deleted, added := c.Reconcile(nil, []*models.Decision{d1bis, d2, d3})
+	if len(deleted) != 0 {
+		t.Errorf("expected no deletion, found=%d", len(deleted))
+	}
+	if !reflect.DeepEqual(added, []*models.Decision{d1bis, d3}) {
+		t.Errorf("expected %s and %s to be added, found=%d decisions", *d1bis.Value, *d3.Value, len(added))
+	}
+
+	// the second batch is incremental
+	deleted, added = c.Reconcile(nil, []*models.Decision{d2})
+	if len(deleted) != 0 || len(added) != 1 {
+		t.Errorf("expected the batch to be unchanged, found=%d deleted, %d added", len(deleted), len(added))
+	}
+
+	for _, err := range []error{c.Add(ctx, d1bis), c.SyncState(), c.ShutDown()} {
+		if err != nil {
+			t.Fatal(err)
+		}
+	}
+
+	c = newBouncer()
+
+	// d2 is not active anymore, d1 is back
+	deleted, added = c.Reconcile(nil, []*models.Decision{d1})
+	if len(deleted) != 1 || *deleted[0].Value != ip2 {
+		t.Errorf("expected %s to be deleted, found=%d deletions", ip2, len(deleted))
+	}
+	if len(added) != 1 {
+		t.Errorf("expected %s to be added, found=%d decisions", ip1, len(added))
+	}
+
+	// the failed commands are not journaled, they are sent again after a restart
+	liveDir := t.TempDir()
+	openLive := func(path string) *custom.CustomBouncer {
+		c, err := custom.NewCustomBouncer(&cfg.SinkConfig{BinPath: path, StateDir: liveDir})
+		if err != nil {
+			t.Fatal(err)
+		}
+		if err := c.OpenState(); err != nil {
+			t.Fatal(err)
+		}
+		return c
+	}
+
+	c = openLive("/bin/false")
+	for _, err := range []error{c.Add(ctx, d1), c.AddBatch(ctx, []*models.Decision{d2}), c.SyncState(), c.ShutDown()} {
+		if err != nil {
+			t.Fatal(err)
+		}
+	}
+
+	c = openLive(binaryPath)
+	if _, added := c.Reconcile(nil, []*models.Decision{d1, d2}); len(added) != 2 {
+		t.Errorf("expected the failed adds to be sent again, found=%d decisions", len(added))
+	}
+	for _, err := range []error{c.Add(ctx, d1), c.AddBatch(ctx, []*models.Decision{d2}), c.SyncState(), c.ShutDown()} {
+		if err != nil {
+			t.Fatal(err)
+		}
+	}
+
+	c = openLive("/bin/false")
+	for _, err := range []error{c.Delete(ctx, d1), c.DeleteBatch(ctx, []*models.Decision{d2}), c.SyncState(), c.ShutDown()} {
+		if err != nil {
+			t.Fatal(err)
+		}
+	}
+
+	c = openLive(binaryPath)
+	defer c.ShutDown()
+
+	if deleted, _ := c.Reconcile(nil, nil); len(deleted) != 2 {
+		t.Errorf("expected the failed deletions to be sent again, found=%d decisions", len(deleted))
+	}
+}
+
+func Test_CustomBouncer_BulkLoad(t *testing.T) {
+	ctx := t.Context()
+	bulkFile := t.TempDir() + "/bulk"
+
+	d1 := &models.Decision{ID: 1, Duration: &durationWithUnit, Value: &ip1, Scenario: &sceanario, Type: &decisionType}
+	d2 := &models.Decision{ID: 2, Duration: &durationWithUnit, Value: &ip2, Scenario: &sceanario, Type: &decisionType}
+	d3 := &models.Decision{ID: 3, Duration: &durationWithUnit, Value: &ip3, Scenario: &sceanario, Type: &decisionType}
+
+	t.Run("stdin", func(t *testing.T) {
+		c, err := custom.NewCustomBouncer(&cfg.SinkConfig{
+			BinPath:         binaryPath,
+			FeedViaStdin:    true,
+			StdinFormat:     "tsv",
+			StdinTSVFields:  []string{"action", "value"},
+			ReplayOnRestart: true,
+			BulkLoadFile:    bulkFile,
+		})
+		if err != nil {
+			t.Fatal(err)
+		}
+
+		var stdin bytes.Buffer
+		if _, err := c.SetStdin(&stdin); err != nil {
+			t.Fatal(err)
+		}
+		stdin.Reset()
+
+		// d3 has expired since it's been added
+		if err := c.BulkLoad(ctx, []*models.Decision{d3}, []*models.Decision{d1, d2, d3}); err != nil {
+			t.Fatal(err)
+		}
+
+		if stdin.String() != "bulk-load\t2\t"+bulkFile+"\n" {
+			t.Errorf("expected bulk-load marker, found=%q", stdin.String())
+		}
+
+		content, err := os.ReadFile(bulkFile)
+		if err != nil {
+			t.Fatal(err)
+		}
+		if string(content) != "add\t"+ip1+"\nadd\t"+ip2+"\n" {
+			t.Errorf("unexpected bulk file content: %q", content)
+		}
+
+		// the loaded decisions are active
+		stdin.Reset()
+		if _, err := c.SetStdin(&stdin); err != nil {
+			t.Fatal(err)
+		}
+		if !strings.HasSuffix(stdin.String(), "snapshot-end\t2\n") {
+			t.Errorf("expected 2 active decisions, found=%q", stdin.String())
+		}
+	})
+
+	t.Run("live", func(t *testing.T) {
+		defer cleanup()
+
+		c, err := custom.NewCustomBouncer(&cfg.SinkConfig{
+			BinPath:      binaryPath,
+			BulkLoadFile: bulkFile,
+		})
+		if err != nil {
+			t.Fatal(err)
+		}
+
+		if err := c.BulkLoad(ctx, nil, []*models.Decision{d1, d2}); err != nil {
+			t.Fatal(err)
+		}
+
+		if lines := readLines(binaryOutputFile); len(lines) != 1 || lines[0] != "bulk-load "+bulkFile {
+			t.Errorf("expected a single bulk-load call, found=%q", lines)
+		}
+
+		if lines := readLines(bulkFile); len(lines) != 2 || !strings.Contains(lines[1], `"value":"`+ip2+`"`) {
+			t.Errorf("expected 2 JSON lines, found=%q", lines)
+		}
+	})
+
+	t.Run("failure", func(t *testing.T) {
+		c, err := custom.NewCustomBouncer(&cfg.SinkConfig{
+			BinPath:         binaryPath,
+			FeedViaStdin:    true,
+			StdinFormat:     "tsv",
+			StdinTSVFields:  []string{"action", "value"},
+			ReplayOnRestart: true,
+			BulkLoadFile:    bulkFile,
+		})
+		if err != nil {
+			t.Fatal(err)
+		}
+
+		// the program is not running yet
+		if err := c.BulkLoad(ctx, nil, []*models.Decision{d1, d2}); err == nil {
+			t.Fatal("expected an error")
+		}
+
+		// nothing has been applied, the decisions are not active
+		var stdin bytes.Buffer
+		if _, err := c.SetStdin(&stdin); err != nil {
+			t.Fatal(err)
+		}
+		if stdin.String() != "snapshot-end\t0\n" {
+			t.Errorf("expected no active decision, found=%q", stdin.String())
+		}
+
+		live, err := custom.NewCustomBouncer(&cfg.SinkConfig{
+			BinPath:      "/bin/false",
+			BulkLoadFile: bulkFile,
+		})
+		if err != nil {
+			t.Fatal(err)
+		}
+
+		if err := live.BulkLoad(ctx, nil, []*models.Decision{d1, d2}); err == nil {
+			t.Error("expected an error when the command fails")
+		}
+	})
+}
+
+func Test_Aggregator(t *testing.T) {
+	c, err := custom.NewCustomBouncer(&cfg.SinkConfig{
+		BinPath:        binaryPath,
+		AggregateCIDRs: true,
+	})
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	ipScope := "Ip"
+	rangeScope := "Range"
+	countryScope := "Country"
+
+	decision := func(scope, value string) *models.Decision {
+		return &models.Decision{Duration: &durationWithUnit, Value: &value, Scenario: &sceanario, Type: &decisionType, Scope: &scope}
+	}
+
+	values := func(decisions []*models.Decision) []string {
+		ret := make([]string, 0, len(decisions))
+		for _, d := range decisions {
+			ret = append(ret, *d.Scope+":"+*d.Value)
+		}
+		return ret
+	}
+
+	d4 := decision(ipScope, "10.0.0.4")
+	d5 := decision(ipScope, "10.0.0.5")
+	d6 := decision(ipScope, "10.0.0.6")
+	d7 := decision(rangeScope, "10.0.0.7/32")
+	d6to7 := decision(rangeScope, "10.0.0.6/31")
+	country := decision(countryScope, "FR")
+	outer := decision(rangeScope, "10.0.1.0/24")
+	inner := decision(ipScope, "10.0.1.100")
+	outer2 := decision(rangeScope, "10.0.2.0/24")
+	longer := decision(ipScope, "10.0.1.5")
+	longDuration := "4h"
+	longer.Duration = &longDuration
+
+	tests := []struct {
+		name            string
+		deleted         []*models.Decision
+		added           []*models.Decision
+		expectedDeleted []string
+		expectedAdded   []string
+	}{
+		{
+			name:          "merge adjacent addresses",
+			added:         []*models.Decision{d4, d5, country},
+			expectedAdded: []string{"Range:10.0.0.4/31", "Country:FR"},
+		},
+		{
+			name:            "merge with a range",
+			added:           []*models.Decision{d6to7},
+			expectedDeleted: []string{"Range:10.0.0.4/31"},
+			expectedAdded:   []string{"Range:10.0.0.4/30"},
+		},
+		{
+			name:  "covered address",
+			added: []*models.Decision{d6, d7},
+		},
+		{
+			name:    "still covered",
+			deleted: []*models.Decision{d6to7},
+		},
+		{
+			name:            "split",
+			deleted:         []*models.Decision{d5, country},
+			expectedDeleted: []string{"Range:10.0.0.4/30", "Country:FR"},
+			expectedAdded:   []string{"Range:10.0.0.6/31", "Ip:10.0.0.4"},
+		},
+		{
+			name:            "delete everything",
+			deleted:         []*models.Decision{d4, d6, d7},
+			expectedDeleted: []string{"Ip:10.0.0.4", "Range:10.0.0.6/31"},
+		},
+		{
+			name:          "nested address",
+			added:         []*models.Decision{outer},
+			expectedAdded: []string{"Range:10.0.1.0/24"},
+		},
+		{
+			name:  "address in a range",
+			added: []*models.Decision{inner},
+		},
+		{
+			name:          "address alone",
+			added:         []*models.Decision{decision(ipScope, "10.0.2.100")},
+			expectedAdded: []string{"Ip:10.0.2.100"},
+		},
+		{
+			name:            "range over an address",
+			added:           []*models.Decision{outer2},
+			expectedDeleted: []string{"Ip:10.0.2.100"},
+			expectedAdded:   []string{"Range:10.0.2.0/24"},
+		},
+		{
+			name:            "address uncovered",
+			deleted:         []*models.Decision{outer2},
+			expectedDeleted: []string{"Range:10.0.2.0/24"},
+			expectedAdded:   []string{"Ip:10.0.2.100"},
+		},
+		{
+			name:            "longer decision",
+			added:           []*models.Decision{longer},
+			expectedDeleted: []string{"Range:10.0.1.0/24"},
+			expectedAdded:   []string{"Range:10.0.1.0/24"},
+		},
+	}
+
+	aggregator := c.NewAggregator()
+
+	for _, tt := range tests {
+		deleted, added := aggregator.Apply(tt.deleted, tt.added)
+		if got := values(deleted); len(got) != len(tt.expectedDeleted) || (len(got) != 0 && !reflect.DeepEqual(got, tt.expectedDeleted)) {
+			t.Errorf("%s: expected deleted=%q, found=%q", tt.name, tt.expectedDeleted, got)
+		}
+		if got := values(added); len(got) != len(tt.expectedAdded) || (len(got) != 0 && !reflect.DeepEqual(got, tt.expectedAdded)) {
+			t.Errorf("%s: expected added=%q, found=%q", tt.name, tt.expectedAdded, got)
+		}
+	}
+
+	c, err = custom.NewCustomBouncer(&cfg.SinkConfig{BinPath: binaryPath})
+	if err != nil {
+		t.Fatal(err)
+	}
+	if c.NewAggregator() != nil {
+		t.Error("expected no aggregator without aggregate_cidrs")
+	}
+}
+
+func Test_CustomBouncer_FilterDecisions(t *testing.T) {
+	decision := func(scope, value, scenario, origin, duration string) *models.Decision {
+		return &models.Decision{Duration: &duration, Value: &value, Scenario: &scenario, Type: &decisionType, Scope: &scope, Origin: &origin}
+	}
+
+	short := decision("Ip", "1.2.3.4", "crowdsecurity/ssh-bf", "crowdsec", "30s")
+	ssh := decision("Ip", "1.2.3.5", "crowdsecurity/ssh-bf", "crowdsec", "4h")
+	probing := decision("Ip", "1.2.3.6", "crowdsecurity/http-probing", "crowdsec", "4h")
+	hers := decision("Ip", "1.2.3.7", "ushers", "cscli", "4h")
+	private := decision("Range", "10.1.0.0/16", "manual", "cscli", "4h")
+	mapped := decision("Ip", "::ffff:10.2.3.4", "manual", "cscli", "4h")
+	notInside := decision("Range", "10.0.0.0/7", "manual", "cscli", "4h")
+	country := decision("Country", "FR", "manual", "cscli", "4h")
+
+	c, err := custom.NewCustomBouncer(&cfg.SinkConfig{
+		BinPath: binaryPath,
+		DecisionFilters: []cfg.FilterRule{
+			{Name: "short", MinDuration: time.Minute, Origins: []string{"CrowdSec"}},
+			{ScenarioRegex: "^crowdsecurity/http-", ScenarioContains: []string{"crawl", "probing"}},
+			{ScenarioContains: []string{"she", "hers"}, Scopes: []string{"ip"}},
+			{CIDRs: []string{"10.0.0.0/8"}},
+		},
+	})
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	deleted, added := c.FilterDecisions(
+		[]*models.Decision{country},
+		[]*models.Decision{short, ssh, probing, hers, private, mapped, notInside, country},
+	)
+
+	if !reflect.DeepEqual(deleted, []*models.Decision{country}) {
+		t.Errorf("expected %s to be deleted, found=%d decisions", *country.Value, len(deleted))
+	}
+	if !reflect.DeepEqual(added, []*models.Decision{ssh, notInside, country}) {
+		for _, d := range added {
+			t.Logf("kept %s", *d.Value)
+		}
+		t.Errorf("expected %s, %s and %s to be kept, found=%d decisions", *ssh.Value, *notInside.Value, *country.Value, len(added))
+	}
+
+	// LAPI sends the deletions with the remaining duration: only those of
+	// the filtered adds are dropped
+	shortDel := decision("Ip", "1.2.3.4", "crowdsecurity/ssh-bf", "crowdsec", "-1s")
+	sshDel := decision("Ip", "1.2.3.5", "crowdsecurity/ssh-bf", "crowdsec", "-1s")
+	unknownDel := decision("Ip", "1.2.3.8", "crowdsecurity/ssh-bf", "crowdsec", "-1s")
+
+	deleted, _ = c.FilterDecisions([]*models.Decision{shortDel, sshDel, unknownDel}, nil)
+	if !reflect.DeepEqual(deleted, []*models.Decision{sshDel, unknownDel}) {
+		t.Errorf("expected %s and %s to be deleted, found=%d decisions", *sshDel.Value, *unknownDel.Value, len(deleted))
+	}
+
+	// the key has been deleted, it's not filtered anymore
+	deleted, _ = c.FilterDecisions([]*models.Decision{shortDel}, nil)
+	if len(deleted) != 1 {
+		t.Errorf("expected %s to be deleted again, found=%d decisions", *shortDel.Value, len(deleted))
+	}
+
+	for _, rules := range [][]cfg.FilterRule{
+		{{ScenarioRegex: "("}},
+		{{CIDRs: []string{"10.0.0.0/33"}}},
+	} {
+		if _, err := custom.NewCustomBouncer(&cfg.SinkConfig{BinPath: binaryPath, DecisionFilters: rules}); err == nil {
+			t.Errorf("expected an error for %+v", rules)
+		}
+	}
+}
+
+func Test_CustomBouncer_LocalExpiry(t *testing.T) {
+	ctx := t.Context()
+
+	c, err := custom.NewCustomBouncer(&cfg.SinkConfig{
+		BinPath:      binaryPath,
+		FeedViaStdin: true,
+		LocalExpiry:  true,
+	})
+	if err != nil {
+		t.Fatal(err)
+	}
+	if _, err := c.SetStdin(io.Discard); err != nil {
+		t.Fatal(err)
+	}
+
+	shortDuration := "1s"
+	d1 := &models.Decision{ID: 1, Duration: &durationWithUnit, Value: &ip1, Scenario: &sceanario, Type: &decisionType}
+	d2 := &models.Decision{ID: 2, Duration: &shortDuration, Value: &ip2, Scenario: &sceanario, Type: &decisionType}
+	d3 := &models.Decision{ID: 3, Duration: &shortDuration, Value: &ip3, Scenario: &sceanario, Type: &decisionType}
+
+	for _, err := range []error{c.Add(ctx, d1), c.Add(ctx, d2), c.Add(ctx, d3), c.Delete(ctx, d3)} {
+		if err != nil {
+			t.Fatal(err)
+		}
+	}
+
+	if expired := c.ExpireDecisions(time.Now()); len(expired) != 0 {
+		t.Errorf("expected no expired decision yet, found=%d", len(expired))
+	}
+
+	expired := c.ExpireDecisions(time.Now().Add(2 * time.Second))
+	if !reflect.DeepEqual(expired, []*models.Decision{d2}) {
+		t.Fatalf("expected %s to expire, found=%d decisions", ip2, len(expired))
+	}
+	if err := c.Delete(ctx, d2); err != nil {
+		t.Fatal(err)
+	}
+
+	// the deletion of d2 from LAPI is ignored, once
+	if deleted := c.SkipExpired([]*models.Decision{d2, d1}); !reflect.DeepEqual(deleted, []*models.Decision{d1}) {
+		t.Errorf("expected only %s to be deleted, found=%d decisions", ip1, len(deleted))
+	}
+	if deleted := c.SkipExpired([]*models.Decision{d2}); len(deleted) != 1 {
+		t.Errorf("expected %s to be deleted, found=%d decisions", ip2, len(deleted))
+	}
+
+	c, err = custom.NewCustomBouncer(&cfg.SinkConfig{BinPath: binaryPath, FeedViaStdin: true})
+	if err != nil {
+		t.Fatal(err)
+	}
+	if _, err := c.SetStdin(io.Discard); err != nil {
+		t.Fatal(err)
+	}
+	if err := c.Add(ctx, d2); err != nil {
+		t.Fatal(err)
+	}
+	if expired := c.ExpireDecisions(time.Now().Add(2 * time.Second)); expired != nil {
+		t.Errorf("expected no expiry without local_expiry, found=%d decisions", len(expired))
+	}
+
+	// the deletions are spread: 20 per second, 2 at a time
+	c, err = custom.NewCustomBouncer(&cfg.SinkConfig{BinPath: binaryPath, FeedViaStdin: true, LocalExpiry: true, LocalExpiryRate: 20})
+	if err != nil {
+		t.Fatal(err)
+	}
+	if _, err := c.SetStdin(io.Discard); err != nil {
+		t.Fatal(err)
+	}
+	for i := 0; i < 5; i++ {
+		value := fmt.Sprintf("10.0.0.%d", i)
+		d := &models.Decision{ID: int64(10 + i), Duration: &shortDuration, Value: &value, Scenario: &sceanario, Type: &decisionType}
+		if err := c.Add(ctx, d); err != nil {
+			t.Fatal(err)
+		}
+	}
+
+	now := time.Now().Add(2 * time.Second)
+	var counts []int
+	for _, elapsed := range []time.Duration{0, 0, 50 * time.Millisecond, 100 * time.Millisecond, time.Second} {
+		counts = append(counts, len(c.ExpireDecisions(now.Add(elapsed))))
+	}
+	if !reflect.DeepEqual(counts, []int{2, 0, 1, 1, 1}) {
+		t.Errorf("expected the deletions to be spread, found=%v", counts)
+	}
+}
+
+func Test_CustomBouncer_StdinAck(t *testing.T) {
+	ctx := t.Context()
+
+	c, err := custom.NewCustomBouncer(&cfg.SinkConfig{
+		BinPath:           binaryPath,
+		FeedViaStdin:      true,
+		StdinAck:          true,
+		StdinAckWindow:    1,
+		StdinAckRetries:   1,
+		StdinWriteTimeout: 5 * time.Second,
+	})
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	stdinReader, stdinWriter := io.Pipe()
+	stdoutReader, stdoutWriter := io.Pipe()
+
+	// the program nacks decision 2 once, and acks everything else
+	received := make(chan int64, 10)
+	go func() {
+		defer stdoutWriter.Close()
+		nacked := false
+		dec := json.NewDecoder(stdinReader)
+		for {
+			var d custom.DecisionWithAction
+			if err := dec.Decode(&d); err != nil {
+				return
+			}
+			received <- d.ID
+			reply := "ack"
+			if d.ID == 2 && !nacked {
+				reply, nacked = "nack", true
+			}
+			fmt.Fprintf(stdoutWriter, "%s %d some reason\n", reply, d.ID)
+		}
+	}()
+
+	if _, err := c.SetStdin(stdinWriter); err != nil {
+		t.Fatal(err)
+	}
+
+	readDone := make(chan error)
+	go func() {
+		readDone <- c.ReadAcks(stdoutReader)
+	}()
+
+	for i, ip := range []string{ip1, ip2, ip3} {
+		d := &models.Decision{ID: int64(i + 1), Duration: &durationWithUnit, Value: &ip, Scenario: &sceanario, Type: &decisionType}
+		if err := c.Add(ctx, d); err != nil {
+			t.Fatal(err)
+		}
+	}
+	if err := c.FlushStdin(); err != nil {
+		t.Fatal(err)
+	}
+
+	var ids []int64
+	for len(ids) < 4 {
+		select {
+		case id := <-received:
+			ids = append(ids, id)
+		case <-time.After(5 * time.Second):
+			t.Fatalf("timeout, received=%v", ids)
+		}
+	}
+
+	if !reflect.DeepEqual(ids, []int64{1, 2, 2, 3}) {
+		t.Errorf("expected decision 2 to be sent again, received=%v", ids)
+	}
+
+	stdinWriter.Close()
+	if err := <-readDone; err != nil {
+		t.Error(err)
+	}
+
+	if _, err := custom.NewCustomBouncer(&cfg.SinkConfig{BinPath: binaryPath, FeedViaStdin: true, StdinAck: true, StdinFormat: "tsv"}); err == nil {
+		t.Error("expected an error with stdin_ack and no id in tsv fields")
+	}
+}
+
+func Test_CustomBouncer_StdinAckSuperseded(t *testing.T) {
+	ctx := t.Context()
+
+	c, err := custom.NewCustomBouncer(&cfg.SinkConfig{
+		BinPath:           binaryPath,
+		FeedViaStdin:      true,
+		StdinAck:          true,
+		StdinAckWindow:    10,
+		StdinAckRetries:   3,
+		StdinWriteTimeout: 5 * time.Second,
+	})
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	stdinReader, stdinWriter := io.Pipe()
+	stdoutReader, stdoutWriter := io.Pipe()
+
+	// the program nacks the add once the del has been received
+	received := make(chan string, 10)
+	go func() {
+		defer stdoutWriter.Close()
+		dec := json.NewDecoder(stdinReader)
+		for {
+			var d custom.DecisionWithAction
+			if err := dec.Decode(&d); err != nil {
+				return
+			}
+			received <- d.Action
+			if d.Action == "del" {
+				fmt.Fprintf(stdoutWriter, "nack %d some reason\nack %d\n", d.ID, d.ID)
+			}
+		}
+	}()
+
+	if _, err := c.SetStdin(stdinWriter); err != nil {
+		t.Fatal(err)
+	}
+
+	readDone := make(chan error)
+	go func() {
+		readDone <- c.ReadAcks(stdoutReader)
+	}()
+
+	d := &models.Decision{ID: 1, Duration: &durationWithUnit, Value: &ip1, Scenario: &sceanario, Type: &decisionType}
+	for _, err := range []error{c.Add(ctx, d), c.Delete(ctx, d), c.FlushStdin()} {
+		if err != nil {
+			t.Fatal(err)
+		}
+	}
+
+	deadline := time.Now().Add(5 * time.Second)
+	for c.Inflight() > 0 && time.Now().Before(deadline) {
+		time.Sleep(10 * time.Millisecond)
+	}
+	if n := c.Inflight(); n != 0 {
+		t.Errorf("expected no decision in flight, found=%d", n)
+	}
+
+	stdinWriter.Close()
+	if err := <-readDone; err != nil {
+		t.Error(err)
+	}
+
+	close(received)
+	var actions []string
+	for action := range received {
+		actions = append(actions, action)
+	}
+	// the add is not sent again after the del
+	if !reflect.DeepEqual(actions, []string{"add", "del"}) {
+		t.Errorf("expected the add not to be sent again, received=%v", actions)
+	}
+}
+
+func Test_CustomBouncer_RetryQueue(t *testing.T) {
+	ctx, cancel := context.WithCancel(t.Context())
+	defer cancel()
+
+	defer cleanup()
+	defer os.Remove("./tried.txt")
+
+	deadLetterFile := t.TempDir() + "/dead-letter"
+
+	d1 := &models.Decision{ID: 1, Duration: &durationWithUnit, Value: &ip1, Scenario: &sceanario, Type: &decisionType}
+
+	newBouncer := func(binPath string) *custom.CustomBouncer {
+		c, err := custom.NewCustomBouncer(&cfg.SinkConfig{
+			BinPath:             binPath,
+			ExecRetries:         2,
+			ExecRetryBackoff:    10 * time.Millisecond,
+			ExecRetryMaxBackoff: 20 * time.Millisecond,
+			DeadLetterFile:      deadLetterFile,
+		})
+		if err != nil {
+			t.Fatal(err)
+		}
+		go func() {
+			_ = c.RunRetryQueue(ctx)
+		}()
+		return c
+	}
+
+	waitFor := func(path string) string {
+		for i := 0; i < 100; i++ {
+			if content, err := os.ReadFile(path); err == nil && len(content) != 0 {
+				return string(content)
+			}
+			time.Sleep(20 * time.Millisecond)
+		}
+		t.Fatalf("timeout waiting for %s", path)
+		return ""
+	}
+
+	c := newBouncer("./testdata/custom-flaky")
+	if err := c.Add(ctx, d1); err != nil {
+		t.Fatal(err)
+	}
+	if content := waitFor(binaryOutputFile); !strings.HasPrefix(content, "add "+ip1+" "+durationInSeconds+" "+sceanario+" ") || strings.Count(content, "\n") != 1 {
+		t.Errorf("expected the add to succeed on retry, found=%q", content)
+	}
+
+	c = newBouncer("/bin/false")
+	if err := c.Add(ctx, d1); err != nil {
+		t.Fatal(err)
+	}
+	if content := waitFor(deadLetterFile); !strings.Contains(content, `"value":"`+ip1+`"`) || !strings.Contains(content, `"action":"add"`) {
+		t.Errorf("expected the add in the dead letter file, found=%q", content)
+	}
+
+	// a deletion received while the add is retried is run after it
+	cleanup()
+	os.Remove("./tried.txt")
+	defer os.Remove("./started.txt")
+
+	c = newBouncer("./testdata/custom-slow-retry")
+	if err := c.Add(ctx, d1); err != nil {
+		t.Fatal(err)
+	}
+	waitFor("./started.txt")
+	if err := c.Delete(ctx, d1); err != nil {
+		t.Fatal(err)
+	}
+	// and the result of the retry doesn't hide the next add
+	if err := c.Add(ctx, d1); err != nil {
+		t.Fatal(err)
+	}
+
+	lines := readLines(binaryOutputFile)
+	if len(lines) != 3 || !strings.HasPrefix(lines[0], "add ") || !strings.HasPrefix(lines[1], "del ") || !strings.HasPrefix(lines[2], "add ") {
+		t.Errorf("expected add, del and add, found=%q", lines)
+	}
+}
+
+func Test_CustomBouncer_SharedBatch(t *testing.T) {
+	decision := func(value string) *models.Decision {
+		scope := "Ip"
+		return &models.Decision{Duration: &durationWithUnit, Value: &value, Scenario: &sceanario, Type: &decisionType, Scope: &scope}
+	}
+
+	// the sinks receive the same batches, they must not modify them
+	deleted := []*models.Decision{decision("10.0.0.1")}
+	added := []*models.Decision{decision("10.0.0.4"), decision("10.0.0.5"), decision("192.168.0.1")}
+
+	snapshot := func() []models.Decision {
+		ret := make([]models.Decision, 0, len(deleted)+len(added))
+		for _, d := range append(append([]*models.Decision{}, deleted...), added...) {
+			ret = append(ret, *d)
+		}
+		return ret
+	}
+
+	before := snapshot()
+
+	aggregated, err := custom.NewCustomBouncer(&cfg.SinkConfig{
+		BinPath:         binaryPath,
+		AggregateCIDRs:  true,
+		DecisionFilters: []cfg.FilterRule{{CIDRs: []string{"192.168.0.0/16"}}},
+	})
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	plain, err := custom.NewCustomBouncer(&cfg.SinkConfig{BinPath: binaryPath})
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	d, a := aggregated.FilterDecisions(deleted, added)
+	d, a = aggregated.NewAggregator().Apply(d, a)
+	d, a = aggregated.Reconcile(d, a)
+	if len(d) != 1 || len(a) != 1 || *a[0].Value != "10.0.0.4/31" {
+		t.Errorf("expected 1 deletion and 10.0.0.4/31, found %d deletions and %d additions", len(d), len(a))
+	}
+
+	d, a = plain.FilterDecisions(deleted, added)
+	d, a = plain.NewAggregator().Apply(d, a)
+	d, a = plain.Reconcile(d, a)
+	if !reflect.DeepEqual(d, deleted) || !reflect.DeepEqual(a, added) {
+		t.Errorf("expected the batch unchanged, found %d deletions and %d additions", len(d), len(a))
+	}
+
+	if !reflect.DeepEqual(snapshot(), before) {
+		t.Error("the batch has been modified")
+	}
+}
+
+func Test_CustomBouncer_StdinWorkers(t *testing.T) {
+	ctx := t.Context()
+
+	const workers = 3
+
+	c, err := custom.NewCustomBouncer(&cfg.SinkConfig{
+		BinPath:         binaryPath,
+		FeedViaStdin:    true,
+		StdinWorkers:    workers,
+		ReplayOnRestart: true,
+	})
+	if err != nil {
+		t.Fatal(err)
+	}
+	if c.StdinWorkers() != workers {
+		t.Fatalf("expected %d workers, found=%d", workers, c.StdinWorkers())
+	}
+
+	var stdin [workers]bytes.Buffer
+
+	for i := range stdin {
+		// not all the programs have been started yet
+		waitCtx, cancel := context.WithTimeout(ctx, 10*time.Millisecond)
+		err := c.WaitStdin(waitCtx)
+		cancel()
+		if err == nil {
+			t.Fatalf("expected WaitStdin to wait for the program %d", i)
+		}
+
+		if _, err := c.SetShardStdin(i, &stdin[i]); err != nil {
+			t.Fatal(err)
+		}
+		stdin[i].Reset()
+	}
+
+	if err := c.WaitStdin(ctx); err != nil {
+		t.Fatal(err)
+	}
+
+	decisions := make([]*models.Decision, 0, 30)
+	for i := 0; i < 30; i++ {
+		value := fmt.Sprintf("10.0.0.%d", i)
+		decisions = append(decisions, &models.Decision{Duration: &durationWithUnit, Value: &value, Scenario: &sceanario, Type: &decisionType})
+	}
+
+	for _, d := range decisions {
+		if err := c.Add(ctx, d); err != nil {
+			t.Fatal(err)
+		}
+	}
+	for _, d := range decisions[:10] {
+		if err := c.Delete(ctx, d); err != nil {
+			t.Fatal(err)
+		}
+	}
+	if err := c.FlushStdin(); err != nil {
+		t.Fatal(err)
+	}
+
+	// the add and del of a decision go to the same program
+	shardOf := make(map[string]int)
+	for i := range stdin {
+		for _, line := range strings.Split(strings.TrimSpace(stdin[i].String()), "\n") {
+			var d custom.DecisionWithAction
+			if err := json.Unmarshal([]byte(line), &d); err != nil {
+				t.Fatalf("%s: %s", line, err)
+			}
+			if shard, ok := shardOf[*d.Value]; ok && shard != i {
+				t.Errorf("%s sent to %d and %d", *d.Value, shard, i)
+			}
+			shardOf[*d.Value] = i
+		}
+		if stdin[i].Len() == 0 {
+			t.Errorf("nothing sent to %d", i)
+		}
+	}
+	if len(shardOf) != len(decisions) {
+		t.Errorf("expected %d decisions, found=%d", len(decisions), len(shardOf))
+	}
+
+	// a restarted program only receives its own decisions
+	var restarted bytes.Buffer
+	if _, err := c.SetShardStdin(1, &restarted); err != nil {
+		t.Fatal(err)
+	}
+
+	lines := strings.Split(strings.TrimSpace(restarted.String()), "\n")
+	for _, line := range lines[:len(lines)-1] {
+		var d custom.DecisionWithAction
+		if err := json.Unmarshal([]byte(line), &d); err != nil {
+			t.Fatalf("%s: %s", line, err)
+		}
+		if shardOf[*d.Value] != 1 {
+			t.Errorf("%s replayed to the wrong program", *d.Value)
+		}
+	}
+	if !strings.HasPrefix(lines[len(lines)-1], `{"action":"snapshot-end"`) {
+		t.Errorf("expected snapshot marker, found=%s", lines[len(lines)-1])
+	}
+}
+
+func Test_DispatchQueue(t *testing.T) {
+	ctx := t.Context()
+
+	decision := func(id int64, value string) *models.Decision {
+		return &models.Decision{ID: id, Duration: &durationWithUnit, Value: &value, Scenario: &sceanario, Type: &decisionType}
+	}
+
+	values := func(decisions []*models.Decision) []string {
+		ret := make([]string, 0, len(decisions))
+		for _, d := range decisions {
+			ret = append(ret, *d.Value)
+		}
+		return ret
+	}
+
+	a1, a2, a3 := decision(1, "1.1.1.1"), decision(2, "2.2.2.2"), decision(3, "3.3.3.3")
+	a1bis := decision(4, "1.1.1.1")
+
+	tests := []struct {
+		policy          string
+		expectedDeleted [][]string
+		expectedAdded   [][]string
+	}{
+		{
+			policy:          "drop_oldest_adds",
+			expectedDeleted: [][]string{{"3.3.3.3", "1.1.1.1"}, {}},
+			expectedAdded:   [][]string{{"2.2.2.2"}, {"1.1.1.1"}},
+		},
+		{
+			// 1.1.1.1 has not been sent yet
+			policy:          "collapse",
+			expectedDeleted: [][]string{{"3.3.3.3"}},
+			expectedAdded:   [][]string{{"1.1.1.1", "2.2.2.2"}},
+		},
+	}
+
+	for _, tt := range tests {
+		c, err := custom.NewCustomBouncer(&cfg.SinkConfig{BinPath: binaryPath, Name: tt.policy, QueueSize: 2, QueuePolicy: tt.policy})
+		if err != nil {
+			t.Fatal(err)
+		}
+
+		q := c.NewDispatchQueue()
+
+		for _, batch := range [][2][]*models.Decision{
+			{{a3}, {a1}},
+			{{a1}, {a2}},
+			{nil, {a1bis}},
+		} {
+			if err := q.Push(ctx, batch[0], batch[1], time.Now()); err != nil {
+				t.Fatal(err)
+			}
+		}
+
+		if q.Len() != len(tt.expectedAdded) {
+			t.Fatalf("%s: expected %d batches, found=%d", tt.policy, len(tt.expectedAdded), q.Len())
+		}
+
+		for i := range tt.expectedAdded {
+			batch, ok := q.Pop()
+			if !ok {
+				t.Fatalf("%s: expected batch %d", tt.policy, i)
+			}
+			if got := values(batch.Deleted); !reflect.DeepEqual(got, tt.expectedDeleted[i]) {
+				t.Errorf("%s: expected deleted=%q, found=%q", tt.policy, tt.expectedDeleted[i], got)
+			}
+			if got := values(batch.New); !reflect.DeepEqual(got, tt.expectedAdded[i]) {
+				t.Errorf("%s: expected added=%q, found=%q", tt.policy, tt.expectedAdded[i], got)
+			}
+		}
+	}
+
+	// block waits for a Pop
+	c, err := custom.NewCustomBouncer(&cfg.SinkConfig{BinPath: binaryPath, Name: "block", QueueSize: 1, QueuePolicy: "block"})
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	q := c.NewDispatchQueue()
+	if err := q.Push(ctx, nil, []*models.Decision{a1}, time.Now()); err != nil {
+		t.Fatal(err)
+	}
+
+	pushed := make(chan error, 1)
+	go func() {
+		pushed <- q.Push(ctx, nil, []*models.Decision{a2}, time.Now())
+	}()
+
+	select {
+	case <-pushed:
+		t.Fatal("expected Push to wait")
+	case <-time.After(50 * time.Millisecond):
+	}
+
+	<-q.Ready()
+	if batch, ok := q.Pop(); !ok || batch.New[0] != a1 {
+		t.Fatal("expected the first batch")
+	}
+	if err := <-pushed; err != nil {
+		t.Fatal(err)
+	}
+	if q.Len() != 1 {
+		t.Errorf("expected 1 batch, found=%d", q.Len())
+	}
+}
+
+func Test_CustomBouncer_ExecRateLimit(t *testing.T) {
+	ctx := t.Context()
+	defer cleanup()
+
+	c, err := custom.NewCustomBouncer(&cfg.SinkConfig{
+		BinPath:       binaryPath,
+		ExecRateLimit: 20,
+		ExecRateBurst: 1,
+		ExecPriority:  "del",
+	})
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	decision := func(value string) *models.Decision {
+		return &models.Decision{Duration: &durationWithUnit, Value: &value, Scenario: &sceanario, Type: &decisionType}
+	}
+
+	// use the burst
+	if err := c.Add(ctx, decision("10.0.0.1")); err != nil {
+		t.Fatal(err)
+	}
+
+	start := time.Now()
+	errs := make(chan error, 6)
+
+	for i := 2; i <= 4; i++ {
+		added := decision(fmt.Sprintf("10.0.1.%d", i))
+		deleted := decision(fmt.Sprintf("10.0.2.%d", i))
+		go func() { errs <- c.Add(ctx, added) }()
+		go func() { errs <- c.Delete(ctx, deleted) }()
+	}
+
+	for i := 0; i < 6; i++ {
+		if err := <-errs; err != nil {
+			t.Fatal(err)
+		}
+	}
+
+	// 6 commands at 20 per second
+	if elapsed := time.Since(start); elapsed < 250*time.Millisecond {
+		t.Errorf("expected the commands to be throttled, took %s", elapsed)
+	}
+
+	lines := parseFile(binaryOutputFile)
+	if len(lines) != 7 {
+		t.Fatalf("expected 7 commands, found=%d", len(lines))
+	}
+	for i, line := range lines[1:4] {
+		if line.action != "del" {
+			t.Errorf("expected the deletions first, found %s %s at %d", line.action, line.value, i+1)
+		}
+	}
+}
+
+type closeBuffer struct {
+	bytes.Buffer
+	closed bool
+}
+
+func (b *closeBuffer) Close() error {
+	b.closed = true
+	return nil
+}
+
+func Test_Recorder(t *testing.T) {
+	var out closeBuffer
+
+	r := custom.NewRecorder(&out, 10)
+
+	received := time.Date(2024, 1, 1, 12, 0, 0, 0, time.UTC)
+	d1 := &models.Decision{ID: 1, Duration: &durationWithUnit, Value: &ip1, Scenario: &sceanario, Type: &decisionType}
+	d2 := &models.Decision{ID: 2, Duration: &durationWithUnit, Value: &ip2, Scenario: &sceanario, Type: &decisionType}
+
+	r.Record(received, nil, []*models.Decision{d1, d2})
+	r.Record(received.Add(time.Second), []*models.Decision{d1}, nil)
+
+	if err := r.Close(); err != nil {
+		t.Fatal(err)
+	}
+	if !out.closed {
+		t.Error("expected the file to be closed")
+	}
+
+	decoder := json.NewDecoder(&out.Buffer)
+
+	var batches []custom.RecordedBatch
+	for decoder.More() {
+		var batch custom.RecordedBatch
+		if err := decoder.Decode(&batch); err != nil {
+			t.Fatal(err)
+		}
+		batches = append(batches, batch)
+	}
+
+	if len(batches) != 2 {
+		t.Fatalf("expected 2 batches, found=%d", len(batches))
+	}
+	if !batches[0].ReceivedAt.Equal(received) || len(batches[0].New) != 2 || len(batches[0].Deleted) != 0 {
+		t.Errorf("unexpected first batch: %+v", batches[0])
+	}
+	if len(batches[1].Deleted) != 1 || *batches[1].Deleted[0].Value != ip1 || batches[1].Deleted[0].ID != 1 {
+		t.Errorf("unexpected second batch: %+v", batches[1])
+	}
+
+	// recording is optional
+	var disabled *custom.Recorder
+	disabled.Record(received, nil, nil)
+	if err := disabled.Close(); err != nil {
+		t.Error(err)
+	}
+}
+
+func Test_LogSampler(t *testing.T) {
+	level := log.GetLevel()
+	defer log.SetLevel(level)
+
+	custom.SetLogSampling(2, 3)
+	defer custom.SetLogSampling(0, 0)
+
+	var s custom.LogSampler
+
+	log.SetLevel(log.InfoLevel)
+	if s.Enabled() {
+		t.Error("expected no line without debug logging")
+	}
+
+	log.SetLevel(log.DebugLevel)
+
+	// the lines are counted per second, start with a new one
+	now := time.Now()
+	time.Sleep(now.Truncate(time.Second).Add(time.Second + 10*time.Millisecond).Sub(now))
+
+	var got []bool
+	for i := 0; i < 8; i++ {
+		got = append(got, s.Enabled())
+	}
+
+	expected := []bool{true, true, false, false, true, false, false, true}
+	if !reflect.DeepEqual(got, expected) {
+		t.Errorf("expected %v, found=%v", expected, got)
+	}
+
+	// not sampled
+	custom.SetLogSampling(0, 0)
+	for i := 0; i < 5; i++ {
+		if !s.Enabled() {
+			t.Fatal("expected all the lines")
+		}
+	}
+}
@@ -0,0 +1,192 @@
+package custom
+
+import (
+	"encoding/json"
+	"reflect"
+	"strconv"
+	"sync"
+	"unicode/utf8"
+
+	"github.com/crowdsecurity/crowdsec/pkg/models"
+)
+
+// decisionJSONFields are the fields of models.Decision, with their json tags,
+// that appendDecisionJSON knows how to encode.
+var decisionJSONFields = []string{
+	"Duration:duration",
+	"ID:id,omitempty",
+	"Origin:origin",
+	"Scenario:scenario",
+	"Scope:scope",
+	"Simulated:simulated,omitempty",
+	"Type:type",
+	"Until:until,omitempty",
+	"UUID:uuid,omitempty",
+	"Value:value",
+}
+
+// fastJSON is false if models.Decision doesn't have the expected fields, in
+// which case we fall back to encoding/json instead of producing a different output.
+var fastJSON = func() bool {
+	t := reflect.TypeOf(models.Decision{})
+	if t.NumField() != len(decisionJSONFields) {
+		return false
+	}
+
+	for i := 0; i < t.NumField(); i++ {
+		f := t.Field(i)
+		if f.Name+":"+f.Tag.Get("json") != decisionJSONFields[i] {
+			return false
+		}
+	}
+
+	return true
+}()
+
+var bufPool = sync.Pool{
+	New: func() any {
+		b := make([]byte, 0, 512)
+		return &b
+	},
+}
+
+func getBuffer() *[]byte {
+	return bufPool.Get().(*[]byte)
+}
+
+func putBuffer(b *[]byte) {
+	// don't keep the occasional huge buffer around
+	if cap(*b) > 64*1024 {
+		return
+	}
+
+	*b = (*b)[:0]
+	bufPool.Put(b)
+}
+
+// appendDecisionJSON appends the JSON representation of a DecisionWithAction to buf.
+// The output is the same as json.Marshal(), field by field and byte by byte.
+func appendDecisionJSON(buf []byte, decision *models.Decision, action string) ([]byte, error) {
+	if !fastJSON {
+		b, err := json.Marshal(DecisionWithAction{Decision: *decision, Action: action, ID: decision.ID})
+		if err != nil {
+			return buf, err
+		}
+
+		return append(buf, b...), nil
+	}
+
+	buf = append(buf, `{"duration":`...)
+	buf = appendJSONStringPtr(buf, decision.Duration)
+	buf = append(buf, `,"origin":`...)
+	buf = appendJSONStringPtr(buf, decision.Origin)
+	buf = append(buf, `,"scenario":`...)
+	buf = appendJSONStringPtr(buf, decision.Scenario)
+	buf = append(buf, `,"scope":`...)
+	buf = appendJSONStringPtr(buf, decision.Scope)
+
+	if decision.Simulated != nil {
+		buf = append(buf, `,"simulated":`...)
+		buf = strconv.AppendBool(buf, *decision.Simulated)
+	}
+
+	buf = append(buf, `,"type":`...)
+	buf = appendJSONStringPtr(buf, decision.Type)
+
+	if decision.Until != "" {
+		buf = append(buf, `,"until":`...)
+		buf = appendJSONString(buf, decision.Until)
+	}
+
+	if decision.UUID != "" {
+		buf = append(buf, `,"uuid":`...)
+		buf = appendJSONString(buf, decision.UUID)
+	}
+
+	buf = append(buf, `,"value":`...)
+	buf = appendJSONStringPtr(buf, decision.Value)
+	// the ID of DecisionWithAction, which shadows the one of models.Decision
+	buf = append(buf, `,"id":`...)
+	buf = strconv.AppendInt(buf, decision.ID, 10)
+
+	if action != "" {
+		buf = append(buf, `,"action":`...)
+		buf = appendJSONString(buf, action)
+	}
+
+	return append(buf, '}'), nil
+}
+
+func appendJSONStringPtr(buf []byte, s *string) []byte {
+	if s == nil {
+		return append(buf, "null"...)
+	}
+
+	return appendJSONString(buf, *s)
+}
+
+const hexDigits = "0123456789abcdef"
+
+// appendJSONString quotes a string like encoding/json does, HTML escaping included.
+func appendJSONString(buf []byte, s string) []byte {
+	buf = append(buf, '"')
+	start := 0
+
+	for i := 0; i < len(s); {
+		if b := s[i]; b < utf8.RuneSelf {
+			if b >= 0x20 && b != '"' && b != '\\' && b != '<' && b != '>' && b != '&' {
+				i++
+				continue
+			}
+
+			buf = append(buf, s[start:i]...)
+
+			switch b {
+			case '\\', '"':
+				buf = append(buf, '\\', b)
+			case '\b':
+				buf = append(buf, '\\', 'b')
+			case '\f':
+				buf = append(buf, '\\', 'f')
+			case '\n':
+				buf = append(buf, '\\', 'n')
+			case '\r':
+				buf = append(buf, '\\', 'r')
+			case '\t':
+				buf = append(buf, '\\', 't')
+			default:
+				buf = append(buf, '\\', 'u', '0', '0', hexDigits[b>>4], hexDigits[b&0xF])
+			}
+
+			i++
+			start = i
+
+			continue
+		}
+
+		r, size := utf8.DecodeRuneInString(s[i:])
+		if r == utf8.RuneError && size == 1 {
+			buf = append(buf, s[start:i]...)
+			buf = append(buf, `\ufffd`...)
+			i += size
+			start = i
+
+			continue
+		}
+
+		if r == '\u2028' || r == '\u2029' {
+			buf = append(buf, s[start:i]...)
+			buf = append(buf, '\\', 'u', '2', '0', '2', hexDigits[r&0xF])
+			i += size
+			start = i
+
+			continue
+		}
+
+		i += size
+	}
+
+	buf = append(buf, s[start:]...)
+
+	return append(buf, '"')
+}
@@ -0,0 +1,171 @@
+package custom
+
+import (
+	"sync"
+	"time"
+
+	"github.com/crowdsecurity/crowdsec/pkg/models"
+
+	"github.com/crowdsecurity/cs-custom-bouncer/pkg/metrics"
+)
+
+// the deletions from LAPI are expected well before this, after a local expiry
+const locallyExpiredRetention = time.Hour
+
+// the budget of local deletions is at most local_expiry_rate over this
+const localExpiryBurst = 100 * time.Millisecond
+
+type locallyExpired struct {
+	id int64
+	at time.Time
+}
+
+type locallyExpiredKey struct {
+	key DecisionKey
+	at  time.Time
+}
+
+// expiryScheduler keeps the deadline of the active decisions, to delete them
+// when they expire instead of waiting for LAPI.
+type expiryScheduler struct {
+	mu        sync.Mutex
+	deadlines deadlineHeap
+	// keys deleted locally, and the id of their decision, until LAPI deletes them too
+	expired map[DecisionKey]locallyExpired
+	// the same keys, by expiry time, to forget them if LAPI never does
+	expiredOrder []locallyExpiredKey
+	// deletions allowed by local_expiry_rate, and when it was computed
+	budget     float64
+	budgetTime time.Time
+}
+
+// take returns how many decisions can be deleted now, with s.mu held. The
+// budget grows by rate per second, up to localExpiryBurst worth of it. There's
+// no limit if rate is 0.
+func (s *expiryScheduler) take(now time.Time, rate float64) int {
+	if rate <= 0 {
+		return -1
+	}
+
+	limit := max(rate*localExpiryBurst.Seconds(), 1)
+
+	if s.budgetTime.IsZero() {
+		s.budget = limit
+	} else {
+		s.budget = min(s.budget+rate*now.Sub(s.budgetTime).Seconds(), limit)
+	}
+
+	s.budgetTime = now
+
+	return int(s.budget)
+}
+
+func (s *expiryScheduler) schedule(key DecisionKey, decision *models.Decision, now time.Time) {
+	seconds := durationSeconds(decision)
+
+	s.mu.Lock()
+	defer s.mu.Unlock()
+
+	delete(s.expired, key)
+
+	if seconds <= 0 {
+		s.deadlines.remove(key)
+		return
+	}
+
+	s.deadlines.set(key, now.Add(time.Duration(seconds)*time.Second))
+}
+
+func (s *expiryScheduler) cancel(key DecisionKey) {
+	s.mu.Lock()
+	defer s.mu.Unlock()
+
+	s.deadlines.remove(key)
+}
+
+func (s *expiryScheduler) reset() {
+	s.mu.Lock()
+	defer s.mu.Unlock()
+
+	s.deadlines = deadlineHeap{}
+}
+
+// ExpireDecisions returns the active decisions that have expired at the given
+// time, to be deleted. The deletion that LAPI sends later for them is dropped
+// by SkipExpired. It returns nil if local_expiry is not set.
+//
+// At most local_expiry_rate decisions are returned per second, a tenth of it
+// at a time at most: it's meant to be called several times per second. The
+// other expired decisions wait for the next calls, or for LAPI to delete them.
+func (c *CustomBouncer) ExpireDecisions(now time.Time) []*models.Decision {
+	if !c.localExpiry {
+		return nil
+	}
+
+	s := &c.expiries
+
+	s.mu.Lock()
+	defer s.mu.Unlock()
+
+	for len(s.expiredOrder) > 0 && now.Sub(s.expiredOrder[0].at) > locallyExpiredRetention {
+		old := s.expiredOrder[0]
+		// unless it has expired again since
+		if e, ok := s.expired[old.key]; ok && e.at.Equal(old.at) {
+			delete(s.expired, old.key)
+		}
+		s.expiredOrder = s.expiredOrder[1:]
+	}
+
+	var ret []*models.Decision
+
+	keys := s.deadlines.popExpiredN(now, s.take(now, c.localExpiryRate))
+	s.budget -= float64(len(keys))
+
+	for _, key := range keys {
+		decision := c.active.get(key)
+		if decision == nil {
+			continue
+		}
+
+		if s.expired == nil {
+			s.expired = make(map[DecisionKey]locallyExpired)
+		}
+
+		s.expired[key] = locallyExpired{id: decision.ID, at: now}
+		metrics.LocallyExpired.Inc()
+		s.expiredOrder = append(s.expiredOrder, locallyExpiredKey{key: key, at: now})
+		ret = append(ret, decision)
+	}
+
+	return ret
+}
+
+// SkipExpired removes from the deletions received from LAPI those of the
+// decisions that have already expired locally.
+func (c *CustomBouncer) SkipExpired(deleted []*models.Decision) []*models.Decision {
+	if !c.localExpiry {
+		return deleted
+	}
+
+	s := &c.expiries
+
+	s.mu.Lock()
+	defer s.mu.Unlock()
+
+	if len(s.expired) == 0 {
+		return deleted
+	}
+
+	ret := make([]*models.Decision, 0, len(deleted))
+
+	for _, decision := range deleted {
+		key := decisionToDecisionKey(decision)
+		if e, ok := s.expired[key]; ok && e.id == decision.ID {
+			delete(s.expired, key)
+			continue
+		}
+		ret = append(ret, decision)
+	}
+
+	return ret
+}
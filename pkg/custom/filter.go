@@ -0,0 +1,248 @@
+package custom
+
+import (
+	"fmt"
+	"net/netip"
+	"regexp"
+	"strconv"
+	"strings"
+	"sync"
+
+	"github.com/prometheus/client_golang/prometheus"
+
+	"github.com/crowdsecurity/crowdsec/pkg/models"
+
+	"github.com/crowdsecurity/cs-custom-bouncer/pkg/cfg"
+	"github.com/crowdsecurity/cs-custom-bouncer/pkg/metrics"
+)
+
+// filterRule is a compiled cfg.FilterRule. A decision matches when it
+// satisfies all the conditions that are set.
+type filterRule struct {
+	scenarioRegex    *regexp.Regexp
+	scenarioContains *ahoCorasick
+	scopes           map[string]struct{}
+	types            map[string]struct{}
+	origins          map[string]struct{}
+	minDuration      int64
+	cidrs            []netip.Prefix
+	matched          prometheus.Counter
+}
+
+func lowerSet(values []string) map[string]struct{} {
+	if len(values) == 0 {
+		return nil
+	}
+
+	ret := make(map[string]struct{}, len(values))
+	for _, v := range values {
+		ret[strings.ToLower(v)] = struct{}{}
+	}
+
+	return ret
+}
+
+func inLowerSet(set map[string]struct{}, value *string) bool {
+	if value == nil {
+		return false
+	}
+
+	_, ok := set[strings.ToLower(*value)]
+
+	return ok
+}
+
+// decisionFilter is the compiled decision_filters.
+type decisionFilter struct {
+	rules []*filterRule
+	// only parse what the rules need
+	needDuration bool
+	needPrefix   bool
+	// the keys whose last add has been filtered, to filter their deletion
+	mu   sync.Mutex
+	keys map[DecisionKey]struct{}
+}
+
+// newDecisionFilter returns nil if there is no rule.
+func newDecisionFilter(rules []cfg.FilterRule) (*decisionFilter, error) {
+	if len(rules) == 0 {
+		return nil, nil
+	}
+
+	ret := &decisionFilter{keys: make(map[DecisionKey]struct{})}
+
+	for i, rule := range rules {
+		name := rule.Name
+		if name == "" {
+			name = "rule-" + strconv.Itoa(i+1)
+		}
+
+		f := &filterRule{
+			scopes:      lowerSet(rule.Scopes),
+			types:       lowerSet(rule.Types),
+			origins:     lowerSet(rule.Origins),
+			minDuration: int64(rule.MinDuration.Seconds()),
+			matched:     metrics.FilteredDecisions.WithLabelValues(name),
+		}
+
+		if rule.ScenarioRegex != "" {
+			re, err := regexp.Compile(rule.ScenarioRegex)
+			if err != nil {
+				return nil, fmt.Errorf("decision_filters: %s: %w", name, err)
+			}
+			f.scenarioRegex = re
+		}
+
+		if len(rule.ScenarioContains) != 0 {
+			f.scenarioContains = newAhoCorasick(rule.ScenarioContains)
+		}
+
+		for _, cidr := range rule.CIDRs {
+			prefix, err := netip.ParsePrefix(cidr)
+			if err != nil {
+				addr, aerr := netip.ParseAddr(cidr)
+				if aerr != nil {
+					return nil, fmt.Errorf("decision_filters: %s: %w", name, err)
+				}
+				prefix = netip.PrefixFrom(addr, addr.BitLen())
+			}
+			if prefix.Addr().Is4In6() && prefix.Bits() >= 96 {
+				prefix = netip.PrefixFrom(prefix.Addr().Unmap(), prefix.Bits()-96)
+			}
+			f.cidrs = append(f.cidrs, prefix.Masked())
+		}
+
+		ret.rules = append(ret.rules, f)
+		ret.needDuration = ret.needDuration || f.minDuration > 0
+		ret.needPrefix = ret.needPrefix || f.cidrs != nil
+	}
+
+	return ret, nil
+}
+
+// match is called with the parsed duration and prefix of the decision, the
+// prefix being invalid for the decisions that are not Ip or Range.
+func (f *filterRule) match(decision *models.Decision, seconds int64, prefix netip.Prefix) bool {
+	if f.scopes != nil && !inLowerSet(f.scopes, decision.Scope) {
+		return false
+	}
+
+	if f.types != nil && !inLowerSet(f.types, decision.Type) {
+		return false
+	}
+
+	if f.origins != nil && !inLowerSet(f.origins, decision.Origin) {
+		return false
+	}
+
+	if f.minDuration > 0 && seconds >= f.minDuration {
+		return false
+	}
+
+	if f.cidrs != nil && !prefixInAny(prefix, f.cidrs) {
+		return false
+	}
+
+	if f.scenarioContains != nil && !f.scenarioContains.matchString(derefString(decision.Scenario)) {
+		return false
+	}
+
+	if f.scenarioRegex != nil && !f.scenarioRegex.MatchString(derefString(decision.Scenario)) {
+		return false
+	}
+
+	return true
+}
+
+func prefixInAny(prefix netip.Prefix, cidrs []netip.Prefix) bool {
+	if !prefix.IsValid() {
+		return false
+	}
+
+	for _, cidr := range cidrs {
+		if cidr.Bits() <= prefix.Bits() && cidr.Contains(prefix.Addr()) {
+			return true
+		}
+	}
+
+	return false
+}
+
+// filtered returns true if the decision matches one of the rules.
+func (df *decisionFilter) filtered(decision *models.Decision) bool {
+	var (
+		seconds int64
+		prefix  netip.Prefix
+	)
+
+	if df.needDuration {
+		seconds = durationSeconds(decision)
+	}
+
+	if df.needPrefix {
+		prefix, _ = decisionPrefix(decision)
+	}
+
+	for _, f := range df.rules {
+		if f.match(decision, seconds, prefix) {
+			f.matched.Inc()
+			return true
+		}
+	}
+
+	return false
+}
+
+// FilterDecisions removes the decisions that match one of the decision_filters,
+// before they cost anything. A deletion is only removed if the add of its key
+// has been filtered: the rules are not evaluated for the deletions, LAPI sends
+// them with the remaining duration of the decision.
+func (c *CustomBouncer) FilterDecisions(deleted, added []*models.Decision) ([]*models.Decision, []*models.Decision) {
+	if c.filter == nil {
+		return deleted, added
+	}
+
+	return c.filter.applyDeleted(deleted), c.filter.applyAdded(added)
+}
+
+func (df *decisionFilter) applyDeleted(decisions []*models.Decision) []*models.Decision {
+	df.mu.Lock()
+	defer df.mu.Unlock()
+
+	ret := make([]*models.Decision, 0, len(decisions))
+
+	for _, decision := range decisions {
+		key := decisionToDecisionKey(decision)
+		if _, ok := df.keys[key]; ok {
+			delete(df.keys, key)
+			continue
+		}
+		ret = append(ret, decision)
+	}
+
+	return ret
+}
+
+func (df *decisionFilter) applyAdded(decisions []*models.Decision) []*models.Decision {
+	ret := make([]*models.Decision, 0, len(decisions))
+
+	for _, decision := range decisions {
+		filtered := df.filtered(decision)
+		key := decisionToDecisionKey(decision)
+
+		df.mu.Lock()
+		if filtered {
+			df.keys[key] = struct{}{}
+		} else {
+			// the program has it now, its deletion must go through
+			delete(df.keys, key)
+		}
+		df.mu.Unlock()
+
+		if !filtered {
+			ret = append(ret, decision)
+		}
+	}
+
+	return ret
+}
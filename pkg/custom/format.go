@@ -0,0 +1,209 @@
+package custom
+
+import (
+	"encoding/binary"
+	"fmt"
+	"math"
+	"strconv"
+	"strings"
+	"time"
+
+	"github.com/crowdsecurity/crowdsec/pkg/models"
+)
+
+// stdinEncoder serializes the decisions sent to the custom program in stdin mode.
+type stdinEncoder interface {
+	// appendDecision appends the record for a decision ("add" or "del") to buf
+	appendDecision(buf []byte, decision *models.Decision, action string) ([]byte, error)
+	// appendMarker appends a control record, like the end of a snapshot.
+	// path is only set for the markers that refer to a file.
+	appendMarker(buf []byte, marker string, count int, path string) []byte
+}
+
+func newStdinEncoder(format string, tsvFields []string) (stdinEncoder, error) {
+	switch format {
+	case "", "json":
+		return jsonEncoder{}, nil
+	case "tsv":
+		return newTSVEncoder(tsvFields)
+	case "binary":
+		return binaryEncoder{}, nil
+	default:
+		return nil, fmt.Errorf("unknown stdin_format '%s', must be one of: json, tsv, binary", format)
+	}
+}
+
+func durationSeconds(decision *models.Decision) int64 {
+	if decision.Duration == nil {
+		return 0
+	}
+
+	d, err := time.ParseDuration(*decision.Duration)
+	if err != nil {
+		return 0
+	}
+
+	return int64(d.Seconds())
+}
+
+func derefString(s *string) string {
+	if s == nil {
+		return ""
+	}
+
+	return *s
+}
+
+// jsonEncoder writes one JSON object per line (the default).
+type jsonEncoder struct{}
+
+func (jsonEncoder) appendDecision(buf []byte, decision *models.Decision, action string) ([]byte, error) {
+	buf, err := appendDecisionJSON(buf, decision, action)
+	if err != nil {
+		return buf, err
+	}
+
+	return append(buf, '\n'), nil
+}
+
+func (jsonEncoder) appendMarker(buf []byte, marker string, count int, path string) []byte {
+	buf = append(buf, `{"action":`...)
+	buf = strconv.AppendQuote(buf, marker)
+	buf = append(buf, `,"count":`...)
+	buf = strconv.AppendInt(buf, int64(count), 10)
+	if path != "" {
+		buf = append(buf, `,"path":`...)
+		buf = appendJSONString(buf, path)
+	}
+
+	return append(buf, "}\n"...)
+}
+
+// tsvFields are the fields that can be selected with stdin_tsv_fields.
+var tsvFields = map[string]func(decision *models.Decision, action string) string{
+	"action":           func(_ *models.Decision, action string) string { return action },
+	"id":               func(d *models.Decision, _ string) string { return strconv.FormatInt(d.ID, 10) },
+	"value":            func(d *models.Decision, _ string) string { return derefString(d.Value) },
+	"type":             func(d *models.Decision, _ string) string { return derefString(d.Type) },
+	"scope":            func(d *models.Decision, _ string) string { return derefString(d.Scope) },
+	"scenario":         func(d *models.Decision, _ string) string { return derefString(d.Scenario) },
+	"origin":           func(d *models.Decision, _ string) string { return derefString(d.Origin) },
+	"duration":         func(d *models.Decision, _ string) string { return derefString(d.Duration) },
+	"duration_seconds": func(d *models.Decision, _ string) string { return strconv.FormatInt(durationSeconds(d), 10) },
+	"until":            func(d *models.Decision, _ string) string { return d.Until },
+	"uuid":             func(d *models.Decision, _ string) string { return d.UUID },
+}
+
+var defaultTSVFields = []string{"action", "value", "duration_seconds", "type", "scope", "scenario"}
+
+var tsvEscaper = strings.NewReplacer("\\", `\\`, "\t", `\t`, "\n", `\n`, "\r", `\r`)
+
+// tsvEncoder writes the selected fields of a decision on a line, separated by tabs.
+// Backslashes, tabs and newlines in the values are escaped as \\, \t, \n and \r.
+type tsvEncoder struct {
+	fields []func(decision *models.Decision, action string) string
+}
+
+func newTSVEncoder(fields []string) (*tsvEncoder, error) {
+	if len(fields) == 0 {
+		fields = defaultTSVFields
+	}
+
+	e := &tsvEncoder{}
+
+	for _, name := range fields {
+		f, ok := tsvFields[name]
+		if !ok {
+			return nil, fmt.Errorf("unknown field '%s' in stdin_tsv_fields", name)
+		}
+
+		e.fields = append(e.fields, f)
+	}
+
+	return e, nil
+}
+
+func (e *tsvEncoder) appendDecision(buf []byte, decision *models.Decision, action string) ([]byte, error) {
+	for i, f := range e.fields {
+		if i > 0 {
+			buf = append(buf, '\t')
+		}
+
+		buf = append(buf, tsvEscaper.Replace(f(decision, action))...)
+	}
+
+	return append(buf, '\n'), nil
+}
+
+func (*tsvEncoder) appendMarker(buf []byte, marker string, count int, path string) []byte {
+	buf = append(buf, marker...)
+	buf = append(buf, '\t')
+	buf = strconv.AppendInt(buf, int64(count), 10)
+	if path != "" {
+		buf = append(buf, '\t')
+		buf = append(buf, tsvEscaper.Replace(path)...)
+	}
+
+	return append(buf, '\n')
+}
+
+// binaryEncoder writes length-prefixed frames. All integers are big-endian.
+//
+//	uint32  length of the rest of the frame
+//	byte    'a' (add), 'd' (del) or 'm' (marker)
+//	int64   decision id (marker: count)
+//	int64   duration in seconds (marker: 0)
+//	5 x (uint16 length + bytes): value, type, scope, scenario, origin
+//	                             (marker: name, path or empty, then 3 empty strings)
+type binaryEncoder struct{}
+
+func appendBinaryString(buf []byte, s string) ([]byte, error) {
+	if len(s) > math.MaxUint16 {
+		return buf, fmt.Errorf("string too long for binary format (%d bytes)", len(s))
+	}
+
+	buf = binary.BigEndian.AppendUint16(buf, uint16(len(s)))
+
+	return append(buf, s...), nil
+}
+
+func appendBinaryFrame(buf []byte, op byte, id, seconds int64, strs ...string) ([]byte, error) {
+	start := len(buf)
+	// length placeholder
+	buf = append(buf, 0, 0, 0, 0, op)
+	buf = binary.BigEndian.AppendUint64(buf, uint64(id))
+	buf = binary.BigEndian.AppendUint64(buf, uint64(seconds))
+
+	var err error
+
+	for _, s := range strs {
+		if buf, err = appendBinaryString(buf, s); err != nil {
+			return buf[:start], err
+		}
+	}
+
+	binary.BigEndian.PutUint32(buf[start:], uint32(len(buf)-start-4))
+
+	return buf, nil
+}
+
+func (binaryEncoder) appendDecision(buf []byte, decision *models.Decision, action string) ([]byte, error) {
+	op := byte('a')
+	if action == "del" {
+		op = 'd'
+	}
+
+	return appendBinaryFrame(buf, op, decision.ID, durationSeconds(decision),
+		derefString(decision.Value),
+		derefString(decision.Type),
+		derefString(decision.Scope),
+		derefString(decision.Scenario),
+		derefString(decision.Origin),
+	)
+}
+
+func (binaryEncoder) appendMarker(buf []byte, marker string, count int, path string) []byte {
+	// the marker names are short constants, and paths are limited to a few KB by the OS
+	buf, _ = appendBinaryFrame(buf, 'm', int64(count), 0, marker, path, "", "", "")
+	return buf
+}
@@ -0,0 +1,114 @@
+package custom
+
+import (
+	"container/heap"
+	"time"
+)
+
+type heapItem struct {
+	key      DecisionKey
+	deadline time.Time
+	pos      int
+}
+
+type heapItems []*heapItem
+
+func (h heapItems) Len() int           { return len(h) }
+func (h heapItems) Less(i, j int) bool { return h[i].deadline.Before(h[j].deadline) }
+
+func (h heapItems) Swap(i, j int) {
+	h[i], h[j] = h[j], h[i]
+	h[i].pos = i
+	h[j].pos = j
+}
+
+func (h *heapItems) Push(x any) {
+	item := x.(*heapItem)
+	item.pos = len(*h)
+	*h = append(*h, item)
+}
+
+func (h *heapItems) Pop() any {
+	old := *h
+	n := len(old)
+	item := old[n-1]
+	old[n-1] = nil
+	*h = old[:n-1]
+
+	return item
+}
+
+// deadlineHeap is a min-heap of decision keys ordered by deadline, with at
+// most one deadline per key. It's not safe for concurrent use.
+type deadlineHeap struct {
+	items heapItems
+	index map[DecisionKey]*heapItem
+}
+
+// set adds the key, or moves its deadline if it's already there.
+func (h *deadlineHeap) set(key DecisionKey, deadline time.Time) {
+	if h.index == nil {
+		h.index = make(map[DecisionKey]*heapItem)
+	}
+
+	if item, ok := h.index[key]; ok {
+		item.deadline = deadline
+		heap.Fix(&h.items, item.pos)
+
+		return
+	}
+
+	item := &heapItem{key: key, deadline: deadline}
+	h.index[key] = item
+	heap.Push(&h.items, item)
+}
+
+func (h *deadlineHeap) remove(key DecisionKey) {
+	item, ok := h.index[key]
+	if !ok {
+		return
+	}
+
+	heap.Remove(&h.items, item.pos)
+	delete(h.index, key)
+}
+
+func (h *deadlineHeap) deadline(key DecisionKey) (time.Time, bool) {
+	item, ok := h.index[key]
+	if !ok {
+		return time.Time{}, false
+	}
+
+	return item.deadline, true
+}
+
+// next returns the earliest deadline.
+func (h *deadlineHeap) next() (time.Time, bool) {
+	if len(h.items) == 0 {
+		return time.Time{}, false
+	}
+
+	return h.items[0].deadline, true
+}
+
+// popExpired removes and returns the keys with a deadline not after now, earliest first.
+func (h *deadlineHeap) popExpired(now time.Time) []DecisionKey {
+	return h.popExpiredN(now, -1)
+}
+
+// popExpiredN is popExpired for at most n keys, or all of them if n < 0.
+func (h *deadlineHeap) popExpiredN(now time.Time, n int) []DecisionKey {
+	var ret []DecisionKey
+
+	for len(h.items) > 0 && !h.items[0].deadline.After(now) && len(ret) != n {
+		item := heap.Pop(&h.items).(*heapItem)
+		delete(h.index, item.key)
+		ret = append(ret, item.key)
+	}
+
+	return ret
+}
+
+func (h *deadlineHeap) len() int {
+	return len(h.items)
+}
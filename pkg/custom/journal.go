@@ -0,0 +1,251 @@
+package custom
+
+import (
+	"bufio"
+	"bytes"
+	"encoding/json"
+	"errors"
+	"fmt"
+	"io"
+	"os"
+	"path/filepath"
+	"sync"
+
+	log "github.com/sirupsen/logrus"
+
+	"github.com/crowdsecurity/crowdsec/pkg/models"
+)
+
+const (
+	journalFile = "decisions.journal"
+	// the journal is not compacted before it has this many records
+	journalMinCompact = 1024
+)
+
+// journal is an append-only log of the add/del operations sent to the custom
+// program, one JSON line per operation. It's rewritten with only the active
+// decisions when it grows to twice their number.
+type journal struct {
+	mu      sync.Mutex
+	path    string
+	f       *os.File
+	w       *bufio.Writer
+	records int
+}
+
+// openJournal reads the journal in dir, if any, and returns it ready to append
+// with the decisions it contains. A truncated last line, left by a crash, is ignored.
+func openJournal(dir string) (*journal, map[DecisionKey]*models.Decision, error) {
+	if err := os.MkdirAll(dir, 0o750); err != nil {
+		return nil, nil, err
+	}
+
+	j := &journal{path: filepath.Join(dir, journalFile)}
+
+	decisions, err := readJournal(j.path)
+	if err != nil {
+		return nil, nil, err
+	}
+
+	snapshot := make([]*models.Decision, 0, len(decisions))
+	for _, decision := range decisions {
+		snapshot = append(snapshot, decision)
+	}
+
+	// start from a compacted file, without the records of the previous run
+	if err := j.compact(snapshot); err != nil {
+		return nil, nil, err
+	}
+
+	return j, decisions, nil
+}
+
+func readJournal(path string) (map[DecisionKey]*models.Decision, error) {
+	decisions := make(map[DecisionKey]*models.Decision)
+
+	f, err := os.Open(path)
+	if errors.Is(err, os.ErrNotExist) {
+		return decisions, nil
+	}
+	if err != nil {
+		return nil, err
+	}
+	defer f.Close()
+
+	r := bufio.NewReader(f)
+
+	for lineno := 1; ; lineno++ {
+		line, err := r.ReadBytes('\n')
+		if errors.Is(err, io.EOF) {
+			if len(bytes.TrimSpace(line)) != 0 {
+				log.Warningf("%s: ignoring truncated record at line %d", path, lineno)
+			}
+			return decisions, nil
+		}
+		if err != nil {
+			return nil, err
+		}
+
+		var record DecisionWithAction
+		if err := json.Unmarshal(line, &record); err != nil {
+			return nil, fmt.Errorf("%s: line %d: %w", path, lineno, err)
+		}
+
+		if record.Value == nil || record.Type == nil {
+			return nil, fmt.Errorf("%s: line %d: missing value or type", path, lineno)
+		}
+
+		decision := record.Decision
+		decision.ID = record.ID
+		key := decisionToDecisionKey(&decision)
+
+		switch record.Action {
+		case "add":
+			decisions[key] = &decision
+		case "del":
+			delete(decisions, key)
+		default:
+			return nil, fmt.Errorf("%s: line %d: unknown action '%s'", path, lineno, record.Action)
+		}
+	}
+}
+
+func (j *journal) append(decision *models.Decision, action string) {
+	j.mu.Lock()
+	defer j.mu.Unlock()
+
+	if j.w == nil {
+		return
+	}
+
+	buf := getBuffer()
+	defer putBuffer(buf)
+
+	b, err := jsonEncoder{}.appendDecision(*buf, decision, action)
+	*buf = b
+	if err != nil {
+		log.Warningf("serialize: %s", err)
+		return
+	}
+
+	if _, err := j.w.Write(b); err != nil {
+		log.Errorf("unable to write to %s: %s", j.path, err)
+		return
+	}
+
+	j.records++
+}
+
+// sync writes the buffered records to disk, and compacts the journal if
+// active (the number of active decisions) is less than half of its records.
+func (j *journal) sync(active int, snapshot func() []*models.Decision) error {
+	j.mu.Lock()
+	defer j.mu.Unlock()
+
+	if j.w == nil {
+		return nil
+	}
+
+	if j.records > journalMinCompact && j.records > 2*active {
+		return j.compact(snapshot())
+	}
+
+	if err := j.w.Flush(); err != nil {
+		return err
+	}
+
+	return j.f.Sync()
+}
+
+// reset replaces the recorded decisions with the given ones.
+func (j *journal) reset(decisions []*models.Decision) error {
+	j.mu.Lock()
+	defer j.mu.Unlock()
+
+	return j.compact(decisions)
+}
+
+// compact replaces the journal with one "add" record per decision. The new
+// file is written aside and renamed, so a crash leaves either one in place.
+// It must be called with j.mu held, or before the journal is shared.
+func (j *journal) compact(decisions []*models.Decision) error {
+	tmp, err := os.CreateTemp(filepath.Dir(j.path), journalFile+".*")
+	if err != nil {
+		return err
+	}
+	defer os.Remove(tmp.Name())
+
+	w := bufio.NewWriter(tmp)
+
+	var buf []byte
+
+	for _, decision := range decisions {
+		buf, err = jsonEncoder{}.appendDecision(buf[:0], decision, "add")
+		if err != nil {
+			log.Warningf("serialize: %s", err)
+			continue
+		}
+
+		if _, err := w.Write(buf); err != nil {
+			tmp.Close()
+			return err
+		}
+	}
+
+	if err := w.Flush(); err != nil {
+		tmp.Close()
+		return err
+	}
+
+	if err := tmp.Sync(); err != nil {
+		tmp.Close()
+		return err
+	}
+
+	if err := tmp.Close(); err != nil {
+		return err
+	}
+
+	if j.f != nil {
+		// the old records are superseded, even if they couldn't be written
+		_ = j.w.Flush()
+		j.f.Close()
+		j.f, j.w = nil, nil
+	}
+
+	if err := os.Rename(tmp.Name(), j.path); err != nil {
+		return err
+	}
+
+	f, err := os.OpenFile(j.path, os.O_WRONLY|os.O_APPEND, 0o600)
+	if err != nil {
+		return err
+	}
+
+	j.f = f
+	j.w = bufio.NewWriter(f)
+	j.records = len(decisions)
+
+	return nil
+}
+
+func (j *journal) close() error {
+	j.mu.Lock()
+	defer j.mu.Unlock()
+
+	if j.f == nil {
+		return nil
+	}
+
+	err := j.w.Flush()
+	if serr := j.f.Sync(); err == nil {
+		err = serr
+	}
+	if cerr := j.f.Close(); err == nil {
+		err = cerr
+	}
+
+	j.f, j.w = nil, nil
+
+	return err
+}
@@ -0,0 +1,72 @@
+package custom
+
+import (
+	"sync"
+	"sync/atomic"
+	"time"
+
+	log "github.com/sirupsen/logrus"
+
+	"github.com/crowdsecurity/cs-custom-bouncer/pkg/metrics"
+)
+
+var logSampling struct {
+	first      atomic.Int64
+	thereafter atomic.Int64
+}
+
+// SetLogSampling sets the sampling of the per-decision debug lines: for each
+// message, the first `first` lines of every second are logged, then one in
+// `thereafter`. All the lines are logged if first is 0, the default.
+func SetLogSampling(first, thereafter int) {
+	logSampling.first.Store(int64(first))
+	logSampling.thereafter.Store(int64(thereafter))
+}
+
+// LogSampler samples the lines of one of the per-decision debug messages.
+type LogSampler struct {
+	mu     sync.Mutex
+	second int64
+	count  int64
+}
+
+// Enabled tells if the next line of the message is to be logged: debug
+// logging is enabled and the line is sampled. Its arguments are only to be
+// computed then.
+func (s *LogSampler) Enabled() bool {
+	if !log.IsLevelEnabled(log.DebugLevel) {
+		return false
+	}
+
+	if s.sample(time.Now()) {
+		return true
+	}
+
+	metrics.LogDroppedLines.WithLabelValues("sampled").Inc()
+
+	return false
+}
+
+func (s *LogSampler) sample(now time.Time) bool {
+	first := logSampling.first.Load()
+	if first <= 0 {
+		return true
+	}
+
+	s.mu.Lock()
+	defer s.mu.Unlock()
+
+	if sec := now.Unix(); sec != s.second {
+		s.second = sec
+		s.count = 0
+	}
+
+	s.count++
+	if s.count <= first {
+		return true
+	}
+
+	thereafter := logSampling.thereafter.Load()
+
+	return thereafter > 0 && (s.count-first)%thereafter == 0
+}
@@ -0,0 +1,95 @@
+package custom
+
+import (
+	"context"
+	"hash/fnv"
+	"sync"
+	"time"
+
+	log "github.com/sirupsen/logrus"
+
+	"github.com/crowdsecurity/crowdsec/pkg/models"
+
+	"github.com/crowdsecurity/cs-custom-bouncer/pkg/metrics"
+)
+
+// queue size of each worker, Submit() blocks when it's full
+const execQueueSize = 1024
+
+type execJob struct {
+	action   string
+	decision *models.Decision
+	received time.Time
+}
+
+// ExecPool runs the live mode commands on a fixed number of workers.
+// All the commands for a given DecisionKey are run by the same worker,
+// so they are executed in the order they have been submitted.
+type ExecPool struct {
+	custom *CustomBouncer
+	queues []chan execJob
+	wg     sync.WaitGroup
+}
+
+func NewExecPool(ctx context.Context, c *CustomBouncer, workers int) *ExecPool {
+	p := &ExecPool{
+		custom: c,
+		queues: make([]chan execJob, workers),
+	}
+
+	for i := range p.queues {
+		p.queues[i] = make(chan execJob, execQueueSize)
+		p.wg.Add(1)
+
+		go func(queue <-chan execJob) {
+			defer p.wg.Done()
+			p.work(ctx, queue)
+		}(p.queues[i])
+	}
+
+	return p
+}
+
+func (p *ExecPool) work(ctx context.Context, queue <-chan execJob) {
+	for job := range queue {
+		var err error
+
+		metrics.DispatchLag.Observe(time.Since(job.received).Seconds())
+
+		switch job.action {
+		case "add":
+			err = p.custom.Add(ctx, job.decision)
+		case "del":
+			err = p.custom.Delete(ctx, job.decision)
+		}
+
+		if err != nil {
+			log.Errorf("unable to %s decision for '%s': %s", job.action, *job.decision.Value, err)
+		}
+	}
+}
+
+// Submit queues a command ("add" or "del") for the decision, received from LAPI at the given time.
+func (p *ExecPool) Submit(action string, decision *models.Decision, received time.Time) {
+	key := decisionToDecisionKey(decision)
+	p.queues[keyHash(key)%uint64(len(p.queues))] <- execJob{action: action, decision: decision, received: received}
+}
+
+// Close waits for the queued commands to complete. Submit() must not be called afterwards.
+func (p *ExecPool) Close() {
+	for _, queue := range p.queues {
+		close(queue)
+	}
+
+	p.wg.Wait()
+}
+
+// keyHash is a stable hash of the decision key, used to partition the decisions.
+func keyHash(key DecisionKey) uint64 {
+	h := fnv.New64a()
+	h.Write([]byte(key.Value))
+	h.Write([]byte{0})
+	h.Write([]byte(key.Type))
+
+	return h.Sum64()
+}
@@ -0,0 +1,222 @@
+package custom
+
+import (
+	"context"
+	"sync"
+	"time"
+
+	"github.com/prometheus/client_golang/prometheus"
+	log "github.com/sirupsen/logrus"
+
+	"github.com/crowdsecurity/crowdsec/pkg/models"
+
+	"github.com/crowdsecurity/cs-custom-bouncer/pkg/metrics"
+)
+
+// QueuedBatch is a batch of decisions received from LAPI, waiting to be dispatched.
+type QueuedBatch struct {
+	Deleted  []*models.Decision
+	New      []*models.Decision
+	Received time.Time
+	queued   time.Time
+}
+
+// DispatchQueue holds the stream batches of a sink, between the reception
+// from LAPI and their dispatch. When it has queue_size batches, queue_policy
+// decides what happens to the next one:
+//
+//   - block: Push waits until a batch has been dispatched.
+//   - drop_oldest_adds: the additions of the oldest batch are dropped, its
+//     deletions are merged into the next batch.
+//   - collapse: all the batches are merged into one, with only the last
+//     operation on each decision (and the deletion before an addition).
+//
+// Deletions are never dropped, not to leave a decision applied forever.
+type DispatchQueue struct {
+	mu      sync.Mutex
+	batches []*QueuedBatch
+	name    string
+	size    int
+	policy  string
+	closed  bool
+	// signaled when a batch is pushed, or popped
+	ready chan struct{}
+	room  chan struct{}
+
+	depth   prometheus.Gauge
+	wait    prometheus.Observer
+	dropped prometheus.Counter
+}
+
+// NewDispatchQueue returns the queue of the sink, with its queue_size and queue_policy.
+func (c *CustomBouncer) NewDispatchQueue() *DispatchQueue {
+	return &DispatchQueue{
+		name:    c.name,
+		size:    max(c.queueSize, 1),
+		policy:  c.queuePolicy,
+		ready:   make(chan struct{}, 1),
+		room:    make(chan struct{}, 1),
+		depth:   metrics.SinkQueueDepth.WithLabelValues(c.name),
+		wait:    metrics.SinkQueueWait.WithLabelValues(c.name),
+		dropped: metrics.SinkQueueDropped.WithLabelValues(c.name),
+	}
+}
+
+func notify(ch chan struct{}) {
+	select {
+	case ch <- struct{}{}:
+	default:
+	}
+}
+
+// Push queues a batch received from LAPI at the given time. It only returns
+// an error if ctx is done while waiting, with the block policy.
+func (q *DispatchQueue) Push(ctx context.Context, deleted, added []*models.Decision, received time.Time) error {
+	batch := &QueuedBatch{Deleted: deleted, New: added, Received: received, queued: time.Now()}
+
+	q.mu.Lock()
+	defer q.mu.Unlock()
+
+	for len(q.batches) >= q.size {
+		switch q.policy {
+		case "drop_oldest_adds":
+			q.dropOldestAdds(batch)
+			continue
+		case "collapse":
+			q.collapse(batch)
+			return nil
+		}
+
+		log.Warningf("queue of sink %s is full (%d batches), waiting", q.name, len(q.batches))
+		q.mu.Unlock()
+		select {
+		case <-q.room:
+		case <-ctx.Done():
+			q.mu.Lock()
+			return ctx.Err()
+		}
+		q.mu.Lock()
+	}
+
+	q.batches = append(q.batches, batch)
+	q.depth.Set(float64(len(q.batches)))
+	notify(q.ready)
+
+	return nil
+}
+
+// dropOldestAdds removes the oldest batch, and moves its deletions to the
+// next one. batch is the one being pushed.
+func (q *DispatchQueue) dropOldestAdds(batch *QueuedBatch) {
+	oldest := q.batches[0]
+	q.batches = q.batches[1:]
+
+	next := batch
+	if len(q.batches) != 0 {
+		next = q.batches[0]
+	}
+
+	// the slices of a batch are shared with the other sinks
+	deleted := make([]*models.Decision, 0, len(oldest.Deleted)+len(next.Deleted))
+	next.Deleted = append(append(deleted, oldest.Deleted...), next.Deleted...)
+	next.Received = oldest.Received
+	next.queued = oldest.queued
+
+	if len(oldest.New) != 0 {
+		log.Warningf("queue of sink %s is full, dropping %d new decisions", q.name, len(oldest.New))
+		q.dropped.Add(float64(len(oldest.New)))
+	}
+}
+
+// collapse replaces the queued batches and batch with a single one.
+func (q *DispatchQueue) collapse(batch *QueuedBatch) {
+	co := &Coalescer{pending: make(map[DecisionKey]*coalescedKey)}
+
+	for _, b := range append(q.batches, batch) {
+		co.Push(b.Deleted, b.New)
+	}
+
+	merged := &QueuedBatch{Received: q.batches[0].Received, queued: q.batches[0].queued}
+
+	total := 0
+
+	for _, key := range co.order {
+		p := co.pending[key]
+		total += p.ops
+
+		if !p.lastAdd {
+			merged.Deleted = append(merged.Deleted, p.last)
+			continue
+		}
+
+		if p.firstDel != nil {
+			merged.Deleted = append(merged.Deleted, p.firstDel)
+		}
+		merged.New = append(merged.New, p.last)
+	}
+
+	if dropped := total - len(merged.Deleted) - len(merged.New); dropped > 0 {
+		metrics.CoalescedOperations.Add(float64(dropped))
+	}
+
+	log.Warningf("queue of sink %s is full, collapsing %d batches", q.name, len(q.batches)+1)
+
+	q.batches = []*QueuedBatch{merged}
+	q.depth.Set(1)
+	notify(q.ready)
+}
+
+// Ready is signaled when there may be a batch to Pop.
+func (q *DispatchQueue) Ready() <-chan struct{} {
+	return q.ready
+}
+
+// Pop returns the oldest batch, if any.
+func (q *DispatchQueue) Pop() (*QueuedBatch, bool) {
+	q.mu.Lock()
+	defer q.mu.Unlock()
+
+	if len(q.batches) == 0 {
+		return nil, false
+	}
+
+	batch := q.batches[0]
+	q.batches[0] = nil
+	q.batches = q.batches[1:]
+
+	q.depth.Set(float64(len(q.batches)))
+	q.wait.Observe(time.Since(batch.queued).Seconds())
+	notify(q.room)
+
+	if len(q.batches) != 0 || q.closed {
+		notify(q.ready)
+	}
+
+	return batch, true
+}
+
+// Close is called when no more batches will be pushed. Ready is signaled
+// when the queue is empty, for Closed to be checked.
+func (q *DispatchQueue) Close() {
+	q.mu.Lock()
+	defer q.mu.Unlock()
+
+	q.closed = true
+	notify(q.ready)
+}
+
+// Closed returns true if the queue has been closed, and all its batches popped.
+func (q *DispatchQueue) Closed() bool {
+	q.mu.Lock()
+	defer q.mu.Unlock()
+
+	return q.closed && len(q.batches) == 0
+}
+
+// Len returns the number of queued batches.
+func (q *DispatchQueue) Len() int {
+	q.mu.Lock()
+	defer q.mu.Unlock()
+
+	return len(q.batches)
+}
@@ -0,0 +1,141 @@
+package custom
+
+import (
+	"context"
+	"sync"
+	"time"
+
+	log "github.com/sirupsen/logrus"
+
+	"github.com/crowdsecurity/cs-custom-bouncer/pkg/metrics"
+)
+
+// forkLimiter is a token bucket that limits the number of commands run per
+// second in live mode. When both actions are waiting for a token, the
+// commands of the first action get it first.
+type forkLimiter struct {
+	mu     sync.Mutex
+	rate   float64
+	burst  float64
+	tokens float64
+	last   time.Time
+	first  string
+	// number of commands waiting for a token, by action
+	waiting map[string]int
+	// set while commands are waiting, for the logs
+	throttledSince time.Time
+	throttled      int
+}
+
+// newForkLimiter returns nil if rate is 0, wait can be called on a nil limiter.
+func newForkLimiter(rate float64, burst int, first string) *forkLimiter {
+	if rate <= 0 {
+		return nil
+	}
+
+	if first == "" {
+		first = "del"
+	}
+
+	return &forkLimiter{
+		rate:    rate,
+		burst:   float64(burst),
+		tokens:  float64(burst),
+		last:    time.Now(),
+		first:   first,
+		waiting: make(map[string]int),
+	}
+}
+
+func (l *forkLimiter) refill(now time.Time) {
+	l.tokens = min(l.burst, l.tokens+now.Sub(l.last).Seconds()*l.rate)
+	l.last = now
+}
+
+// take returns 0 if a token has been taken for the action, or how long to
+// wait before trying again.
+func (l *forkLimiter) take(action string, now time.Time) time.Duration {
+	l.refill(now)
+
+	// the other action waits while the first one has commands waiting
+	if l.tokens >= 1 && (action == l.first || l.waiting[l.first] == 0) {
+		l.tokens--
+		return 0
+	}
+
+	if l.tokens >= 1 {
+		return time.Duration(float64(time.Second) / l.rate)
+	}
+
+	return time.Duration((1 - l.tokens) / l.rate * float64(time.Second))
+}
+
+// wait blocks until the command for the action ("add" or "del") can be run.
+func (l *forkLimiter) wait(ctx context.Context, action string) error {
+	if l == nil {
+		return nil
+	}
+
+	l.mu.Lock()
+	delay := l.take(action, time.Now())
+	if delay == 0 {
+		l.mu.Unlock()
+		return nil
+	}
+	l.startWaiting(action)
+	l.mu.Unlock()
+
+	start := time.Now()
+	timer := time.NewTimer(delay)
+
+	defer func() {
+		timer.Stop()
+		metrics.ExecThrottledSeconds.WithLabelValues(action).Add(time.Since(start).Seconds())
+		l.mu.Lock()
+		l.stopWaiting(action)
+		l.mu.Unlock()
+	}()
+
+	for {
+		select {
+		case <-ctx.Done():
+			return ctx.Err()
+		case <-timer.C:
+		}
+
+		l.mu.Lock()
+		delay = l.take(action, time.Now())
+		l.mu.Unlock()
+
+		if delay == 0 {
+			return nil
+		}
+
+		timer.Reset(delay)
+	}
+}
+
+func (l *forkLimiter) startWaiting(action string) {
+	l.waiting[action]++
+	l.throttled++
+	metrics.ExecThrottled.WithLabelValues(action).Inc()
+
+	if l.throttledSince.IsZero() {
+		l.throttledSince = time.Now()
+		log.Warningf("live mode commands are throttled to %g per second", l.rate)
+	}
+}
+
+func (l *forkLimiter) stopWaiting(action string) {
+	l.waiting[action]--
+	metrics.ExecThrottled.WithLabelValues(action).Dec()
+
+	if l.waiting["add"] != 0 || l.waiting["del"] != 0 {
+		return
+	}
+
+	log.Infof("live mode commands are no longer throttled: %d commands delayed over %s",
+		l.throttled, time.Since(l.throttledSince).Round(time.Millisecond))
+	l.throttledSince = time.Time{}
+	l.throttled = 0
+}
@@ -0,0 +1,110 @@
+package custom
+
+import (
+	"bufio"
+	"encoding/json"
+	"io"
+	"time"
+
+	log "github.com/sirupsen/logrus"
+
+	"github.com/crowdsecurity/crowdsec/pkg/models"
+
+	"github.com/crowdsecurity/cs-custom-bouncer/pkg/metrics"
+)
+
+// RecordedBatch is a batch of decisions received from LAPI, as written by the
+// Recorder and read by -replay: one JSON object per line.
+type RecordedBatch struct {
+	ReceivedAt time.Time          `json:"received_at"`
+	New        []*models.Decision `json:"new"`
+	Deleted    []*models.Decision `json:"deleted"`
+}
+
+// Recorder writes the batches received from LAPI to a file, from its own
+// goroutine. Up to bufferSize batches wait to be written, the next ones are
+// dropped: the stream is never slowed down by the recording.
+type Recorder struct {
+	w       io.WriteCloser
+	batches chan *RecordedBatch
+	done    chan struct{}
+	err     error
+}
+
+// NewRecorder starts recording to w, until Close is called.
+func NewRecorder(w io.WriteCloser, bufferSize int) *Recorder {
+	r := &Recorder{
+		w:       w,
+		batches: make(chan *RecordedBatch, bufferSize),
+		done:    make(chan struct{}),
+	}
+
+	go r.run()
+
+	return r
+}
+
+func (r *Recorder) run() {
+	defer close(r.done)
+
+	buf := bufio.NewWriterSize(r.w, 64*1024)
+	encoder := json.NewEncoder(buf)
+
+	for batch := range r.batches {
+		if r.err != nil {
+			// keep reading, not to block Record
+			continue
+		}
+
+		if err := encoder.Encode(batch); err != nil {
+			log.Errorf("unable to record stream batch: %s", err)
+			r.err = err
+			continue
+		}
+
+		metrics.RecordedBatches.WithLabelValues("written").Inc()
+
+		// write when there's nothing else to encode
+		if len(r.batches) == 0 {
+			if err := buf.Flush(); err != nil {
+				log.Errorf("unable to record stream batch: %s", err)
+				r.err = err
+			}
+		}
+	}
+
+	if r.err == nil {
+		r.err = buf.Flush()
+	}
+}
+
+// Record queues a batch received at the given time, or drops it if the buffer
+// is full. It can be called on a nil Recorder. The decisions must not be
+// modified afterwards.
+func (r *Recorder) Record(received time.Time, deleted, added []*models.Decision) {
+	if r == nil {
+		return
+	}
+
+	select {
+	case r.batches <- &RecordedBatch{ReceivedAt: received, New: added, Deleted: deleted}:
+	default:
+		metrics.RecordedBatches.WithLabelValues("dropped").Inc()
+	}
+}
+
+// Close writes the queued batches and closes the file. Record must not be called afterwards.
+func (r *Recorder) Close() error {
+	if r == nil {
+		return nil
+	}
+
+	close(r.batches)
+	<-r.done
+
+	if err := r.w.Close(); err != nil && r.err == nil {
+		r.err = err
+	}
+
+	return r.err
+}
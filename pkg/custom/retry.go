@@ -0,0 +1,320 @@
+package custom
+
+import (
+	"context"
+	"math/rand"
+	"os"
+	"sync"
+	"time"
+
+	log "github.com/sirupsen/logrus"
+
+	"github.com/crowdsecurity/crowdsec/pkg/models"
+
+	"github.com/crowdsecurity/cs-custom-bouncer/pkg/metrics"
+)
+
+type retryEntry struct {
+	decision *models.Decision
+	action   string
+	attempts int
+	// set when the entry is being run, closed once it's done
+	done chan struct{}
+	// a newer command for the key has been received while it was running
+	cancelled bool
+}
+
+// retryQueue keeps the live mode commands that have failed, to run them again
+// with an exponential backoff. There's at most one entry per decision key: a
+// new add/del of the decision replaces the one that failed, or waits for it
+// if it's already being run, so that the commands of a key stay in order.
+type retryQueue struct {
+	mu         sync.Mutex
+	deadlines  deadlineHeap
+	entries    map[DecisionKey]*retryEntry
+	running    map[DecisionKey]*retryEntry
+	maxRetries int
+	backoff    time.Duration
+	maxBackoff time.Duration
+	deadLetter string
+	// signaled when an entry is added, to recompute the next deadline
+	wake chan struct{}
+}
+
+func newRetryQueue(maxRetries int, backoff, maxBackoff time.Duration, deadLetter string) *retryQueue {
+	return &retryQueue{
+		entries:    make(map[DecisionKey]*retryEntry),
+		running:    make(map[DecisionKey]*retryEntry),
+		maxRetries: maxRetries,
+		backoff:    backoff,
+		maxBackoff: maxBackoff,
+		deadLetter: deadLetter,
+		wake:       make(chan struct{}, 1),
+	}
+}
+
+// delay returns the backoff before an attempt, with a random jitter of up to
+// half of it, so that the failures of a batch are not retried all at once.
+func (q *retryQueue) delay(attempt int) time.Duration {
+	d := q.backoff
+	for i := 1; i < attempt && d < q.maxBackoff; i++ {
+		d *= 2
+	}
+
+	d = min(d, q.maxBackoff)
+
+	return d/2 + time.Duration(rand.Int63n(int64(d/2)+1))
+}
+
+// push schedules another attempt of a failed command, or writes it to the
+// dead letter file if it's failed too many times already.
+func (q *retryQueue) push(decision *models.Decision, action string, attempts int) {
+	if attempts > q.maxRetries {
+		q.giveUp(decision, action)
+		return
+	}
+
+	q.mu.Lock()
+	q.schedule(decision, action, attempts)
+	q.mu.Unlock()
+
+	q.signal()
+}
+
+// schedule adds an entry, with q.mu held.
+func (q *retryQueue) schedule(decision *models.Decision, action string, attempts int) {
+	key := decisionToDecisionKey(decision)
+
+	if _, ok := q.entries[key]; !ok {
+		metrics.RetryQueueDepth.Inc()
+	}
+	q.entries[key] = &retryEntry{decision: decision, action: action, attempts: attempts}
+	q.deadlines.set(key, time.Now().Add(q.delay(attempts)))
+}
+
+func (q *retryQueue) signal() {
+	select {
+	case q.wake <- struct{}{}:
+	default:
+	}
+}
+
+func (q *retryQueue) giveUp(decision *models.Decision, action string) {
+	metrics.RetryResults.WithLabelValues("dead_letter").Inc()
+	log.Errorf("giving up '%s' for '%s' after %d retries", action, derefString(decision.Value), q.maxRetries)
+	q.writeDeadLetter(decision, action)
+}
+
+// cancel drops the entry of a key, before a new command is run for it. If the
+// entry is being run, it waits for it to complete, and its result is ignored.
+func (q *retryQueue) cancel(key DecisionKey) {
+	q.mu.Lock()
+
+	if _, ok := q.entries[key]; ok {
+		delete(q.entries, key)
+		q.deadlines.remove(key)
+		metrics.RetryQueueDepth.Dec()
+	}
+
+	running := q.running[key]
+	if running != nil {
+		running.cancelled = true
+	}
+
+	q.mu.Unlock()
+
+	if running != nil {
+		<-running.done
+	}
+}
+
+// due removes and returns the entries to run now, and when to check again.
+// They must be passed to finish once they have been run.
+func (q *retryQueue) due(now time.Time) ([]*retryEntry, time.Time, bool) {
+	q.mu.Lock()
+	defer q.mu.Unlock()
+
+	var ret []*retryEntry
+
+	for _, key := range q.deadlines.popExpired(now) {
+		e := q.entries[key]
+		e.done = make(chan struct{})
+		q.running[key] = e
+		ret = append(ret, e)
+		delete(q.entries, key)
+	}
+
+	metrics.RetryQueueDepth.Sub(float64(len(ret)))
+
+	next, ok := q.deadlines.next()
+
+	return ret, next, ok
+}
+
+// isCancelled tells if a newer command has been received for the key of a running entry.
+func (q *retryQueue) isCancelled(e *retryEntry) bool {
+	q.mu.Lock()
+	defer q.mu.Unlock()
+
+	return e.cancelled
+}
+
+// finish releases a running entry and, if it has failed, schedules another
+// attempt or gives up. It tells if the entry has been cancelled meanwhile, in
+// which case its result is ignored.
+func (q *retryQueue) finish(e *retryEntry, failed bool) bool {
+	key := decisionToDecisionKey(e.decision)
+
+	q.mu.Lock()
+
+	if q.running[key] == e {
+		delete(q.running, key)
+	}
+
+	cancelled := e.cancelled
+	retry := failed && !cancelled && e.attempts < q.maxRetries
+	if retry {
+		// before the entry is released, a cancel must find it
+		q.schedule(e.decision, e.action, e.attempts+1)
+	}
+
+	close(e.done)
+	q.mu.Unlock()
+
+	switch {
+	case retry:
+		q.signal()
+	case failed && !cancelled:
+		q.giveUp(e.decision, e.action)
+	}
+
+	return cancelled
+}
+
+func (q *retryQueue) writeDeadLetter(decision *models.Decision, action string) {
+	if q.deadLetter == "" {
+		return
+	}
+
+	line, err := jsonEncoder{}.appendDecision(nil, decision, action)
+	if err != nil {
+		log.Warningf("serialize: %s", err)
+		return
+	}
+
+	f, err := os.OpenFile(q.deadLetter, os.O_WRONLY|os.O_APPEND|os.O_CREATE, 0o600)
+	if err != nil {
+		log.Errorf("unable to open dead letter file: %s", err)
+		return
+	}
+	defer f.Close()
+
+	if _, err := f.Write(line); err != nil {
+		log.Errorf("unable to write to dead letter file: %s", err)
+	}
+}
+
+// RunRetryQueue runs the failed live mode commands again, until ctx is done.
+// It returns immediately if exec_retries is 0.
+func (c *CustomBouncer) RunRetryQueue(ctx context.Context) error {
+	q := c.retries
+	if q == nil {
+		return nil
+	}
+
+	timer := time.NewTimer(time.Hour)
+	defer timer.Stop()
+
+	for {
+		entries, next, ok := q.due(time.Now())
+
+		if len(entries) != 0 {
+			c.retry(ctx, entries)
+			// the commands took some time, look again
+			continue
+		}
+
+		timer.Stop()
+		if ok {
+			timer.Reset(time.Until(next))
+		}
+
+		select {
+		case <-ctx.Done():
+			return ctx.Err()
+		case <-q.wake:
+		case <-timer.C:
+		}
+	}
+}
+
+func (c *CustomBouncer) retry(ctx context.Context, entries []*retryEntry) {
+	if !c.BatchExec() {
+		for _, e := range entries {
+			if c.retries.isCancelled(e) {
+				c.retries.finish(e, false)
+				continue
+			}
+			c.retryResult(e, c.execDecision(ctx, e.action, e.decision))
+		}
+		return
+	}
+
+	// one batch per action, deletions first
+	for _, action := range []string{"del", "add"} {
+		var batch []*retryEntry
+		var decisions []*models.Decision
+
+		for _, e := range entries {
+			if e.action != action {
+				continue
+			}
+			if c.retries.isCancelled(e) {
+				c.retries.finish(e, false)
+				continue
+			}
+			batch = append(batch, e)
+			decisions = append(decisions, e.decision)
+		}
+
+		if len(batch) == 0 {
+			continue
+		}
+
+		size := c.maxBatchSize
+		if size <= 0 {
+			size = len(batch)
+		}
+
+		for start := 0; start < len(batch); start += size {
+			end := min(start+size, len(batch))
+			err := c.execChunk(ctx, action+"-batch", decisions[start:end])
+			for _, e := range batch[start:end] {
+				c.retryResult(e, err)
+			}
+		}
+	}
+}
+
+func (c *CustomBouncer) retryResult(e *retryEntry, err error) {
+	if err != nil {
+		metrics.RetryResults.WithLabelValues("failure").Inc()
+	} else {
+		metrics.RetryResults.WithLabelValues("success").Inc()
+	}
+
+	if c.retries.finish(e, err != nil) || err != nil {
+		// superseded by a newer command for the key, run after this one,
+		// or scheduled again
+		return
+	}
+
+	key := decisionToDecisionKey(e.decision)
+	if e.action == "add" {
+		c.setActive(key, e.decision)
+		c.newDecisionValueSet.add(key)
+	} else {
+		c.removeActive(key, e.decision)
+		c.expiredDecisionValueSet.add(key)
+	}
+}
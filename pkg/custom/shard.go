@@ -0,0 +1,75 @@
+package custom
+
+import (
+	"context"
+	"sync"
+
+	"github.com/crowdsecurity/crowdsec/pkg/models"
+)
+
+// stdinShard is one of the stdin_workers copies of the custom program, in
+// stdin mode. Each one receives the decisions of a partition of the keys.
+type stdinShard struct {
+	mu     sync.Mutex
+	writer *StdinWriter
+	acks   *ackTracker
+	// closed when the first program has been attached
+	attached   chan struct{}
+	attachOnce sync.Once
+}
+
+// flush writes the buffered lines to the program.
+func (s *stdinShard) flush() error {
+	s.mu.Lock()
+	defer s.mu.Unlock()
+
+	if s.writer == nil {
+		return nil
+	}
+
+	return s.writer.Flush()
+}
+
+// StdinWorkers returns the number of copies of the custom program to run in stdin mode.
+func (c *CustomBouncer) StdinWorkers() int {
+	return len(c.shards)
+}
+
+// WaitStdin waits until a program has been attached to every shard with
+// SetShardStdin, in stdin mode, or until ctx is done.
+func (c *CustomBouncer) WaitStdin(ctx context.Context) error {
+	for _, s := range c.shards {
+		select {
+		case <-s.attached:
+		case <-ctx.Done():
+			return ctx.Err()
+		}
+	}
+
+	return nil
+}
+
+// shardOf returns the index of the program that receives the decision. All the
+// decisions for the same DecisionKey go to the same program.
+func (c *CustomBouncer) shardOf(decision *models.Decision) int {
+	if len(c.shards) == 1 {
+		return 0
+	}
+
+	return int(keyHash(decisionToDecisionKey(decision)) % uint64(len(c.shards)))
+}
+
+// partition returns the decisions for each program.
+func (c *CustomBouncer) partition(decisions []*models.Decision) [][]*models.Decision {
+	if len(c.shards) == 1 {
+		return [][]*models.Decision{decisions}
+	}
+
+	ret := make([][]*models.Decision, len(c.shards))
+	for _, decision := range decisions {
+		i := c.shardOf(decision)
+		ret[i] = append(ret[i], decision)
+	}
+
+	return ret
+}
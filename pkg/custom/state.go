@@ -0,0 +1,72 @@
+package custom
+
+import (
+	"sync"
+
+	"github.com/crowdsecurity/crowdsec/pkg/models"
+)
+
+// decisionState is the authoritative set of active decisions: the ones that
+// have been sent to the custom program with "add" and not deleted since.
+type decisionState struct {
+	mu sync.Mutex
+	m  map[DecisionKey]*models.Decision
+}
+
+func (s *decisionState) set(key DecisionKey, decision *models.Decision) {
+	s.mu.Lock()
+	defer s.mu.Unlock()
+
+	if s.m == nil {
+		s.m = make(map[DecisionKey]*models.Decision)
+	}
+
+	s.m[key] = decision
+}
+
+func (s *decisionState) get(key DecisionKey) *models.Decision {
+	s.mu.Lock()
+	defer s.mu.Unlock()
+
+	return s.m[key]
+}
+
+func (s *decisionState) remove(key DecisionKey) {
+	s.mu.Lock()
+	defer s.mu.Unlock()
+
+	delete(s.m, key)
+}
+
+// replace makes decisions the only active ones.
+func (s *decisionState) replace(decisions []*models.Decision) {
+	m := make(map[DecisionKey]*models.Decision, len(decisions))
+	for _, decision := range decisions {
+		m[decisionToDecisionKey(decision)] = decision
+	}
+
+	s.mu.Lock()
+	defer s.mu.Unlock()
+
+	s.m = m
+}
+
+func (s *decisionState) len() int {
+	s.mu.Lock()
+	defer s.mu.Unlock()
+
+	return len(s.m)
+}
+
+// snapshot returns a copy of the active decisions, in no particular order.
+func (s *decisionState) snapshot() []*models.Decision {
+	s.mu.Lock()
+	defer s.mu.Unlock()
+
+	ret := make([]*models.Decision, 0, len(s.m))
+	for _, decision := range s.m {
+		ret = append(ret, decision)
+	}
+
+	return ret
+}
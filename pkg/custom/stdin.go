@@ -0,0 +1,146 @@
+package custom
+
+import (
+	"bufio"
+	"errors"
+	"fmt"
+	"io"
+	"os"
+	"sync"
+	"time"
+
+	"github.com/crowdsecurity/cs-custom-bouncer/pkg/metrics"
+)
+
+// ErrStalledConsumer is returned when the custom program doesn't read its stdin.
+var ErrStalledConsumer = errors.New("custom program is not reading its stdin")
+
+// StdinWriter buffers the lines sent to the custom program. The buffer is
+// written to the program when it's full, when Flush() is called (once per
+// stream batch), or flushInterval after the first buffered line.
+//
+// If the underlying writer supports write deadlines (like the pipe created by
+// os.Pipe), a write that doesn't complete within writeTimeout fails with
+// ErrStalledConsumer and Stalled() is closed. All subsequent writes fail.
+type StdinWriter struct {
+	mu            sync.Mutex
+	buf           *bufio.Writer
+	flushInterval time.Duration
+	timer         *time.Timer
+	err           error
+	stalled       chan struct{}
+	stallOnce     sync.Once
+}
+
+func NewStdinWriter(w io.Writer, size int, flushInterval, writeTimeout time.Duration) *StdinWriter {
+	s := &StdinWriter{
+		flushInterval: flushInterval,
+		stalled:       make(chan struct{}),
+	}
+
+	dw := &deadlineWriter{w: w, timeout: writeTimeout, onStall: s.stall}
+	s.buf = bufio.NewWriterSize(dw, size)
+
+	return s
+}
+
+func (s *StdinWriter) stall() {
+	s.stallOnce.Do(func() { close(s.stalled) })
+}
+
+// fail stops the writer with err, as if a write had timed out.
+func (s *StdinWriter) fail(err error) {
+	s.mu.Lock()
+	if s.err == nil {
+		s.err = err
+	}
+	s.mu.Unlock()
+
+	s.stall()
+}
+
+// Stalled is closed when a write to the custom program has timed out, or
+// when it doesn't reply in time with stdin_ack.
+func (s *StdinWriter) Stalled() <-chan struct{} {
+	return s.stalled
+}
+
+// Err returns the error that stopped the writer, if any.
+func (s *StdinWriter) Err() error {
+	s.mu.Lock()
+	defer s.mu.Unlock()
+
+	return s.err
+}
+
+func (s *StdinWriter) Write(p []byte) (int, error) {
+	s.mu.Lock()
+	defer s.mu.Unlock()
+
+	if s.err != nil {
+		return 0, s.err
+	}
+
+	n, err := s.buf.Write(p)
+	if err != nil {
+		s.err = err
+		return n, err
+	}
+
+	if s.flushInterval > 0 && s.timer == nil && s.buf.Buffered() > 0 {
+		s.timer = time.AfterFunc(s.flushInterval, func() {
+			_ = s.Flush()
+		})
+	}
+
+	return n, nil
+}
+
+// Flush writes the buffered lines to the custom program.
+func (s *StdinWriter) Flush() error {
+	s.mu.Lock()
+	defer s.mu.Unlock()
+
+	if s.timer != nil {
+		s.timer.Stop()
+		s.timer = nil
+	}
+
+	if s.err != nil {
+		return s.err
+	}
+
+	if err := s.buf.Flush(); err != nil {
+		s.err = err
+		return err
+	}
+
+	return nil
+}
+
+type deadliner interface {
+	SetWriteDeadline(t time.Time) error
+}
+
+// deadlineWriter sets a write deadline before each write, when the writer supports it.
+type deadlineWriter struct {
+	w       io.Writer
+	timeout time.Duration
+	onStall func()
+}
+
+func (d *deadlineWriter) Write(p []byte) (int, error) {
+	if dl, ok := d.w.(deadliner); ok && d.timeout > 0 {
+		// os.ErrNoDeadline means the file is not pollable, write without a deadline
+		_ = dl.SetWriteDeadline(time.Now().Add(d.timeout))
+	}
+
+	n, err := d.w.Write(p)
+	metrics.StdinBytes.Add(float64(n))
+	if errors.Is(err, os.ErrDeadlineExceeded) {
+		d.onStall()
+		return n, fmt.Errorf("%w: write not completed after %s", ErrStalledConsumer, d.timeout)
+	}
+
+	return n, err
+}
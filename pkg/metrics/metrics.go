@@ -0,0 +1,184 @@
+package metrics
+
+import (
+	"github.com/prometheus/client_golang/prometheus"
+)
+
+var CoalescedOperations = prometheus.NewCounter(prometheus.CounterOpts{
+	Name: "custom_bouncer_coalesced_operations_total",
+	Help: "The total number of add/del operations dropped because they were redundant",
+})
+
+var ExecDuration = prometheus.NewHistogramVec(prometheus.HistogramOpts{
+	Name:    "custom_bouncer_exec_duration_seconds",
+	Help:    "Duration of the calls to the custom binary in live mode",
+	Buckets: prometheus.ExponentialBuckets(0.001, 2, 15),
+}, []string{"action"})
+
+var ExecFailures = prometheus.NewCounterVec(prometheus.CounterOpts{
+	Name: "custom_bouncer_exec_failures_total",
+	Help: "The total number of calls to the custom binary that failed in live mode",
+}, []string{"action"})
+
+var StdinBytes = prometheus.NewCounter(prometheus.CounterOpts{
+	Name: "custom_bouncer_stdin_bytes_total",
+	Help: "The total number of bytes written to the custom program in stdin mode",
+})
+
+var StdinLines = prometheus.NewCounter(prometheus.CounterOpts{
+	Name: "custom_bouncer_stdin_lines_total",
+	Help: "The total number of decisions and markers (lines, or frames in binary format) written in stdin mode",
+})
+
+var CacheHits = prometheus.NewCounter(prometheus.CounterOpts{
+	Name: "custom_bouncer_cache_hits_total",
+	Help: "The total number of decisions skipped because they have been sent recently",
+})
+
+var CacheMisses = prometheus.NewCounter(prometheus.CounterOpts{
+	Name: "custom_bouncer_cache_misses_total",
+	Help: "The total number of decisions not found in the cache",
+})
+
+var CacheSize = prometheus.NewGauge(prometheus.GaugeOpts{
+	Name: "custom_bouncer_cache_size",
+	Help: "The number of decisions in the cache",
+})
+
+var BatchSize = prometheus.NewHistogramVec(prometheus.HistogramOpts{
+	Name:    "custom_bouncer_stream_batch_size",
+	Help:    "Number of decisions in each batch received from LAPI",
+	Buckets: prometheus.ExponentialBuckets(1, 4, 10),
+}, []string{"kind"})
+
+var ChildRestarts = prometheus.NewCounter(prometheus.CounterOpts{
+	Name: "custom_bouncer_child_restarts_total",
+	Help: "The total number of times the custom program has been restarted in stdin mode",
+})
+
+var DispatchLag = prometheus.NewHistogram(prometheus.HistogramOpts{
+	Name:    "custom_bouncer_dispatch_lag_seconds",
+	Help:    "Time between the reception of a decision from LAPI and its dispatch to the custom program",
+	Buckets: prometheus.ExponentialBuckets(0.001, 2, 18),
+})
+
+var AggregatedDecisions = prometheus.NewGauge(prometheus.GaugeOpts{
+	Name: "custom_bouncer_aggregated_decisions",
+	Help: "The number of Ip and Range decisions merged by aggregate_cidrs",
+})
+
+var AggregatedPrefixes = prometheus.NewGauge(prometheus.GaugeOpts{
+	Name: "custom_bouncer_aggregated_prefixes",
+	Help: "The number of prefixes sent for the decisions merged by aggregate_cidrs",
+})
+
+var FilteredDecisions = prometheus.NewCounterVec(prometheus.CounterOpts{
+	Name: "custom_bouncer_filtered_decisions_total",
+	Help: "The total number of decisions dropped by each rule of decision_filters",
+}, []string{"rule"})
+
+var LocallyExpired = prometheus.NewCounter(prometheus.CounterOpts{
+	Name: "custom_bouncer_locally_expired_decisions_total",
+	Help: "The total number of decisions deleted by local_expiry when they expired, before LAPI",
+})
+
+var StdinAcks = prometheus.NewCounterVec(prometheus.CounterOpts{
+	Name: "custom_bouncer_stdin_replies_total",
+	Help: "The total number of replies of the custom program with stdin_ack (ack, nack), and of decisions that failed after all retries (failed)",
+}, []string{"result"})
+
+var StdinInflight = prometheus.NewGauge(prometheus.GaugeOpts{
+	Name: "custom_bouncer_stdin_inflight_decisions",
+	Help: "The number of decisions sent to the custom program and not acknowledged yet, with stdin_ack",
+})
+
+var ApplyDuration = prometheus.NewHistogram(prometheus.HistogramOpts{
+	Name:    "custom_bouncer_apply_duration_seconds",
+	Help:    "Time between the writing of a decision to the custom program and its acknowledgement, with stdin_ack",
+	Buckets: prometheus.ExponentialBuckets(0.0001, 2, 18),
+})
+
+var RetryQueueDepth = prometheus.NewGauge(prometheus.GaugeOpts{
+	Name: "custom_bouncer_retry_queue_depth",
+	Help: "The number of failed live mode commands waiting to be run again",
+})
+
+var RetryResults = prometheus.NewCounterVec(prometheus.CounterOpts{
+	Name: "custom_bouncer_retries_total",
+	Help: "The total number of live mode commands run again (success, failure), and given up after exec_retries (dead_letter)",
+}, []string{"result"})
+
+var SinkQueueDepth = prometheus.NewGaugeVec(prometheus.GaugeOpts{
+	Name: "custom_bouncer_sink_queue_depth",
+	Help: "The number of stream batches waiting to be processed by each sink",
+}, []string{"sink"})
+
+var SinkBacklog = prometheus.NewGaugeVec(prometheus.GaugeOpts{
+	Name: "custom_bouncer_sink_backlog_batches",
+	Help: "The number of stream batches waiting for room in the queue of each sink, with queue_policy=block",
+}, []string{"sink"})
+
+var SinkQueueWait = prometheus.NewHistogramVec(prometheus.HistogramOpts{
+	Name:    "custom_bouncer_sink_queue_wait_seconds",
+	Help:    "Time spent by the stream batches in the queue of each sink",
+	Buckets: prometheus.ExponentialBuckets(0.001, 2, 18),
+}, []string{"sink"})
+
+var SinkQueueDropped = prometheus.NewCounterVec(prometheus.CounterOpts{
+	Name: "custom_bouncer_sink_queue_dropped_decisions_total",
+	Help: "The total number of new decisions dropped by each sink because its queue was full, with queue_policy=drop_oldest_adds",
+}, []string{"sink"})
+
+var ExecThrottled = prometheus.NewGaugeVec(prometheus.GaugeOpts{
+	Name: "custom_bouncer_exec_throttled_commands",
+	Help: "The number of live mode commands waiting because of exec_rate_limit",
+}, []string{"action"})
+
+var ExecThrottledSeconds = prometheus.NewCounterVec(prometheus.CounterOpts{
+	Name: "custom_bouncer_exec_throttled_seconds_total",
+	Help: "The total time spent by live mode commands waiting for exec_rate_limit",
+}, []string{"action"})
+
+var RecordedBatches = prometheus.NewCounterVec(prometheus.CounterOpts{
+	Name: "custom_bouncer_recorded_batches_total",
+	Help: "The total number of stream batches written to record.file (written), or dropped because the writer was lagging behind (dropped)",
+}, []string{"result"})
+
+var LogDroppedLines = prometheus.NewCounterVec(prometheus.CounterOpts{
+	Name: "custom_bouncer_log_dropped_lines_total",
+	Help: "The total number of log lines dropped because the log_buffer_size buffer was full (buffer_full), or by the sampling of the per-decision debug lines (sampled)",
+}, []string{"reason"})
+
+// Collectors returns the metrics of the bouncer, to be registered.
+func Collectors() []prometheus.Collector {
+	return []prometheus.Collector{
+		CoalescedOperations,
+		ExecDuration,
+		ExecFailures,
+		StdinBytes,
+		StdinLines,
+		CacheHits,
+		CacheMisses,
+		CacheSize,
+		BatchSize,
+		ChildRestarts,
+		DispatchLag,
+		AggregatedDecisions,
+		AggregatedPrefixes,
+		FilteredDecisions,
+		LocallyExpired,
+		StdinAcks,
+		StdinInflight,
+		ApplyDuration,
+		RetryQueueDepth,
+		RetryResults,
+		SinkQueueDepth,
+		SinkBacklog,
+		SinkQueueWait,
+		SinkQueueDropped,
+		ExecThrottled,
+		ExecThrottledSeconds,
+		RecordedBatches,
+		LogDroppedLines,
+	}
+}